@@ -19,6 +19,13 @@ const redisClient = redis.createClient({
   database: parseInt(process.env.REDIS_DB || '0', 10),
 });
 
+// Keys shared with the Python worker (udemy_dl/worker_rq.py)
+// Jobs being downloaded are leased (sorted set: job json -> lease expiry), jobs waiting for
+// enrollment are parked (hash: task id -> job json), jobs that kept killing workers are dead-lettered
+const LEASES_KEY = 'rq:leases:downloads';
+const PARKED_JOBS_KEY = 'rq:parked:downloads';
+const DEAD_LETTER_KEY = 'rq:dead:downloads';
+
 // Connect to Redis
 redisClient.on('error', (err) => Logger.error('Redis Client Error', err));
 redisClient.on('connect', () => Logger.info('Redis Client Connected'));
@@ -98,10 +105,18 @@ const getQueueStats = async () => {
     }
 
     const queueKey = 'rq:queue:downloads';
-    const waiting = await redisClient.lLen(queueKey);
+    const [waiting, processing, parked, dead] = await Promise.all([
+      redisClient.lLen(queueKey),
+      redisClient.zCard(LEASES_KEY),
+      redisClient.hLen(PARKED_JOBS_KEY),
+      redisClient.lLen(DEAD_LETTER_KEY),
+    ]);
 
     return {
       waiting,
+      processing,
+      parked,
+      dead,
       queueName: queueKey,
     };
   } catch (error) {
@@ -111,7 +126,8 @@ const getQueueStats = async () => {
 };
 
 /**
- * Get all jobs in queue
+ * Get all jobs in queue, including the ones a worker is running and the ones parked for enrollment
+ * (task recovery must not requeue those)
  * @returns {Promise<Array>} - Array of jobs
  */
 const getAllJobs = async () => {
@@ -121,9 +137,13 @@ const getAllJobs = async () => {
     }
 
     const queueKey = 'rq:queue:downloads';
-    const jobs = await redisClient.lRange(queueKey, 0, -1);
+    const [queued, leased, parked] = await Promise.all([
+      redisClient.lRange(queueKey, 0, -1),
+      redisClient.zRange(LEASES_KEY, 0, -1),
+      redisClient.hVals(PARKED_JOBS_KEY),
+    ]);
     
-    return jobs.map(job => JSON.parse(job));
+    return [...queued, ...leased, ...parked].map(job => JSON.parse(job));
   } catch (error) {
     Logger.error('Failed to get jobs', error);
     throw error;
@@ -139,8 +139,8 @@ const triggerAdminDownload = async (courseId, email = null) => {
         if (!result || !result.success) {
           // ✅ FIX: For admin downloads, enrollment failure is not fatal
           // The course might already be enrolled, or enrollment might fail due to cookie/auth issues
-          // Keep status as 'processing' so worker can attempt download anyway
-          // enroll.service.js will keep status as 'processing' for admin downloads (not set to 'failed')
+          // enroll.service.js marks the task 'failed', the worker sees it as an admin task
+          // (failed_but_admin) and attempts the download anyway - course might already be enrolled
           Logger.warn('[AdminDownload] Enrollment failed, but continuing with download', {
             taskId: task.id,
             courseId: course.id,
@@ -148,22 +148,6 @@ const triggerAdminDownload = async (courseId, email = null) => {
             status: result ? result.status : 'unknown',
             note: 'Worker will attempt download - course might already be enrolled'
           });
-          
-          // Verify task status is still 'processing' (enroll service should keep it as 'processing' for admin)
-          const taskStatus = await DownloadTask.findByPk(task.id, {
-            attributes: ['id', 'status']
-          });
-          
-          if (taskStatus && taskStatus.status === 'failed') {
-            // If somehow status was set to 'failed', reset to 'processing'
-            Logger.warn('[AdminDownload] Task status was set to failed, resetting to processing', {
-              taskId: task.id
-            });
-            await DownloadTask.update(
-              { status: 'processing' },
-              { where: { id: task.id } }
-            );
-          }
         } else {
           // Update task status to enrolled
           await DownloadTask.update(
@@ -187,20 +171,12 @@ const triggerAdminDownload = async (courseId, email = null) => {
           note: 'Worker will attempt download - course might already be enrolled'
         });
         
-        // Ensure task status is 'processing' (not 'failed')
-        const taskStatus = await DownloadTask.findByPk(task.id, {
-          attributes: ['id', 'status']
-        });
-        
-        if (taskStatus && taskStatus.status === 'failed') {
-          Logger.warn('[AdminDownload] Task status was set to failed after enrollment error, resetting to processing', {
-            taskId: task.id
-          });
-          await DownloadTask.update(
-            { status: 'processing', error_log: enrollError.message },
-            { where: { id: task.id } }
-          );
-        }
+        // Mark the task 'failed' so the worker doesn't wait for the enrollment to finish,
+        // it attempts the download anyway for admin tasks (failed_but_admin)
+        await DownloadTask.update(
+          { status: 'failed', error_log: enrollError.message },
+          { where: { id: task.id } }
+        );
       }
     } else {
       // Non-Udemy course, skip enrollment and set status to 'enrolled' directly
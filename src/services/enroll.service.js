@@ -10,6 +10,7 @@ const { transformToNormalizeUdemyCourseUrl, transformToSamsungUdemy } = require(
 const DownloadTask = require('../models/downloadTask.model');
 const Logger = require('../utils/logger.util');
 const lifecycleLogger = require('./lifecycleLogger.service');
+const { publishTaskStatusChange } = require('./progress.service');
 const { Op } = require('sequelize');
 
 // --- CẤU HÌNH ---
@@ -468,6 +469,9 @@ const enrollCourses = async (urls, email, orderId = null) => {
                 orderId: updatedTask.order_id
             });
 
+            // ✅ Wake the download job parked by the Python worker (it listens on task:{id}:status)
+            await publishTaskStatusChange(task.id, updatedTask.order_id, finalStatus, 'processing', 'Enrollment finished');
+
             // ✅ FIX: LIFECYCLE LOG - Only log SUCCESS after DB verification
             // CRITICAL: Only log if status is actually 'enrolled' in database
             if (isSuccess && updatedTask.status === 'enrolled') {
@@ -613,22 +617,21 @@ const enrollCourses = async (urls, email, orderId = null) => {
             }
 
             // Cập nhật trạng thái failed vào DB để không bị treo pending
-            // ✅ FIX: For admin downloads, keep status as 'processing' instead of 'failed'
+            // ✅ FIX: Admin downloads are marked 'failed' too, the worker sees course_type='permanent'
+            // without an order and still attempts the download (the course may already be enrolled)
             // Only update if we have a task ID, otherwise update by email and URL
             try {
                 if (taskId) {
                     // Update specific task by ID
                     if (isAdminDownload) {
-                        // Keep status as 'processing' for admin downloads
-                        // Worker will check course_type and allow download even if enrollment failed
                         await DownloadTask.update(
-                            { error_log: err.message },
+                            { status: 'failed', error_log: err.message },
                             {
                                 where: { id: taskId },
-                                fields: ['error_log']
+                                fields: ['status', 'error_log']
                             }
                         );
-                        Logger.info('Admin download enrollment failed, kept status as processing', {
+                        Logger.info('Admin download enrollment failed, worker will attempt the download anyway', {
                             taskId: taskId,
                             error: err.message
                         });
@@ -644,32 +647,21 @@ const enrollCourses = async (urls, email, orderId = null) => {
                     }
                 } else {
                     // Fallback: Update by email and URL (for cases where task wasn't found)
-                    // Check if it's admin download by querying task
+                    // Admin downloads are marked 'failed' as well, see above
                     const fallbackTask = await DownloadTask.findOne({
                         where: { email, course_url: rawUrl },
-                        attributes: ['id', 'course_type', 'order_id'],
+                        attributes: ['id'],
                         order: [['id', 'DESC']]
                     });
                     
                     if (fallbackTask) {
-                        const isFallbackAdmin = fallbackTask.course_type === 'permanent' && fallbackTask.order_id === null;
-                        if (isFallbackAdmin) {
-                            await DownloadTask.update(
-                                { error_log: err.message },
-                                {
-                                    where: { email, course_url: rawUrl },
-                                    fields: ['error_log']
-                                }
-                            );
-                        } else {
-                            await DownloadTask.update(
-                                { status: 'failed', error_log: err.message },
-                                {
-                                    where: { email, course_url: rawUrl },
-                                    fields: ['status', 'error_log']
-                                }
-                            );
-                        }
+                        await DownloadTask.update(
+                            { status: 'failed', error_log: err.message },
+                            {
+                                where: { email, course_url: rawUrl },
+                                fields: ['status', 'error_log']
+                            }
+                        );
                     } else {
                         // No task found, can't update
                         Logger.warn('No task found to update enrollment failure', { email, url: rawUrl });
@@ -679,6 +671,12 @@ const enrollCourses = async (urls, email, orderId = null) => {
                 Logger.error('Failed to update task status after enrollment failure', e, { email, url: rawUrl, taskId: taskId, isAdminDownload });
             }
 
+            // ✅ Wake the parked download job: it fails, or for admin downloads (status 'failed',
+            // permanent, no order) the worker attempts the download anyway
+            if (taskId) {
+                await publishTaskStatusChange(taskId, null, 'failed', 'processing', err.message);
+            }
+
             results.push({
                 success: false,
                 url: rawUrl,
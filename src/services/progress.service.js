@@ -146,10 +146,11 @@ const publishTaskProgress = async (taskId, progressData) => {
  */
 const publishTaskStatusChange = async (taskId, orderId, newStatus, previousStatus = null, message = null) => {
   try {
-    const channels = [
-      `task:${taskId}:status`,
-      `order:${orderId}:status`
-    ];
+    const channels = [`task:${taskId}:status`];
+    // Admin downloads have no order
+    if (orderId) {
+      channels.push(`order:${orderId}:status`);
+    }
 
     const payload = JSON.stringify({
       taskId,
@@ -0,0 +1,290 @@
+"""
+Aria2 RPC
+Runs a single `aria2c --enable-rpc` daemon per worker process and submits
+downloads to it over JSON-RPC, instead of spawning aria2c for every file
+Downloads are submitted in batches (system.multicall) and tracked by GID, the
+daemon is restarted (and unfinished downloads resubmitted) if it dies.
+"""
+
+import atexit
+import logging
+import os
+import secrets
+import socket
+import subprocess
+import threading
+import time
+
+import requests
+
+logger = logging.getLogger("udemy-downloader")
+
+ARIA2_MAX_CONCURRENT = int(os.getenv("ARIA2_MAX_CONCURRENT", 16))
+ARIA2_START_TIMEOUT = 10
+ARIA2_POLL_INTERVAL = 0.5
+ARIA2_MAX_RESTARTS = 3
+
+# per download options, same as the old `aria2c -s20 -x16 -c` command line
+DOWNLOAD_OPTIONS = {
+    "split": "20",
+    "max-connection-per-server": "16",
+    "continue": "true",
+    "auto-file-renaming": "false",
+    "allow-overwrite": "false",
+    "follow-torrent": "false",
+}
+STATUS_KEYS = ["gid", "status", "errorCode", "errorMessage", "completedLength", "totalLength"]
+
+
+class Aria2Error(Exception):
+    pass
+
+
+class Aria2Daemon:
+    def __init__(self, max_concurrent=ARIA2_MAX_CONCURRENT):
+        self.max_concurrent = max_concurrent
+        self.process = None
+        self.port = None
+        self._secret = secrets.token_hex(16)
+        self._session = requests.Session()
+        self._lock = threading.Lock()
+        self._generation = 0  # bumped on every (re)start, gids of older generations are gone
+        self.download_limit = 0
+
+    @staticmethod
+    def _free_port():
+        with socket.socket(socket.AF_INET, socket.SOCK_STREAM) as sock:
+            sock.bind(("127.0.0.1", 0))
+            return sock.getsockname()[1]
+
+    def _start(self):
+        self.port = self._free_port()
+        args = [
+            "aria2c",
+            "--enable-rpc",
+            "--rpc-listen-all=false",
+            f"--rpc-listen-port={self.port}",
+            f"--rpc-secret={self._secret}",
+            f"--max-concurrent-downloads={self.max_concurrent}",
+            f"--max-overall-download-limit={self.download_limit}",
+            "--disable-ipv6",
+            "--summary-interval=0",
+            "--console-log-level=warn",
+            # don't outlive the process that started it, even if it exits without running atexit
+            f"--stop-with-process={os.getpid()}",
+        ]
+        self.process = subprocess.Popen(args, stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
+        deadline = time.time() + ARIA2_START_TIMEOUT
+        while time.time() < deadline:
+            if self.process.poll() is not None:
+                raise Aria2Error(f"aria2c exited with code {self.process.returncode}")
+            try:
+                version = self._call("aria2.getVersion")
+                self._generation += 1
+                logger.debug(f"aria2c {version.get('version')} RPC daemon listening on port {self.port}")
+                return
+            except (requests.RequestException, Aria2Error):
+                time.sleep(0.1)
+        self._stop()
+        raise Aria2Error("aria2c RPC daemon did not start in time")
+
+    def _stop(self):
+        if self.process is None:
+            return
+        if self.process.poll() is None:
+            self.process.terminate()
+            try:
+                self.process.wait(timeout=5)
+            except subprocess.TimeoutExpired:
+                self.process.kill()
+        self.process = None
+
+    def is_running(self):
+        return self.process is not None and self.process.poll() is None
+
+    def ensure_running(self):
+        """Start the daemon, or restart it if it died"""
+        with self._lock:
+            if self.is_running():
+                return self._generation
+            if self.process is not None:
+                logger.warning(f"aria2c RPC daemon died (exit code {self.process.returncode}), restarting it")
+                self.process = None
+            self._start()
+            return self._generation
+
+    def _call(self, method, *params):
+        payload = {"jsonrpc": "2.0", "id": "udemy-dl", "method": method, "params": [f"token:{self._secret}", *params]}
+        resp = self._session.post(f"http://127.0.0.1:{self.port}/jsonrpc", json=payload, timeout=10)
+        data = resp.json()
+        if "error" in data:
+            raise Aria2Error(data["error"].get("message"))
+        return data.get("result")
+
+    def _multicall(self, calls):
+        """
+        Args:
+            calls (list): (method, params) tuples
+
+        Returns:
+            list: Per call, the result or an Aria2Error
+        """
+        if not calls:
+            return []
+        payload = {
+            "jsonrpc": "2.0",
+            "id": "udemy-dl",
+            "method": "system.multicall",
+            "params": [
+                [{"methodName": method, "params": [f"token:{self._secret}", *params]} for method, params in calls]
+            ],
+        }
+        resp = self._session.post(f"http://127.0.0.1:{self.port}/jsonrpc", json=payload, timeout=30)
+        data = resp.json()
+        if "error" in data:
+            raise Aria2Error(data["error"].get("message"))
+        # each result is wrapped in a list, failures are a fault dict
+        return [r[0] if isinstance(r, list) else Aria2Error(r.get("faultString")) for r in data["result"]]
+
+    def _submit(self, items):
+        calls = [
+            ("aria2.addUri", [[url], {**DOWNLOAD_OPTIONS, "dir": file_dir, "out": filename}])
+            for url, file_dir, filename in items
+        ]
+        return self._multicall(calls)
+
+    def download_many(self, items):
+        """
+        Download several files and wait for all of them
+
+        Args:
+            items (list): (url, file_dir, filename) tuples
+
+        Returns:
+            list: Per item, None on success or the error message
+        """
+        results = [None] * len(items)
+        remaining = list(range(len(items)))
+        restarts = 0
+
+        while remaining:
+            generation = self.ensure_running()
+            try:
+                submitted = self._submit([items[i] for i in remaining])
+                gids = {}
+                for i, gid in zip(remaining, submitted):
+                    if isinstance(gid, Aria2Error):
+                        results[i] = str(gid)
+                    else:
+                        gids[gid] = i
+                self._wait(gids, results)
+                remaining = []
+            except requests.RequestException as e:
+                # the daemon is gone, resubmit what didn't finish (aria2 continues partial files)
+                restarts += 1
+                if restarts > ARIA2_MAX_RESTARTS:
+                    raise Aria2Error(f"aria2c RPC daemon keeps failing: {e}")
+                with self._lock:
+                    # another thread may have restarted it already
+                    if self._generation == generation and self.is_running():
+                        logger.warning(f"aria2c RPC daemon is not responding ({e}), restarting it")
+                        self._stop()
+                remaining = [i for i in remaining if results[i] is None and not self._is_complete(items[i])]
+        return results
+
+    @staticmethod
+    def _is_complete(item):
+        _, file_dir, filename = item
+        path = os.path.join(file_dir, filename)
+        return os.path.isfile(path) and not os.path.isfile(path + ".aria2")
+
+    def _wait(self, gids, results):
+        """Poll the status of `gids` until they are all finished, fills in `results`"""
+        total = len(gids)
+        while gids:
+            time.sleep(ARIA2_POLL_INTERVAL)
+            pending = list(gids)
+            statuses = self._multicall([("aria2.tellStatus", [gid, STATUS_KEYS]) for gid in pending])
+            finished = []
+            for gid, status in zip(pending, statuses):
+                if isinstance(status, Aria2Error):
+                    results[gids[gid]] = str(status)
+                    finished.append(gid)
+                elif status["status"] == "complete":
+                    finished.append(gid)
+                elif status["status"] in ("error", "removed"):
+                    results[gids[gid]] = f"{status.get('errorCode')} {status.get('errorMessage')}"
+                    finished.append(gid)
+            if finished:
+                for gid in finished:
+                    del gids[gid]
+                self._multicall([("aria2.removeDownloadResult", [gid]) for gid in finished])
+                logger.debug(f"aria2: {total - len(gids)}/{total} download(s) finished")
+
+    def set_download_limit(self, bytes_per_second):
+        """Limit the overall download speed of the daemon, None or 0 for unlimited"""
+        self.download_limit = int(bytes_per_second or 0)
+        if self.is_running():
+            self._call("aria2.changeGlobalOption", {"max-overall-download-limit": str(self.download_limit)})
+
+    def download(self, url, file_dir, filename):
+        """Download a single file, raises if it failed"""
+        error = self.download_many([(url, file_dir, filename)])[0]
+        if error:
+            raise Aria2Error(f"Download of {filename} failed: {error}")
+        return 0
+
+    def shutdown(self):
+        with self._lock:
+            if self.is_running():
+                try:
+                    self._call("aria2.shutdown")
+                    self.process.wait(timeout=5)
+                except Exception:
+                    pass
+            self._stop()
+
+
+# Global instance
+_aria2_daemon = None
+_aria2_daemon_lock = threading.Lock()
+_download_limit = 0
+
+
+def get_aria2_daemon():
+    """Get or create global aria2 daemon instance, None if it can't be started"""
+    global _aria2_daemon
+    with _aria2_daemon_lock:
+        if _aria2_daemon is None:
+            daemon = Aria2Daemon()
+            daemon.download_limit = _download_limit
+            try:
+                daemon.ensure_running()
+            except (OSError, Aria2Error) as e:
+                logger.warning(f"aria2c RPC daemon unavailable, spawning aria2c per file: {e}")
+                return None
+            atexit.register(daemon.shutdown)
+            _aria2_daemon = daemon
+    return _aria2_daemon
+
+
+def set_download_limit(bytes_per_second):
+    """
+    Limit the overall download speed of the global daemon, None or 0 for unlimited
+    Doesn't start the daemon, the limit is applied when it is started
+    """
+    global _download_limit
+    with _aria2_daemon_lock:
+        _download_limit = int(bytes_per_second or 0)
+        daemon = _aria2_daemon
+    if daemon:
+        daemon.set_download_limit(_download_limit)
+
+
+def shutdown_aria2_daemon():
+    """Stop the global daemon, for processes that exit without running atexit (forkserver children)"""
+    global _aria2_daemon
+    with _aria2_daemon_lock:
+        daemon, _aria2_daemon = _aria2_daemon, None
+    if daemon:
+        daemon.shutdown()
@@ -0,0 +1,286 @@
+"""
+Asset Cache
+Content-addressed store of downloaded assets and captions, shared by every course on this host
+Entries are keyed by the Udemy asset id and the path of the download url (the
+query string is a signature that changes on every request). The files are
+stored once per content hash and hardlinked (or reflinked, or copied when
+neither works) into the chapter directories. The store is kept under a disk
+quota with LRU eviction. Safe to share between worker processes.
+"""
+
+import hashlib
+import logging
+import os
+import shutil
+import sqlite3
+import threading
+import time
+import uuid
+from urllib.parse import urlparse
+
+import requests
+
+from constants import SAVED_DIR
+from journal import file_checksum
+
+logger = logging.getLogger("udemy-downloader")
+
+ASSET_CACHE_DIR = os.getenv("ASSET_CACHE_DIR", os.path.join(SAVED_DIR, "asset_cache"))
+ASSET_CACHE_MAX_BYTES = int(os.getenv("ASSET_CACHE_MAX_BYTES", 20 * 1024 * 1024 * 1024))
+ASSET_CACHE_ENABLED = os.getenv("ASSET_CACHE_ENABLED", "true").lower() == "true"
+
+FICLONE = 0x40049409  # linux ioctl, copy-on-write clone of a whole file
+
+
+def _reflink(src, dst):
+    import fcntl
+
+    with open(src, "rb") as s, open(dst, "wb") as d:
+        fcntl.ioctl(d.fileno(), FICLONE, s.fileno())
+
+
+def place_file(src, dst):
+    """
+    Put a copy of `src` at `dst`, sharing the data if the filesystem allows it
+
+    Returns:
+        str: How it was placed, "hardlink", "reflink" or "copy"
+    """
+    tmp = f"{dst}.{uuid.uuid4().hex[:8]}.tmp"
+    try:
+        try:
+            os.link(src, tmp)
+            method = "hardlink"
+        except OSError:
+            try:
+                _reflink(src, tmp)
+                method = "reflink"
+            except (OSError, ImportError):
+                shutil.copyfile(src, tmp)
+                method = "copy"
+        os.replace(tmp, dst)
+    except BaseException:
+        try:
+            os.unlink(tmp)
+        except OSError:
+            pass
+        raise
+    return method
+
+
+class AssetCache:
+    def __init__(self, root=ASSET_CACHE_DIR, max_bytes=ASSET_CACHE_MAX_BYTES):
+        self.root = root
+        self.max_bytes = max_bytes
+        self.path = os.path.join(root, "index.db")
+        self._local = threading.local()
+        self._lock = threading.Lock()
+        self.stats = {"hits": 0, "misses": 0, "stale": 0, "stored": 0, "bytes_saved": 0}
+        os.makedirs(os.path.join(root, "blobs"), exist_ok=True)
+        conn = self._connect()
+        with conn:
+            conn.execute(
+                "CREATE TABLE IF NOT EXISTS entries ("
+                "cache_key TEXT PRIMARY KEY, kind TEXT NOT NULL, asset_id TEXT, url_path TEXT NOT NULL, "
+                "blob TEXT NOT NULL, size INTEGER NOT NULL, etag TEXT, stored_at REAL NOT NULL, last_access REAL NOT NULL)"
+            )
+            conn.execute("CREATE INDEX IF NOT EXISTS entries_last_access ON entries (last_access)")
+            conn.execute("CREATE INDEX IF NOT EXISTS entries_blob ON entries (blob)")
+            conn.execute("CREATE TABLE IF NOT EXISTS counters (name TEXT PRIMARY KEY, value INTEGER NOT NULL)")
+
+    def _connect(self):
+        """Returns a per-thread connection"""
+        conn = getattr(self._local, "conn", None)
+        if conn is None:
+            conn = sqlite3.connect(self.path, timeout=30)
+            conn.execute("PRAGMA journal_mode=WAL")
+            conn.execute("PRAGMA synchronous=NORMAL")
+            self._local.conn = conn
+        return conn
+
+    @staticmethod
+    def make_key(kind, asset_id, url):
+        key = f"{kind}\0{asset_id or ''}\0{urlparse(url).path}"
+        return hashlib.sha256(key.encode("utf-8")).hexdigest()
+
+    def _blob_path(self, blob):
+        return os.path.join(self.root, "blobs", blob[:2], blob)
+
+    def _count(self, name, value=1):
+        with self._lock:
+            self.stats[name] += value
+        try:
+            conn = self._connect()
+            with conn:
+                conn.execute(
+                    "INSERT INTO counters (name, value) VALUES (?, ?) "
+                    "ON CONFLICT(name) DO UPDATE SET value = value + excluded.value",
+                    (name, value),
+                )
+        except sqlite3.Error as e:
+            logger.debug(f"Asset cache counter update failed: {e}")
+
+    @staticmethod
+    def _remote_fingerprint(url):
+        """(size, etag) of the remote file from a HEAD request, None if it couldn't be asked"""
+        try:
+            resp = requests.head(url, allow_redirects=True, timeout=10)
+        except requests.RequestException:
+            return None
+        if not resp.ok:
+            return None
+        size = resp.headers.get("Content-Length")
+        return (int(size) if size and size.isdigit() else None), resp.headers.get("ETag")
+
+    def fetch(self, kind, asset_id, url, dest, verify=True):
+        """
+        Place a cached copy of an asset at `dest`
+
+        Args:
+            verify (bool): Compare the size / etag of the cached copy with a HEAD request first
+
+        Returns:
+            bool: True if `dest` was served from the cache
+        """
+        cache_key = self.make_key(kind, asset_id, url)
+        try:
+            row = (
+                self._connect()
+                .execute("SELECT blob, size, etag FROM entries WHERE cache_key = ?", (cache_key,))
+                .fetchone()
+            )
+        except sqlite3.Error as e:
+            logger.warning(f"Asset cache read failed: {e}")
+            return False
+        blob_path = self._blob_path(row[0]) if row else None
+        if row is None or not os.path.isfile(blob_path) or os.path.getsize(blob_path) != row[1]:
+            self._count("misses")
+            return False
+
+        blob, size, etag = row
+        if verify:
+            # if the remote can't be asked, the asset id and path are trusted
+            remote = self._remote_fingerprint(url)
+            if remote is not None:
+                remote_size, remote_etag = remote
+                if (remote_size is not None and remote_size != size) or (etag and remote_etag and remote_etag != etag):
+                    logger.debug(f"Asset cache entry for {os.path.basename(dest)} is stale")
+                    self._count("stale")
+                    self._drop(cache_key)
+                    return False
+                if remote_etag and not etag:
+                    etag = remote_etag
+
+        try:
+            method = place_file(blob_path, dest)
+            with self._connect() as conn:
+                conn.execute(
+                    "UPDATE entries SET last_access = ?, etag = ? WHERE cache_key = ?", (time.time(), etag, cache_key)
+                )
+        except (OSError, sqlite3.Error) as e:
+            logger.warning(f"Failed to place cached asset {os.path.basename(dest)}: {e}")
+            self._count("misses")
+            return False
+        logger.debug(f"Asset cache hit ({method}): {os.path.basename(dest)}")
+        self._count("hits")
+        self._count("bytes_saved", size)
+        return True
+
+    def store(self, kind, asset_id, url, path):
+        """Add a downloaded file to the cache, files bigger than the quota are left out"""
+        try:
+            size = os.path.getsize(path)
+            if size > self.max_bytes:
+                return
+            blob = file_checksum(path)
+            blob_path = self._blob_path(blob)
+            if not os.path.isfile(blob_path):
+                os.makedirs(os.path.dirname(blob_path), exist_ok=True)
+                place_file(path, blob_path)
+            now = time.time()
+            with self._connect() as conn:
+                conn.execute(
+                    "INSERT OR REPLACE INTO entries (cache_key, kind, asset_id, url_path, blob, size, etag, stored_at, last_access) "
+                    "VALUES (?, ?, ?, ?, ?, ?, NULL, ?, ?)",
+                    (
+                        self.make_key(kind, asset_id, url),
+                        kind,
+                        str(asset_id) if asset_id is not None else None,
+                        urlparse(url).path,
+                        blob,
+                        size,
+                        now,
+                        now,
+                    ),
+                )
+            self._count("stored")
+            self._evict()
+        except (OSError, sqlite3.Error) as e:
+            logger.warning(f"Asset cache write failed: {e}")
+
+    def _drop(self, cache_key):
+        try:
+            conn = self._connect()
+            with conn:
+                row = conn.execute("SELECT blob FROM entries WHERE cache_key = ?", (cache_key,)).fetchone()
+                conn.execute("DELETE FROM entries WHERE cache_key = ?", (cache_key,))
+            if row:
+                self._remove_unreferenced_blob(row[0])
+        except sqlite3.Error as e:
+            logger.warning(f"Asset cache write failed: {e}")
+
+    def _remove_unreferenced_blob(self, blob):
+        """Returns True if the blob was removed"""
+        if self._connect().execute("SELECT 1 FROM entries WHERE blob = ? LIMIT 1", (blob,)).fetchone():
+            return False
+        try:
+            os.unlink(self._blob_path(blob))
+        except OSError:
+            pass
+        return True
+
+    def _evict(self):
+        """Drop least recently used entries until the blobs are back under the quota"""
+        conn = self._connect()
+        total = conn.execute(
+            "SELECT COALESCE(SUM(size), 0) FROM (SELECT blob, MAX(size) AS size FROM entries GROUP BY blob)"
+        ).fetchone()[0]
+        if total <= self.max_bytes:
+            return
+        target = int(self.max_bytes * 0.9)
+        for cache_key, blob, size in conn.execute(
+            "SELECT cache_key, blob, size FROM entries ORDER BY last_access ASC"
+        ).fetchall():
+            if total <= target:
+                break
+            with conn:
+                conn.execute("DELETE FROM entries WHERE cache_key = ?", (cache_key,))
+            # a blob shared by several entries only frees space once the last of them is gone
+            if self._remove_unreferenced_blob(blob):
+                total -= size
+        logger.debug(f"Asset cache evicted down to {total} bytes")
+
+    def totals(self):
+        """Hit / miss counters of every process that used this cache"""
+        try:
+            return dict(self._connect().execute("SELECT name, value FROM counters").fetchall())
+        except sqlite3.Error:
+            return {}
+
+
+# Global instance
+_asset_cache = None
+_asset_cache_lock = threading.Lock()
+
+
+def get_asset_cache():
+    """Get or create global asset cache instance, None if caching is disabled"""
+    global _asset_cache
+    with _asset_cache_lock:
+        if _asset_cache is None and ASSET_CACHE_ENABLED:
+            try:
+                _asset_cache = AssetCache()
+            except (sqlite3.Error, OSError) as e:
+                logger.warning(f"Asset cache unavailable, continuing without it: {e}")
+                return None
+    return _asset_cache
@@ -0,0 +1,226 @@
+"""
+Bandwidth Budget
+Host-wide connection and bandwidth budget shared by every worker through Redis
+
+Each running stage (a download or an rclone upload) holds a lease. The budget
+is split between the live leases: connection slots are water-filled up to what
+each lease asked for, bytes/sec are split evenly between the leases of a stage,
+and uploads always get at least BUDGET_UPLOAD_SHARE of the bandwidth so rclone
+isn't starved by the downloads. Leases expire unless refreshed, so a crashed
+worker gives its share back after BUDGET_LEASE_TTL seconds.
+
+Without Redis every lease gets what it asked for and no rate limit.
+"""
+
+import json
+import logging
+import os
+import threading
+import time
+import uuid
+
+import redis
+
+logger = logging.getLogger("udemy-downloader")
+
+BUDGET_MAX_BPS = int(os.getenv("BUDGET_MAX_BPS", 0))  # bytes/sec for the whole host, 0 = unlimited
+BUDGET_MAX_CONNECTIONS = int(os.getenv("BUDGET_MAX_CONNECTIONS", 200))
+BUDGET_UPLOAD_SHARE = float(os.getenv("BUDGET_UPLOAD_SHARE", 0.3))  # guaranteed to uploads when they run
+BUDGET_LEASE_TTL = int(os.getenv("BUDGET_LEASE_TTL", 60))
+BUDGET_REFRESH_INTERVAL = 15
+
+BUDGET_KEY = "budget:leases"
+
+STAGE_DOWNLOAD = "download"
+STAGE_UPLOAD = "upload"
+
+
+def compute_shares(
+    leases, max_bps=BUDGET_MAX_BPS, max_connections=BUDGET_MAX_CONNECTIONS, upload_share=BUDGET_UPLOAD_SHARE
+):
+    """
+    Split the budget between leases
+
+    Args:
+        leases (dict): lease id -> {"stage": ..., "connections": wanted connections}
+
+    Returns:
+        dict: lease id -> (connections, bytes per second or None for unlimited)
+    """
+    if not leases:
+        return {}
+
+    # connections: water-filling, small requests are served in full and the rest is split evenly
+    connections = {}
+    remaining = max_connections
+    pending = sorted(leases.items(), key=lambda item: item[1]["connections"])
+    for i, (lease_id, lease) in enumerate(pending):
+        fair = remaining // (len(pending) - i)
+        connections[lease_id] = max(1, min(lease["connections"], fair))
+        remaining -= connections[lease_id]
+
+    rates = {lease_id: None for lease_id in leases}
+    if max_bps > 0:
+        uploads = [lease_id for lease_id, lease in leases.items() if lease["stage"] == STAGE_UPLOAD]
+        downloads = [lease_id for lease_id in leases if lease_id not in uploads]
+        if uploads and downloads:
+            upload_bps = max(max_bps * upload_share, max_bps * len(uploads) / len(leases))
+        elif uploads:
+            upload_bps = max_bps
+        else:
+            upload_bps = 0
+        for lease_id in uploads:
+            rates[lease_id] = int(upload_bps / len(uploads))
+        for lease_id in downloads:
+            rates[lease_id] = int((max_bps - upload_bps) / len(downloads))
+
+    return {lease_id: (connections[lease_id], rates[lease_id]) for lease_id in leases}
+
+
+class Lease:
+    """
+    A share of the budget
+
+    `connections` and `rate` (bytes/sec, None = unlimited) are updated by
+    refresh(), which runs in the background every BUDGET_REFRESH_INTERVAL
+    seconds; on_change(lease) is called when the share changes.
+    """
+
+    def __init__(self, budget, stage, task_id, connections, on_change=None):
+        self.budget = budget
+        self.id = f"{stage}:{task_id}:{uuid.uuid4().hex[:8]}"
+        self.stage = stage
+        self.task_id = task_id
+        self.wanted_connections = connections
+        self.connections = connections
+        self.rate = None
+        self.on_change = on_change
+        self._stop = threading.Event()
+        self._thread = None
+
+    def refresh(self, notify=True):
+        share = self.budget._refresh(self)
+        if share is None:
+            return
+        changed = share != (self.connections, self.rate)
+        self.connections, self.rate = share
+        if changed and notify and self.on_change:
+            try:
+                self.on_change(self)
+            except Exception as e:
+                logger.debug(f"Budget change callback failed: {e}")
+
+    def _run(self):
+        while not self._stop.wait(BUDGET_REFRESH_INTERVAL):
+            self.refresh()
+
+    def start(self):
+        self.refresh(notify=False)
+        self._thread = threading.Thread(target=self._run, name=f"budget-{self.stage}", daemon=True)
+        self._thread.start()
+        return self
+
+    def release(self):
+        self._stop.set()
+        self.budget._release(self)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_val, exc_tb):
+        self.release()
+
+    def __repr__(self):
+        rate = f"{self.rate / 1024 / 1024:.1f} MiB/s" if self.rate else "unlimited"
+        return f"<Lease {self.stage} task={self.task_id} connections={self.connections} rate={rate}>"
+
+
+class BandwidthBudget:
+    def __init__(self):
+        self.redis_client = None
+        try:
+            redis_password = os.getenv("REDIS_PASSWORD", None)
+            client = redis.Redis(
+                host=os.getenv("REDIS_HOST", "localhost"),
+                port=int(os.getenv("REDIS_PORT", 6379)),
+                password=redis_password if redis_password else None,
+                db=int(os.getenv("REDIS_DB", 0)),
+                decode_responses=True,
+                socket_connect_timeout=2,
+                socket_timeout=2,
+            )
+            client.ping()
+            self.redis_client = client
+        except Exception as e:
+            logger.debug(f"Bandwidth budget is not shared between workers, Redis unavailable: {e}")
+
+    def acquire(self, stage, task_id, connections, on_change=None):
+        """
+        Take a lease for a stage of a task
+
+        Args:
+            stage (str): STAGE_DOWNLOAD or STAGE_UPLOAD
+            task_id: The task the lease is for (only used for bookkeeping)
+            connections (int): How many connections the stage would like to open
+            on_change (callable, optional): Called with the lease when its share changes
+
+        Returns:
+            Lease: Already refreshed (on_change isn't called for the initial share), kept alive until release()
+        """
+        lease = Lease(self, stage, task_id, connections, on_change)
+        return lease.start()
+
+    def _refresh(self, lease):
+        """Re-register a lease and return its current share, None if Redis isn't available"""
+        if not self.redis_client:
+            return None
+        now = time.time()
+        try:
+            self.redis_client.hset(
+                BUDGET_KEY,
+                lease.id,
+                json.dumps(
+                    {
+                        "stage": lease.stage,
+                        "task_id": lease.task_id,
+                        "connections": lease.wanted_connections,
+                        "expires_at": now + BUDGET_LEASE_TTL,
+                    }
+                ),
+            )
+            leases = {}
+            expired = []
+            for lease_id, raw in self.redis_client.hgetall(BUDGET_KEY).items():
+                data = json.loads(raw)
+                if data.get("expires_at", 0) < now:
+                    expired.append(lease_id)
+                else:
+                    leases[lease_id] = data
+            if expired:
+                self.redis_client.hdel(BUDGET_KEY, *expired)
+        except (redis.RedisError, ValueError) as e:
+            logger.debug(f"Bandwidth budget refresh failed, keeping the current share: {e}")
+            return None
+        return compute_shares(leases).get(lease.id)
+
+    def _release(self, lease):
+        if not self.redis_client:
+            return
+        try:
+            self.redis_client.hdel(BUDGET_KEY, lease.id)
+        except redis.RedisError as e:
+            logger.debug(f"Failed to release bandwidth lease: {e}")
+
+
+# Global instance
+_budget = None
+_budget_lock = threading.Lock()
+
+
+def get_budget():
+    """Get or create global bandwidth budget instance"""
+    global _budget
+    with _budget_lock:
+        if _budget is None:
+            _budget = BandwidthBudget()
+    return _budget
@@ -107,11 +107,16 @@ CURRICULUM_ITEMS_PARAMS = {
     "fields[quiz]": "title,object_index,type",
     "fields[practice]": "title,object_index",
     "fields[chapter]": "title,object_index",
-    "fields[asset]": "title,filename,asset_type,status,is_external,media_license_token,course_is_drmed,media_sources,captions,slides,slide_urls,download_urls,external_url,stream_urls,@min,status,delayed_asset_message,processing_errors,body",
+    "fields[asset]": "title,filename,asset_type,status,is_external,media_license_token,course_is_drmed,media_sources,captions,slides,slide_urls,download_urls,external_url,stream_urls,@min,status,delayed_asset_message,processing_errors,body,time_estimation",
     "caching_intent": True,
     "page_size": "200",
 }
 
+# max number of concurrent API requests (page fan-out, prefetching, etc.)
+API_MAX_WORKERS = 5
+# attempts per page when walking paginated results one page at a time
+PAGE_MAX_ATTEMPTS = 3
+
 COURSE_URL_PARAMS = {
     "fields[course]": "title",
     "use_remote_version": True,
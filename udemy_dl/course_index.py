@@ -0,0 +1,145 @@
+"""
+Course Index
+Persistent slug -> course id lookup shared by all workers (SQLite)
+Lets the downloader resolve a course without enumerating every subscribed course
+"""
+
+import json
+import logging
+import os
+import sqlite3
+import threading
+import time
+
+from constants import SAVED_DIR
+
+logger = logging.getLogger("udemy-downloader")
+
+COURSE_INDEX_PATH = os.getenv("COURSE_INDEX_PATH", os.path.join(SAVED_DIR, "course_index.db"))
+
+# outcomes recorded by the resolver
+OUTCOME_HIT = "hit"  # found in the index
+OUTCOME_SEARCH = "search"  # found through the course search endpoint
+OUTCOME_MISS = "miss"  # found only by enumerating all courses
+OUTCOME_NOT_FOUND = "not_found"  # not found at all
+
+
+class CourseIndex:
+    """
+    Maps (portal_name, slug or course id) to the course entry returned by the api
+    The database is opened in WAL mode so several worker processes can share it
+    """
+
+    def __init__(self, path=COURSE_INDEX_PATH):
+        self.path = path
+        self._local = threading.local()
+        os.makedirs(os.path.dirname(os.path.abspath(path)), exist_ok=True)
+        conn = self._connect()
+        with conn:
+            conn.execute(
+                "CREATE TABLE IF NOT EXISTS courses ("
+                "portal_name TEXT NOT NULL, course_key TEXT NOT NULL, course_json TEXT NOT NULL, "
+                "updated_at REAL NOT NULL, PRIMARY KEY (portal_name, course_key))"
+            )
+            conn.execute("CREATE TABLE IF NOT EXISTS resolver_stats (outcome TEXT PRIMARY KEY, count INTEGER NOT NULL)")
+
+    def _connect(self):
+        """Returns a per-thread connection"""
+        conn = getattr(self._local, "conn", None)
+        if conn is None:
+            conn = sqlite3.connect(self.path, timeout=30)
+            conn.execute("PRAGMA journal_mode=WAL")
+            conn.execute("PRAGMA synchronous=NORMAL")
+            self._local.conn = conn
+        return conn
+
+    def get(self, portal_name, course_key):
+        """
+        Look up a course by its slug (published_title) or id
+
+        Returns:
+            dict or None: The stored course entry
+        """
+        try:
+            row = (
+                self._connect()
+                .execute(
+                    "SELECT course_json FROM courses WHERE portal_name = ? AND course_key = ?",
+                    (portal_name, str(course_key)),
+                )
+                .fetchone()
+            )
+        except sqlite3.Error as e:
+            logger.warning(f"Course index lookup failed: {e}")
+            return None
+        return json.loads(row[0]) if row else None
+
+    def put_many(self, portal_name, courses):
+        """Store course entries under both their slug and their id"""
+        now = time.time()
+        rows = []
+        for course in courses or []:
+            if not isinstance(course, dict) or not course.get("id"):
+                continue
+            course_json = json.dumps(
+                {k: course.get(k) for k in ("id", "url", "title", "published_title")}
+            )
+            rows.append((portal_name, str(course.get("id")), course_json, now))
+            if course.get("published_title"):
+                rows.append((portal_name, course.get("published_title"), course_json, now))
+        if not rows:
+            return
+        try:
+            conn = self._connect()
+            with conn:
+                conn.executemany(
+                    "INSERT OR REPLACE INTO courses (portal_name, course_key, course_json, updated_at) VALUES (?, ?, ?, ?)",
+                    rows,
+                )
+        except sqlite3.Error as e:
+            logger.warning(f"Failed to update course index: {e}")
+
+    def put(self, portal_name, course):
+        self.put_many(portal_name, [course])
+
+    def record(self, outcome):
+        """Count a resolver outcome (hit, search, miss, not_found)"""
+        try:
+            conn = self._connect()
+            with conn:
+                conn.execute(
+                    "INSERT INTO resolver_stats (outcome, count) VALUES (?, 1) "
+                    "ON CONFLICT(outcome) DO UPDATE SET count = count + 1",
+                    (outcome,),
+                )
+        except sqlite3.Error as e:
+            logger.warning(f"Failed to record course index stats: {e}")
+
+    def stats(self):
+        """
+        Returns:
+            dict: Outcome counts plus the index and search hit rates
+        """
+        counts = {OUTCOME_HIT: 0, OUTCOME_SEARCH: 0, OUTCOME_MISS: 0, OUTCOME_NOT_FOUND: 0}
+        try:
+            for outcome, count in self._connect().execute("SELECT outcome, count FROM resolver_stats"):
+                counts[outcome] = count
+        except sqlite3.Error as e:
+            logger.warning(f"Failed to read course index stats: {e}")
+        total = sum(counts.values())
+        counts["total"] = total
+        counts["index_hit_rate"] = round(counts[OUTCOME_HIT] / total, 3) if total else 0.0
+        counts["search_hit_rate"] = round(counts[OUTCOME_SEARCH] / total, 3) if total else 0.0
+        return counts
+
+
+# Global instance
+_course_index = None
+
+
+def get_course_index():
+    """Get or create global course index instance"""
+    global _course_index
+    if _course_index is None:
+        _course_index = CourseIndex()
+    return _course_index
@@ -0,0 +1,303 @@
+"""
+HLS helpers
+In-memory store for HLS variant playlists, one per download task, and a
+native segment downloader for non encrypted variant playlists
+"""
+
+import logging
+import os
+import subprocess
+import sys
+import threading
+import time
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
+
+import m3u8
+import requests
+from requests.adapters import HTTPAdapter
+
+from rate_limit import backoff_delay
+
+logger = logging.getLogger("udemy-downloader")
+
+SEGMENT_RETRIES = 5
+SEGMENT_TIMEOUT = 30
+
+
+class PlaylistStore:
+    """
+    Keeps variant playlists in memory instead of a shared temp/ directory
+
+    Playlists are registered with their url and fetched either up front
+    (prefetch) or the first time they are needed (get).
+    """
+
+    def __init__(self, fetch):
+        """
+        Args:
+            fetch (callable): fetch(url) -> playlist text, or None on failure
+        """
+        self._fetch = fetch
+        self._urls = {}
+        self._playlists = {}
+        self._lock = threading.Lock()
+
+    def add(self, key, url):
+        with self._lock:
+            self._urls[key] = url
+
+    def get(self, key):
+        """Returns the playlist text, fetching it if it isn't loaded yet"""
+        with self._lock:
+            if key in self._playlists:
+                return self._playlists[key]
+            url = self._urls.get(key)
+        if not url:
+            return None
+        text = self._fetch(url)
+        if text is not None:
+            with self._lock:
+                self._playlists[key] = text
+        return text
+
+    def prefetch(self, keys, max_workers):
+        """
+        Fetch several playlists concurrently
+
+        Returns:
+            set: The keys that were loaded successfully
+        """
+        keys = list(keys)
+        if not keys:
+            return set()
+        with ThreadPoolExecutor(max_workers=min(max_workers, len(keys))) as executor:
+            results = list(executor.map(self.get, keys))
+        return {key for key, text in zip(keys, results) if text is not None}
+
+    def write(self, key, path):
+        """
+        Write a playlist to disk for tools that need a file (yt-dlp)
+
+        Returns:
+            str or None: The path written to
+        """
+        text = self.get(key)
+        if text is None:
+            return None
+        with open(path, "w", encoding="utf-8") as f:
+            f.write(text)
+        return path
+
+    def discard(self, key):
+        """Drop a playlist once it has been downloaded"""
+        with self._lock:
+            self._playlists.pop(key, None)
+            self._urls.pop(key, None)
+
+
+class SegmentDownloader:
+    """
+    Downloads the segments of a variant playlist into a single file
+
+    Segments are fetched `max_workers` at a time over one pooled session and
+    written in playlist order as soon as the next one is available, so at most
+    2 * max_workers segments are held in memory. The joined stream is then
+    remuxed to mp4 with a single ffmpeg call.
+
+    Encrypted (EXT-X-KEY) and byte range playlists aren't supported, use
+    can_download() first and fall back to yt-dlp for those.
+    """
+
+    def __init__(self, max_workers=10, retries=SEGMENT_RETRIES, timeout=SEGMENT_TIMEOUT, rate_limit=None):
+        """
+        Args:
+            rate_limit (callable, optional): rate_limit() -> bytes/sec allowed right now, None for unlimited
+        """
+        self.max_workers = max_workers
+        self.rate_limit = rate_limit
+        self.retries = retries
+        self.timeout = timeout
+        self._session = requests.Session()
+        adapter = HTTPAdapter(pool_connections=4, pool_maxsize=max_workers)
+        self._session.mount("https://", adapter)
+        self._session.mount("http://", adapter)
+
+    @staticmethod
+    def can_download(playlist: m3u8.M3U8):
+        if playlist.is_variant or not playlist.segments:
+            return False
+        if any(key is not None and key.method and key.method.upper() != "NONE" for key in playlist.keys):
+            return False
+        return not any(segment.byterange for segment in playlist.segments)
+
+    def _fetch(self, url):
+        for attempt in range(self.retries):
+            try:
+                r = self._session.get(url, timeout=self.timeout)
+                r.raise_for_status()
+                return r.content
+            except requests.RequestException as e:
+                if attempt == self.retries - 1:
+                    raise
+                logger.debug(f"Segment download failed ({e}), retrying...")
+                time.sleep(backoff_delay(attempt))
+
+    def _segment_urls(self, playlist: m3u8.M3U8):
+        urls = []
+        init_sections = set()
+        for segment in playlist.segments:
+            # fmp4 playlists start with (or switch to) an initialization section
+            init_section = segment.init_section
+            if init_section is not None and init_section.absolute_uri not in init_sections:
+                init_sections.add(init_section.absolute_uri)
+                urls.append(init_section.absolute_uri)
+            urls.append(segment.absolute_uri)
+        return urls
+
+    def download(self, playlist_text, playlist_url, output_path):
+        """
+        Download a variant playlist to `output_path` (mp4)
+
+        Returns:
+            bool: True on success, False if the playlist isn't supported or the download failed
+        """
+        playlist = m3u8.loads(playlist_text, uri=playlist_url)
+        if not self.can_download(playlist):
+            return False
+
+        urls = self._segment_urls(playlist)
+        stream_path = output_path + ".stream.part"
+        remux_path = output_path + ".remux.part"
+        start = time.time()
+        try:
+            total_bytes = self._download_segments(urls, stream_path)
+            elapsed = max(time.time() - start, 0.001)
+            logger.info(
+                f"      > Downloaded {len(urls)} segments, {total_bytes / 1024 / 1024:.1f} MiB "
+                f"in {elapsed:.1f}s ({total_bytes / elapsed / 1024 / 1024:.1f} MiB/s)"
+            )
+            if not self._remux(stream_path, remux_path):
+                return False
+            os.replace(remux_path, output_path)
+            return True
+        except Exception as e:
+            logger.error(f"      > Segment download failed: {e}")
+            return False
+        finally:
+            for path in (stream_path, remux_path):
+                if os.path.exists(path):
+                    os.remove(path)
+
+    def _download_segments(self, urls, stream_path):
+        total_bytes = 0
+        start = time.time()
+        executor = ThreadPoolExecutor(max_workers=self.max_workers, thread_name_prefix="segment")
+        pending = deque()
+        urls = iter(urls)
+        try:
+            with open(stream_path, "wb") as f:
+                # keep a bounded window of segments in flight, write them in order
+                for url in urls:
+                    pending.append(executor.submit(self._fetch, url))
+                    if len(pending) >= self.max_workers * 2:
+                        break
+                while pending:
+                    data = pending.popleft().result()
+                    f.write(data)
+                    total_bytes += len(data)
+                    self._throttle(total_bytes, start)
+                    url = next(urls, None)
+                    if url is not None:
+                        pending.append(executor.submit(self._fetch, url))
+        finally:
+            for future in pending:
+                future.cancel()
+            executor.shutdown(wait=True)
+        return total_bytes
+
+    def _throttle(self, total_bytes, start):
+        """Hold back the next requests while the average speed is above the rate limit"""
+        rate = self.rate_limit() if self.rate_limit else None
+        if rate:
+            ahead = total_bytes / rate - (time.time() - start)
+            if ahead > 0:
+                time.sleep(ahead)
+
+    @staticmethod
+    def _remux(stream_path, output_path):
+        cmd = [
+            "ffmpeg",
+            "-y",
+            "-loglevel",
+            "error",
+            "-i",
+            stream_path,
+            "-c",
+            "copy",
+            "-bsf:a",
+            "aac_adtstoasc",
+            "-f",
+            "mp4",
+            output_path,
+        ]
+        ret_code = subprocess.run(cmd).returncode
+        if ret_code != 0:
+            logger.error(f"      > Remuxing returned non-zero return code {ret_code}")
+        return ret_code == 0
+
+    def close(self):
+        self._session.close()
+
+
+if __name__ == "__main__":
+    """
+    Benchmark the native segment downloader against yt-dlp + aria2c
+    Usage: python3 hls.py <variant playlist url> [concurrency]
+    """
+    import shutil
+    import tempfile
+
+    if len(sys.argv) < 2:
+        print("Usage: python3 hls.py <variant playlist url> [concurrency]")
+        sys.exit(1)
+
+    logging.basicConfig(level=logging.INFO)
+    playlist_url = sys.argv[1]
+    concurrency = int(sys.argv[2]) if len(sys.argv) > 2 else 10
+    playlist_text = requests.get(playlist_url, timeout=SEGMENT_TIMEOUT).text
+    work_dir = tempfile.mkdtemp(prefix="hls-bench-")
+
+    try:
+        native_path = os.path.join(work_dir, "native.mp4")
+        downloader = SegmentDownloader(max_workers=concurrency)
+        start = time.perf_counter()
+        native_ok = downloader.download(playlist_text, playlist_url, native_path)
+        native_time = time.perf_counter() - start
+        downloader.close()
+
+        ytdlp_path = os.path.join(work_dir, "ytdlp.mp4")
+        cmd = [
+            "yt-dlp",
+            "--force-generic-extractor",
+            "--concurrent-fragments",
+            f"{concurrency}",
+            "--downloader",
+            "aria2c",
+            "--downloader-args",
+            'aria2c:"--disable-ipv6"',
+            "-q",
+            "-o",
+            ytdlp_path,
+            playlist_url,
+        ]
+        start = time.perf_counter()
+        ytdlp_ok = subprocess.run(cmd).returncode == 0
+        ytdlp_time = time.perf_counter() - start
+
+        print(f"native:         {native_time:.2f}s ok={native_ok} size={os.path.getsize(native_path) if native_ok else 0}")
+        print(f"yt-dlp + aria2: {ytdlp_time:.2f}s ok={ytdlp_ok} size={os.path.getsize(ytdlp_path) if ytdlp_ok else 0}")
+        if native_ok and ytdlp_ok:
+            print(f"speedup: {ytdlp_time / native_time:.1f}x")
+    finally:
+        shutil.rmtree(work_dir, ignore_errors=True)
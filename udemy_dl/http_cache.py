@@ -0,0 +1,227 @@
+"""
+HTTP Cache
+On-disk response cache for Udemy API GET requests (SQLite)
+Fresh entries are served without touching the network, stale entries are
+revalidated with ETag / Last-Modified, and the store is kept under a size
+limit with LRU eviction. Safe to share between worker processes.
+"""
+
+import hashlib
+import json
+import logging
+import os
+import re
+import sqlite3
+import threading
+import time
+
+import requests
+from requests.structures import CaseInsensitiveDict
+
+from constants import SAVED_DIR
+
+logger = logging.getLogger("udemy-downloader")
+
+HTTP_CACHE_PATH = os.getenv("HTTP_CACHE_PATH", os.path.join(SAVED_DIR, "http_cache.db"))
+HTTP_CACHE_TTL = int(os.getenv("HTTP_CACHE_TTL", 900))  # 15 minutes, asset links in the payloads expire
+HTTP_CACHE_MAX_BYTES = int(os.getenv("HTTP_CACHE_MAX_BYTES", 256 * 1024 * 1024))
+HTTP_CACHE_ENABLED = os.getenv("HTTP_CACHE_ENABLED", "true").lower() == "true"
+
+# only these api calls are cached, everything else always goes to the network
+CACHEABLE_URL_PATTERNS = [
+    re.compile(r"/api-2\.0/courses/\d+/subscriber-curriculum-items/"),
+    re.compile(r"/api-2\.0/courses/\d+/?(?:\?|$)"),
+    re.compile(r"/api-2\.0/quizzes/\d+/assessments/"),
+]
+
+# response headers worth keeping with the body
+STORED_HEADERS = ("Content-Type", "ETag", "Last-Modified")
+
+# cookies that identify the account when there is no bearer token (cookies.txt / browser cookies)
+ACCOUNT_COOKIES = ("access_token", "client_id")
+
+
+def account_identity(headers, cookies=None):
+    """
+    The credentials of the session, to keep the entries of different accounts apart
+
+    Args:
+        headers: The session headers, the bearer token is used if there is one
+        cookies: The cookie jar the requests are sent with
+
+    Returns:
+        str or None: None if the account can't be told, the response mustn't be cached then
+    """
+    auth = headers.get("authorization")
+    if auth:
+        return auth
+    values = {}
+    for cookie in cookies or []:
+        if cookie.name in ACCOUNT_COOKIES and cookie.value and "udemy" in (cookie.domain or ""):
+            values[cookie.name] = cookie.value
+    if not values:
+        return None
+    return "cookies:" + "\0".join(f"{name}={values[name]}" for name in sorted(values))
+
+
+class CachedResponse:
+    """A cache entry, can be turned back into a requests.Response"""
+
+    def __init__(self, url, body, headers, encoding, stored_at):
+        self.url = url
+        self.body = body
+        self.headers = headers
+        self.encoding = encoding
+        self.stored_at = stored_at
+
+    def is_fresh(self, ttl):
+        return (time.time() - self.stored_at) < ttl
+
+    def revalidation_headers(self):
+        headers = {}
+        if self.headers.get("ETag"):
+            headers["If-None-Match"] = self.headers["ETag"]
+        if self.headers.get("Last-Modified"):
+            headers["If-Modified-Since"] = self.headers["Last-Modified"]
+        return headers
+
+    def to_response(self):
+        resp = requests.models.Response()
+        resp.status_code = 200
+        resp.reason = "OK"
+        resp.url = self.url
+        resp._content = self.body
+        resp.headers = CaseInsensitiveDict(self.headers)
+        resp.encoding = self.encoding
+        return resp
+
+
+class HttpCache:
+    def __init__(self, path=HTTP_CACHE_PATH, ttl=HTTP_CACHE_TTL, max_bytes=HTTP_CACHE_MAX_BYTES):
+        self.path = path
+        self.ttl = ttl
+        self.max_bytes = max_bytes
+        self._local = threading.local()
+        os.makedirs(os.path.dirname(os.path.abspath(path)), exist_ok=True)
+        conn = self._connect()
+        with conn:
+            conn.execute(
+                "CREATE TABLE IF NOT EXISTS responses ("
+                "cache_key TEXT PRIMARY KEY, url TEXT NOT NULL, body BLOB NOT NULL, headers TEXT NOT NULL, "
+                "encoding TEXT, size INTEGER NOT NULL, stored_at REAL NOT NULL, last_access REAL NOT NULL)"
+            )
+            conn.execute("CREATE INDEX IF NOT EXISTS responses_last_access ON responses (last_access)")
+
+    def _connect(self):
+        """Returns a per-thread connection"""
+        conn = getattr(self._local, "conn", None)
+        if conn is None:
+            conn = sqlite3.connect(self.path, timeout=30)
+            conn.execute("PRAGMA journal_mode=WAL")
+            conn.execute("PRAGMA synchronous=NORMAL")
+            self._local.conn = conn
+        return conn
+
+    @staticmethod
+    def is_cacheable(url):
+        return any(pattern.search(url) for pattern in CACHEABLE_URL_PATTERNS)
+
+    @staticmethod
+    def make_key(url, params=None, auth=None):
+        """
+        Key on the fully encoded url (so params order doesn't matter) and the
+        credentials (see account_identity), so two accounts never share entries
+        """
+        if isinstance(params, dict):
+            params = sorted(params.items())
+        full_url = requests.Request("GET", url, params=params).prepare().url
+        digest = hashlib.sha256(full_url.encode("utf-8"))
+        digest.update(b"\0" + (auth or "").encode("utf-8"))
+        return digest.hexdigest()
+
+    def get(self, cache_key):
+        """
+        Returns:
+            CachedResponse or None
+        """
+        try:
+            conn = self._connect()
+            row = conn.execute(
+                "SELECT url, body, headers, encoding, stored_at FROM responses WHERE cache_key = ?", (cache_key,)
+            ).fetchone()
+            if not row:
+                return None
+            with conn:
+                conn.execute("UPDATE responses SET last_access = ? WHERE cache_key = ?", (time.time(), cache_key))
+        except sqlite3.Error as e:
+            logger.warning(f"HTTP cache read failed: {e}")
+            return None
+        url, body, headers, encoding, stored_at = row
+        return CachedResponse(url, body, json.loads(headers), encoding, stored_at)
+
+    def refresh(self, cache_key):
+        """Mark an entry as fresh again after a 304 Not Modified"""
+        try:
+            conn = self._connect()
+            now = time.time()
+            with conn:
+                conn.execute(
+                    "UPDATE responses SET stored_at = ?, last_access = ? WHERE cache_key = ?", (now, now, cache_key)
+                )
+        except sqlite3.Error as e:
+            logger.warning(f"HTTP cache refresh failed: {e}")
+
+    def store(self, cache_key, resp: requests.Response):
+        if resp.status_code != 200:
+            return
+        body = resp.content
+        if len(body) > self.max_bytes:
+            return
+        headers = {k: resp.headers[k] for k in STORED_HEADERS if k in resp.headers}
+        now = time.time()
+        try:
+            conn = self._connect()
+            with conn:
+                conn.execute(
+                    "INSERT OR REPLACE INTO responses (cache_key, url, body, headers, encoding, size, stored_at, last_access) "
+                    "VALUES (?, ?, ?, ?, ?, ?, ?, ?)",
+                    (cache_key, resp.url, body, json.dumps(headers), resp.encoding, len(body), now, now),
+                )
+            self._evict()
+        except sqlite3.Error as e:
+            logger.warning(f"HTTP cache write failed: {e}")
+
+    def _evict(self):
+        """Drop least recently used entries until the store is back under its size limit"""
+        conn = self._connect()
+        total = conn.execute("SELECT COALESCE(SUM(size), 0) FROM responses").fetchone()[0]
+        if total <= self.max_bytes:
+            return
+        target = int(self.max_bytes * 0.9)
+        with conn:
+            for cache_key, size in conn.execute(
+                "SELECT cache_key, size FROM responses ORDER BY last_access ASC"
+            ).fetchall():
+                if total <= target:
+                    break
+                conn.execute("DELETE FROM responses WHERE cache_key = ?", (cache_key,))
+                total -= size
+        logger.debug(f"HTTP cache evicted down to {total} bytes")
+
+
+# Global instance
+_http_cache = None
+_http_cache_lock = threading.Lock()
+
+
+def get_http_cache():
+    """Get or create global http cache instance, None if caching is disabled"""
+    global _http_cache
+    with _http_cache_lock:
+        if _http_cache is None and HTTP_CACHE_ENABLED:
+            try:
+                _http_cache = HttpCache()
+            except (sqlite3.Error, OSError) as e:
+                logger.warning(f"HTTP cache unavailable, continuing without it: {e}")
+                return None
+    return _http_cache
@@ -0,0 +1,192 @@
+"""
+Download Journal
+Per-task record of every lecture, caption and asset written to the sandbox (SQLite)
+A retry of the same task skips the items the journal has verified, and only
+re-fetches the ones that were started but never completed. The worker reads
+the completion summary from the same file after main.py exits.
+"""
+
+import hashlib
+import logging
+import os
+import sqlite3
+import threading
+import time
+
+logger = logging.getLogger("udemy-downloader")
+
+JOURNAL_FILENAME = ".download_journal.db"
+JOURNAL_VERIFY_CHECKSUM = os.getenv("JOURNAL_VERIFY_CHECKSUM", "false").lower() == "true"
+
+STATE_STARTED = "started"
+STATE_DONE = "done"
+STATE_FAILED = "failed"
+
+KIND_LECTURE = "lecture"
+KIND_CAPTION = "caption"
+KIND_ASSET = "asset"
+
+
+def file_checksum(path, chunk_size=1024 * 1024):
+    digest = hashlib.blake2b(digest_size=20)
+    with open(path, "rb") as f:
+        for chunk in iter(lambda: f.read(chunk_size), b""):
+            digest.update(chunk)
+    return digest.hexdigest()
+
+
+class DownloadJournal:
+    """
+    Items are keyed by their path relative to the sandbox, so the journal
+    stays valid whatever directory the sandbox is mounted at
+    """
+
+    def __init__(self, root, filename=JOURNAL_FILENAME):
+        self.root = root
+        self.path = os.path.join(root, filename)
+        self._local = threading.local()
+        # only a directory filled by a run from before the journal can hold finished files it doesn't know,
+        # in a journaled (or fresh) sandbox an untracked file is the leftover of an interrupted write
+        self.adopt_untracked = (
+            os.path.isdir(root) and not os.path.isfile(self.path) and any(os.scandir(root))
+        )
+        os.makedirs(root, exist_ok=True)
+        conn = self._connect()
+        with conn:
+            conn.execute(
+                "CREATE TABLE IF NOT EXISTS items ("
+                "path TEXT PRIMARY KEY, kind TEXT NOT NULL, state TEXT NOT NULL, size INTEGER, "
+                "expected_size INTEGER, checksum TEXT, error TEXT, attempts INTEGER NOT NULL DEFAULT 0, "
+                "updated_at REAL NOT NULL)"
+            )
+
+    def _connect(self):
+        """Returns a per-thread connection"""
+        conn = getattr(self._local, "conn", None)
+        if conn is None:
+            conn = sqlite3.connect(self.path, timeout=30)
+            conn.execute("PRAGMA journal_mode=WAL")
+            conn.execute("PRAGMA synchronous=NORMAL")
+            self._local.conn = conn
+        return conn
+
+    def _key(self, path):
+        return os.path.relpath(os.path.abspath(path), os.path.abspath(self.root))
+
+    def _get(self, path):
+        return (
+            self._connect()
+            .execute("SELECT state, size, expected_size, checksum FROM items WHERE path = ?", (self._key(path),))
+            .fetchone()
+        )
+
+    def _set(self, kind, path, state, **fields):
+        columns = ["path", "kind", "state", "updated_at", *fields]
+        values = [self._key(path), kind, state, time.time(), *fields.values()]
+        updates = ", ".join(f"{c} = excluded.{c}" for c in columns[1:])
+        if state == STATE_STARTED:
+            updates += ", attempts = attempts + 1"
+        try:
+            conn = self._connect()
+            with conn:
+                conn.execute(
+                    f"INSERT INTO items ({', '.join(columns)}, attempts) VALUES ({', '.join('?' * len(columns))}, ?) "
+                    f"ON CONFLICT(path) DO UPDATE SET {updates}",
+                    [*values, 1 if state == STATE_STARTED else 0],
+                )
+        except sqlite3.Error as e:
+            logger.warning(f"Download journal write failed: {e}")
+
+    def check(self, kind, path):
+        """
+        Is the item at `path` completely downloaded?
+
+        Files the journal doesn't know are only adopted in a directory written
+        by a run from before the journal, and only if they don't have an aria2
+        control file next to them. Partial files that can't be resumed are
+        removed so the caller downloads them again.
+
+        Returns:
+            bool: True if the item can be skipped
+        """
+        try:
+            row = self._get(path)
+        except sqlite3.Error as e:
+            logger.warning(f"Download journal read failed: {e}")
+            return os.path.isfile(path)
+
+        exists = os.path.isfile(path)
+        resumable = os.path.isfile(path + ".aria2")
+        if row is None:
+            if exists and not resumable:
+                if self.adopt_untracked:
+                    return self.complete(kind, path)
+                os.remove(path)
+            return False
+
+        state, size, expected_size, checksum = row
+        if state == STATE_DONE and exists:
+            actual_size = os.path.getsize(path)
+            if actual_size == size and (not expected_size or actual_size == expected_size):
+                if not JOURNAL_VERIFY_CHECKSUM or not checksum or file_checksum(path) == checksum:
+                    return True
+            logger.warning(f"      > '{os.path.basename(path)}' doesn't match the journal, downloading it again")
+        if exists and not resumable:
+            os.remove(path)
+        return False
+
+    def start(self, kind, path, expected_size=None):
+        self._set(kind, path, STATE_STARTED, expected_size=expected_size, error=None)
+
+    def complete(self, kind, path, expected_size=None):
+        """
+        Record a finished item with its size, marks it failed if the file is missing or short
+
+        The checksum is only computed (a full read of the file) when JOURNAL_VERIFY_CHECKSUM is set
+        """
+        if not os.path.isfile(path) or os.path.isfile(path + ".aria2"):
+            self.fail(kind, path, "file missing after download")
+            return False
+        size = os.path.getsize(path)
+        if expected_size and size != expected_size:
+            self.fail(kind, path, f"size mismatch: {size} != {expected_size}")
+            return False
+        checksum = file_checksum(path) if JOURNAL_VERIFY_CHECKSUM else None
+        self._set(kind, path, STATE_DONE, size=size, expected_size=expected_size, checksum=checksum, error=None)
+        return True
+
+    def fail(self, kind, path, error):
+        self._set(kind, path, STATE_FAILED, error=str(error)[:1000])
+
+    def summary(self):
+        return read_summary(self.root)
+
+
+def read_summary(root, filename=JOURNAL_FILENAME):
+    """
+    Completion summary of a sandbox
+
+    Returns:
+        dict or None: {"lecture": {"done": n, "failed": n, ...}, ..., "failed_items": [...]}, None if there is no journal
+    """
+    path = os.path.join(root, filename)
+    if not os.path.isfile(path):
+        return None
+    try:
+        conn = sqlite3.connect(path, timeout=30)
+        try:
+            summary = {}
+            for kind, state, count in conn.execute("SELECT kind, state, COUNT(*) FROM items GROUP BY kind, state"):
+                summary.setdefault(kind, {})[state] = count
+            summary["failed_items"] = [
+                {"path": p, "kind": kind, "error": error}
+                for p, kind, error in conn.execute(
+                    "SELECT path, kind, error FROM items WHERE state != ? ORDER BY path LIMIT 50", (STATE_DONE,)
+                )
+            ]
+        finally:
+            conn.close()
+    except sqlite3.Error as e:
+        logger.warning(f"Failed to read download journal: {e}")
+        return None
+    return summary
@@ -1,5 +1,6 @@
 # -*- coding: utf-8 -*-
 import argparse
+import itertools
 import json
 import logging
 import math
@@ -7,16 +8,19 @@ import os
 import re
 import subprocess
 import sys
+import threading
 import time
+from collections import deque
+from concurrent.futures import Future, ThreadPoolExecutor
 from http.cookiejar import MozillaCookieJar
 from pathlib import Path
 from typing import IO, Union
+from urllib.parse import parse_qs, quote, urlencode, urlparse, urlunparse
 
 import browser_cookie3
 import demoji
 import m3u8
 import requests
-import yt_dlp
 from bs4 import BeautifulSoup
 from coloredlogs import ColoredFormatter
 from dotenv import load_dotenv
@@ -25,9 +29,27 @@ from requests.exceptions import ConnectionError as conn_error
 from tqdm import tqdm
 
 from constants import *
+from aria2_rpc import get_aria2_daemon, set_download_limit
+from asset_cache import get_asset_cache
+from budget import STAGE_DOWNLOAD, get_budget
+from course_index import OUTCOME_HIT, OUTCOME_MISS, OUTCOME_NOT_FOUND, OUTCOME_SEARCH, get_course_index
+from hls import PlaylistStore, SegmentDownloader
+from http_cache import HttpCache, account_identity, get_http_cache
+from journal import KIND_ASSET, KIND_CAPTION, KIND_LECTURE, DownloadJournal
+from mpd import extract_formats_ytdlp, parse_mpd
+from rate_limit import backoff_delay, get_rate_limiter, parse_retry_after
+from quality_policy import (
+    budget_per_minute,
+    fit_to_budget,
+    format_size,
+    parse_size,
+    projected_size,
+)
+from session_manager import get_session_manager
+from transcode import TranscodeQueue
 from tls import SSLCiphers
 from utils import extract_kid
-from vtt_to_srt import convert
+from vtt_to_srt import vtt_to_srt
 
 DOWNLOAD_DIR = os.path.join(os.getcwd(), "out_dir")
 MAIN_SCRIPT_PATH = os.path.dirname(os.path.abspath(__file__))
@@ -46,7 +68,9 @@ portal_name = None
 course_name = None
 keep_vtt = False
 skip_hls = False
+defer_hls = False
 concurrent_downloads = 10
+concurrent_lectures = 1
 save_to_file = None
 load_from_file = None
 course_url = None
@@ -62,6 +86,14 @@ browser = None
 cj = None
 use_continuous_lecture_numbers = False
 chapter_filter = None
+task_id = None
+max_bytes_per_minute = None
+size_budget = None
+external_links_lock = threading.Lock()
+download_lease = None  # share of the host-wide bandwidth budget, held while parse_new runs
+journal = None  # download journal of the output directory, opened by parse_new
+post_processor = None  # ffmpeg stages running alongside the downloads, created by parse_new
+transcode_queue = None  # h265 encodes, created by parse_new if --use-h265 is set
 
 
 def deEmojify(inputStr: str):
@@ -98,14 +130,95 @@ def parse_chapter_filter(chapter_str: str):
     return chapters
 
 
-# this is the first function that is called, we parse the arguments, setup the logger, and ensure that required directories exist
-def pre_run():
-    global dl_assets, dl_captions, dl_quizzes, skip_lectures, caption_locale, quality, bearer_token, course_name, keep_vtt, skip_hls, concurrent_downloads, load_from_file, save_to_file, bearer_token, course_url, info, logger, keys, id_as_course_name, LOG_LEVEL, use_h265, h265_crf, h265_preset, use_nvenc, browser, is_subscription_course, DOWNLOAD_DIR, use_continuous_lecture_numbers, chapter_filter
+def select_source(sources, quality):
+    """
+    Picks the source closest to `quality`, or the best one if no quality was requested,
+    among the sources that fit the bytes-per-minute budget (if one is set)
+    """
+    sources = fit_to_budget(sources, max_bytes_per_minute)
+    sources = sorted(sources, key=lambda x: int(x.get("height")), reverse=True)
+    if isinstance(quality, int):
+        return min(sources, key=lambda x: abs(int(x.get("height")) - quality))
+    return sources[0]
 
-    # make sure the logs directory exists
-    if not os.path.exists(LOG_DIR_PATH):
-        os.makedirs(LOG_DIR_PATH, exist_ok=True)
 
+class DownloadError(Exception):
+    """A download that stopped, exit_code is what the command line exits with"""
+
+    def __init__(self, message, exit_code=1):
+        super().__init__(message)
+        self.exit_code = exit_code
+
+
+class DownloadConfig:
+    """
+    The options of a download
+
+    Built from the command line by parse_args(), or directly by callers that
+    import this module (the worker), and applied with setup(). The module
+    globals the download code reads are set from it, so one process can run
+    several downloads one after the other.
+    """
+
+    # option -> default
+    DEFAULTS = {
+        "bearer_token": None,
+        "download_dir": os.path.join(os.getcwd(), "out_dir"),
+        "quality": None,
+        "caption_locale": "en",
+        "dl_assets": False,
+        "dl_captions": False,
+        "dl_quizzes": False,
+        "skip_lectures": False,
+        "keep_vtt": False,
+        "skip_hls": False,
+        "defer_hls": False,
+        "concurrent_downloads": 10,
+        "concurrent_lectures": 1,
+        "load_from_file": None,
+        "save_to_file": None,
+        "info": None,
+        "id_as_course_name": False,
+        "is_subscription_course": False,
+        "use_h265": False,
+        "h265_crf": 28,
+        "h265_preset": "medium",
+        "use_nvenc": False,
+        "browser": None,
+        "use_continuous_lecture_numbers": False,
+        "chapter_filter": None,  # "1,3-5" or a set of chapter numbers
+        "max_bytes_per_minute": None,
+        "size_budget": None,
+        "log_level": logging.INFO,
+        "log_file": None,  # the task log file, a timestamped file in the logs directory otherwise
+        "task_id": None,
+    }
+
+    def __init__(self, course_url, **options):
+        unknown = set(options) - set(self.DEFAULTS)
+        if unknown:
+            raise TypeError(f"Unknown download options: {', '.join(sorted(unknown))}")
+        self.course_url = course_url
+        for name, default in self.DEFAULTS.items():
+            setattr(self, name, options.get(name, default))
+
+        if self.concurrent_downloads <= 0:
+            # if the user gave a number that is less than or equal to 0, set cc to default of 10
+            self.concurrent_downloads = 10
+        elif self.concurrent_downloads > 30:
+            # if the user gave a number thats greater than 30, set cc to the max of 30
+            self.concurrent_downloads = 30
+        self.concurrent_lectures = min(max(self.concurrent_lectures, 1), 10)
+        self.download_dir = os.path.abspath(self.download_dir)
+
+
+def parse_args(argv=None):
+    """
+    Parse the command line into a DownloadConfig
+
+    Args:
+        argv (list, optional): The arguments, sys.argv[1:] by default
+    """
     parser = argparse.ArgumentParser(description="Udemy Downloader")
     parser.add_argument(
         "-c",
@@ -143,6 +256,13 @@ def pre_run():
         type=int,
         help="The number of maximum concurrent downloads for segments (HLS and DASH, must be a number 1-30)",
     )
+    parser.add_argument(
+        "-cl",
+        "--concurrent-lectures",
+        dest="concurrent_lectures",
+        type=int,
+        help="The number of lectures to download at the same time (must be a number 1-10, Default is 1)",
+    )
     parser.add_argument(
         "--skip-lectures",
         dest="skip_lectures",
@@ -179,6 +299,12 @@ def pre_run():
         action="store_true",
         help="If specified, hls streams will be skipped (faster fetching) (hls streams usually contain 1080p quality for non-drm lectures)",
     )
+    parser.add_argument(
+        "--defer-hls",
+        dest="defer_hls",
+        action="store_true",
+        help="If specified, hls variant playlists are only fetched for the quality that gets downloaded (faster fetching)",
+    )
     parser.add_argument(
         "--info",
         dest="info",
@@ -278,80 +404,96 @@ def pre_run():
         type=str,
         help="Download specific chapters. Use comma separated values and ranges (e.g., '1,3-5,7,9-11').",
     )
+    parser.add_argument(
+        "--max-bytes-per-minute",
+        dest="max_bytes_per_minute",
+        type=parse_size,
+        help="Pick the best quality whose bitrate stays under this size per minute of video (e.g. '15M')",
+    )
+    parser.add_argument(
+        "--size-budget",
+        dest="size_budget",
+        type=parse_size,
+        help="Pick qualities so the videos of the course fit in this size (e.g. '4G'), the whole curriculum is fetched first",
+    )
     # parser.add_argument("-v", "--version", action="version", version="You are running version {version}".format(version=__version__))
 
-    args = parser.parse_args()
-    if args.download_assets:
-        dl_assets = True
-    if args.lang:
-        caption_locale = args.lang
-    if args.download_captions:
-        dl_captions = True
-    if args.download_quizzes:
-        dl_quizzes = True
-    if args.skip_lectures:
-        skip_lectures = True
-    if args.quality:
-        quality = args.quality
-    if args.keep_vtt:
-        keep_vtt = args.keep_vtt
-    if args.skip_hls:
-        skip_hls = args.skip_hls
-    if args.concurrent_downloads:
-        concurrent_downloads = args.concurrent_downloads
-
-        if concurrent_downloads <= 0:
-            # if the user gave a number that is less than or equal to 0, set cc to default of 10
-            concurrent_downloads = 10
-        elif concurrent_downloads > 30:
-            # if the user gave a number thats greater than 30, set cc to the max of 30
-            concurrent_downloads = 30
-    if args.load_from_file:
-        load_from_file = args.load_from_file
-    if args.save_to_file:
-        save_to_file = args.save_to_file
-    if args.bearer_token:
-        bearer_token = args.bearer_token
-    if args.course_url:
-        course_url = args.course_url
-    if args.info:
-        info = args.info
-    if args.use_h265:
-        use_h265 = True
-    if args.h265_crf:
-        h265_crf = args.h265_crf
-    if args.h265_preset:
-        h265_preset = args.h265_preset
-    if args.use_nvenc:
-        use_nvenc = True
+    args = parser.parse_args(argv)
+
+    log_level = logging.INFO
     if args.log_level:
-        if args.log_level.upper() == "DEBUG":
-            LOG_LEVEL = logging.DEBUG
-        elif args.log_level.upper() == "INFO":
-            LOG_LEVEL = logging.INFO
-        elif args.log_level.upper() == "ERROR":
-            LOG_LEVEL = logging.ERROR
-        elif args.log_level.upper() == "WARNING":
-            LOG_LEVEL = logging.WARNING
-        elif args.log_level.upper() == "CRITICAL":
-            LOG_LEVEL = logging.CRITICAL
-        else:
+        log_level = {
+            "DEBUG": logging.DEBUG,
+            "INFO": logging.INFO,
+            "ERROR": logging.ERROR,
+            "WARNING": logging.WARNING,
+            "CRITICAL": logging.CRITICAL,
+        }.get(args.log_level.upper())
+        if log_level is None:
             print(f"Invalid log level: {args.log_level}; Using INFO")
-            LOG_LEVEL = logging.INFO
-    if args.id_as_course_name:
-        id_as_course_name = args.id_as_course_name
-    if args.is_subscription_course:
-        is_subscription_course = args.is_subscription_course
-    if args.browser:
-        browser = args.browser
-    if args.out:
-        DOWNLOAD_DIR = os.path.abspath(args.out)
-    if args.use_continuous_lecture_numbers:
-        use_continuous_lecture_numbers = args.use_continuous_lecture_numbers
+            log_level = logging.INFO
+
+    options = {
+        "bearer_token": args.bearer_token,
+        "quality": args.quality,
+        "caption_locale": args.lang,
+        "dl_assets": args.download_assets,
+        "dl_captions": args.download_captions,
+        "dl_quizzes": args.download_quizzes,
+        "skip_lectures": args.skip_lectures,
+        "keep_vtt": args.keep_vtt,
+        "skip_hls": args.skip_hls,
+        "defer_hls": args.defer_hls,
+        "concurrent_downloads": args.concurrent_downloads,
+        "concurrent_lectures": args.concurrent_lectures,
+        "load_from_file": args.load_from_file,
+        "save_to_file": args.save_to_file,
+        "info": args.info,
+        "id_as_course_name": args.id_as_course_name,
+        "is_subscription_course": args.is_subscription_course,
+        "use_h265": args.use_h265,
+        "h265_crf": args.h265_crf,
+        "h265_preset": args.h265_preset,
+        "use_nvenc": args.use_nvenc,
+        "browser": args.browser,
+        "download_dir": args.out,
+        "use_continuous_lecture_numbers": args.use_continuous_lecture_numbers,
+        "chapter_filter": args.chapter_filter_raw,
+        "max_bytes_per_minute": args.max_bytes_per_minute,
+        "size_budget": args.size_budget,
+        "log_level": log_level,
+        # ✅ FIX: set by worker_rq.py when it runs main.py as a subprocess
+        "log_file": os.getenv("TASK_LOG_FILE"),
+        "task_id": os.getenv("TASK_ID"),
+    }
+    # unset arguments keep the defaults
+    return DownloadConfig(args.course_url, **{k: v for k, v in options.items() if v})
+
+
+def apply_config(config: DownloadConfig):
+    """Set the module globals of a download from its config"""
+    global DOWNLOAD_DIR, LOG_LEVEL, course_url, chapter_filter
+    for name in DownloadConfig.DEFAULTS:
+        if name not in ("download_dir", "log_level", "log_file", "chapter_filter"):
+            globals()[name] = getattr(config, name)
+    course_url = config.course_url
+    DOWNLOAD_DIR = config.download_dir
+    LOG_LEVEL = config.log_level
+    chapter_filter = None
+    if isinstance(config.chapter_filter, str):
+        chapter_filter = parse_chapter_filter(config.chapter_filter)
+    elif config.chapter_filter:
+        chapter_filter = set(config.chapter_filter)
+
+
+_log_handlers = []  # the handlers setup_logging added, replaced on the next download
+
+
+def setup_logging(log_level, task_log_file=None):
+    global logger
 
     # setup a logger
-    logger = logging.getLogger(__name__)
-    logging.root.setLevel(LOG_LEVEL)
+    logging.root.setLevel(log_level)
 
     # create a colored formatter for the console
     console_formatter = ColoredFormatter(LOG_FORMAT, datefmt=LOG_DATE_FORMAT)
@@ -360,13 +502,11 @@ def pre_run():
 
     # create a handler for console logging
     stream = logging.StreamHandler()
-    stream.setLevel(LOG_LEVEL)
+    stream.setLevel(log_level)
     stream.setFormatter(console_formatter)
 
-    # ✅ FIX: Check if TASK_LOG_FILE environment variable is set (from worker_rq.py)
-    # If set, write to task log file instead of timestamped file
+    # ✅ FIX: If a task log file is set (from worker_rq.py), write to it instead of a timestamped file
     # This ensures ALL logs (logging module + stdout/stderr) go to one file
-    task_log_file = os.getenv('TASK_LOG_FILE')
     if task_log_file:
         # Write to task-specific log file (for admin dashboard)
         # Use 'a' mode to append (worker already wrote header)
@@ -385,18 +525,35 @@ def pre_run():
         file_handler = logging.FileHandler(LOG_FILE_PATH)
         file_handler.setFormatter(file_formatter)
 
-    # construct the logger
+    # construct the logger, dropping the handlers of a previous download in this process
     logger = logging.getLogger("udemy-downloader")
-    logger.setLevel(LOG_LEVEL)
+    for handler in _log_handlers:
+        logger.removeHandler(handler)
+        handler.close()
+    _log_handlers[:] = [stream, file_handler]
+    logger.setLevel(log_level)
     logger.addHandler(stream)
     logger.addHandler(file_handler)
 
+
+def setup(config: DownloadConfig):
+    """Apply a config: set the globals, setup the logger, and ensure that required directories exist"""
+    global keys
+
+    # make sure the logs directory exists
+    if not os.path.exists(LOG_DIR_PATH):
+        os.makedirs(LOG_DIR_PATH, exist_ok=True)
+
+    setup_logging(config.log_level, config.log_file)
+    apply_config(config)
+
     logger.info(f"Output directory set to {DOWNLOAD_DIR}")
 
     Path(DOWNLOAD_DIR).mkdir(parents=True, exist_ok=True)
     Path(SAVED_DIR).mkdir(parents=True, exist_ok=True)
 
     # Get the keys
+    keys = {}
     if os.path.exists(KEY_FILE_PATH):
         with open(KEY_FILE_PATH, encoding="utf8", mode="r") as keyfile:
             keys = json.loads(keyfile.read())
@@ -404,17 +561,43 @@ def pre_run():
         logger.warning("> Keyfile not found! You won't be able to decrypt any encrypted videos!")
 
     # Process the chapter filter
-    if args.chapter_filter_raw:
-        chapter_filter = parse_chapter_filter(args.chapter_filter_raw)
+    if chapter_filter is not None:
         logger.info("Chapter filter applied: %s", sorted(chapter_filter))
 
 
+# this is the first function that is called, we parse the arguments, setup the logger, and ensure that required directories exist
+def pre_run(argv=None):
+    config = parse_args(argv)
+    setup(config)
+    return config
+
+
+def run(config: DownloadConfig):
+    """
+    Download a course in this process, pre_run() + main() for callers that import this module
+
+    Sessions, the aria2 daemon and the caches stay alive between runs.
+
+    Raises:
+        DownloadError: If the download stopped, with the exit code of the command line
+    """
+    setup(config)
+    try:
+        main()
+    except SystemExit as e:
+        code = e.code if isinstance(e.code, int) else (0 if e.code is None else 1)
+        if code != 0:
+            raise DownloadError(f"Download stopped with exit code {code}", code) from None
+
+
 class Udemy:
     def __init__(self, bearer_token):
         global cj
 
         self.session = None
         self.bearer_token = bearer_token  # ✅ FIX: Save bearer_token parameter
+        self.hls_playlists = PlaylistStore(self._fetch_playlist)
+        self._mpd_sources = {}  # asset id -> (manifest, parsed dash sources), for the lifetime of this instance
         self.auth = UdemyAuth(cache_session=False)
         self.session = self.auth._session
         # if not self.session:
@@ -459,7 +642,9 @@ class Udemy:
         # )
         url = URLS.QUIZ.format(portal_name=portal_name, quiz_id=quiz_id)
         try:
-            resp = self.session._get(url).json()
+            resp = self.session._get(url)
+            resp.raise_for_status()
+            resp = resp.json()
         except conn_error as error:
             logger.fatal(f"[-] Connection error: {error}")
             time.sleep(0.8)
@@ -635,7 +820,7 @@ class Udemy:
             )
         return _temp
 
-    def _extract_sources(self, sources, skip_hls):
+    def _extract_sources(self, sources, skip_hls, quality=None, all_qualities=True):
         _temp = []
         if sources and isinstance(sources, list):
             for source in sources:
@@ -664,7 +849,7 @@ class Udemy:
                     width = "256"
                 if source.get("type") == "application/x-mpegURL" or "m3u8" in download_url:
                     if not skip_hls:
-                        out = self._extract_m3u8(download_url)
+                        out = self._extract_m3u8(download_url, quality, all_qualities)
                         if out:
                             _temp.extend(out)
                 else:
@@ -721,37 +906,39 @@ class Udemy:
                 )
         return _temp
 
-    def _extract_m3u8(self, url):
-        """extracts m3u8 streams"""
+    def _fetch_playlist(self, url):
+        """fetches a single playlist, returns its text or None"""
+        try:
+            r = self.session._get(url)
+            r.raise_for_status()
+            return r.text
+        except Exception as error:
+            logger.error(f"Udemy Says : '{error}' while fetching hls playlist..")
+            return None
+
+    def _extract_m3u8(self, url, quality=None, all_qualities=True):
+        """
+        extracts m3u8 streams, if all_qualities is False only the variant closest
+        to `quality` (or the best one) is kept and fetched
+        """
         asset_id_re = re.compile(r"assets/(?P<id>\d+)/")
         _temp = []
 
-        # get temp folder
-        temp_path = Path(Path.cwd(), "temp")
-
-        # ensure the folder exists
-        temp_path.mkdir(parents=True, exist_ok=True)
-
         # # extract the asset id from the url
         asset_id = asset_id_re.search(url).group("id")
 
-        m3u8_path = Path(temp_path, f"index_{asset_id}.m3u8")
-
         try:
             r = self.session._get(url)
             r.raise_for_status()
             raw_data = r.text
 
-            # write to temp file for later
-            with open(m3u8_path, "w") as f:
-                f.write(r.text)
-
-            m3u8_object = m3u8.loads(raw_data)
+            m3u8_object = m3u8.loads(raw_data, uri=url)
             playlists = m3u8_object.playlists
             seen = set()
             for pl in playlists:
                 resolution = pl.stream_info.resolution
                 codecs = pl.stream_info.codecs
+                bandwidth = pl.stream_info.average_bandwidth or pl.stream_info.bandwidth
 
                 if not resolution:
                     continue
@@ -762,13 +949,9 @@ class Udemy:
                 if height in seen:
                     continue
 
-                # we need to save the individual playlists to disk also
-                playlist_path = Path(temp_path, f"index_{asset_id}_{width}x{height}.m3u8")
-
-                with open(playlist_path, "w") as f:
-                    r = self.session._get(pl.uri)
-                    r.raise_for_status()
-                    f.write(r.text)
+                # the variant playlists are kept in memory, keyed per asset and resolution
+                playlist_key = f"{asset_id}_{width}x{height}"
+                self.hls_playlists.add(playlist_key, pl.absolute_uri)
 
                 seen.add(height)
                 _temp.append(
@@ -777,9 +960,20 @@ class Udemy:
                         "height": height,
                         "width": width,
                         "extension": "mp4",
-                        "download_url": playlist_path.as_uri(),
+                        "download_url": pl.absolute_uri,
+                        "playlist_key": playlist_key,
+                        "tbr": round(bandwidth / 1000) if bandwidth else None,
                     }
                 )
+
+            if _temp and not all_qualities:
+                # the heights are in the master playlist, skip the variants we won't download
+                _temp = [select_source(_temp, quality)]
+
+            if not defer_hls:
+                # fetch all the variant playlists at once, drop the ones that failed
+                loaded = self.hls_playlists.prefetch([x["playlist_key"] for x in _temp], API_MAX_WORKERS)
+                _temp = [x for x in _temp if x["playlist_key"] in loaded]
         except Exception as error:
             logger.error(f"Udemy Says : '{error}' while fetching hls streams..")
         return _temp
@@ -801,35 +995,39 @@ class Udemy:
         # download the mpd and save it to the temp file
         mpd_path = Path(temp_path, f"index_{asset_id}.mpd")
 
+        # formats already parsed for this asset, the manifest is written again if the download removed it
+        if asset_id in self._mpd_sources:
+            manifest, sources = self._mpd_sources[asset_id]
+            if not mpd_path.exists():
+                mpd_path.write_bytes(manifest)
+            return [dict(x) for x in sources]
+
         try:
             with open(mpd_path, "wb") as f:
                 r = self.session._get(url)
                 r.raise_for_status()
                 f.write(r.content)
 
-            ytdl = yt_dlp.YoutubeDL(
-                {
-                    "quiet": True,
-                    "no_warnings": True,
-                    "allow_unplayable_formats": True,
-                    "enable_file_urls": True,
-                }
-            )
-            results = ytdl.extract_info(mpd_path.as_uri(), download=False, force_generic_extractor=True)
-            formats = results.get("formats", [])
-            best_audio = next(f for f in formats if (f["acodec"] != "none" and f["vcodec"] == "none"))
+            try:
+                formats = parse_mpd(r.content)
+            except Exception:
+                logger.warning("Native MPD parser failed, falling back to yt-dlp")
+                formats = extract_formats_ytdlp(mpd_path)
+            audio_formats = [f for f in formats if (f["acodec"] != "none" and f["vcodec"] == "none")]
             # filter formats to remove any audio only formats
             formats = [f for f in formats if f["vcodec"] != "none" and f["acodec"] == "none"]
+            best_audio = max(audio_formats, key=lambda f: f.get("tbr") or 0) if audio_formats else None
             if not best_audio:
                 raise ValueError("No suitable audio format found in MPD")
             audio_format_id = best_audio.get("format_id")
+            audio_tbr = round(best_audio.get("tbr") or 0)
 
             for format in formats:
                 video_format_id = format.get("format_id")
                 extension = format.get("ext")
                 height = format.get("height")
                 width = format.get("width")
-                tbr = format.get("tbr", 0)
+                tbr = format.get("tbr") or 0
 
                 # add to dict based on height
                 if height not in _temp:
@@ -844,6 +1042,7 @@ class Udemy:
                         "extension": extension,
                         "download_url": mpd_path.as_uri(),
                         "tbr": round(tbr),
+                        "audio_tbr": audio_tbr,
                     }
                 )
             # for each resolution, use only the highest bitrate
@@ -857,6 +1056,7 @@ class Udemy:
                     del _temp[height]
 
             _temp = _temp2
+            self._mpd_sources[asset_id] = (r.content, [dict(x) for x in _temp])
         except Exception:
             logger.exception(f"Error fetching MPD streams")
 
@@ -889,6 +1089,26 @@ class Udemy:
         Returns:
             dict: Combined results from all pages
         """
+        pages = self._iter_pagination(initial_url, initial_params)
+        data = next(pages)
+        for page_data in pages:
+            data["results"].extend(page_data["results"])
+        return data
+
+    def _iter_pagination(self, initial_url, initial_params=None):
+        """Generator version of _handle_pagination, yields every page as soon as it is available
+
+        The first page is yielded as returned by the api (with `count`, `next`, ...), the
+        following ones as {"results": [...]}, always in page order. The remaining pages
+        are fetched in the background while the caller works on the ones already yielded.
+
+        Args:
+            initial_url (str): The initial URL to fetch from
+            initial_params (dict, optional): Query parameters for the initial request. Defaults to None.
+
+        Yields:
+            dict: The page data
+        """
         page = 1
         try:
             # ✅ FIX: Check if response is None before calling .json()
@@ -896,13 +1116,17 @@ class Udemy:
             if response is None:
                 logger.fatal(f"Failed to get response from {initial_url}")
                 sys.exit(1)
+            if not response.ok:
+                logger.fatal(f"Request to {initial_url} failed: {response.status_code} {response.reason}")
+                sys.exit(1)
             
             # ✅ FIX: Handle JSON parsing errors for initial request
             try:
                 data = response.json()
             except (json.JSONDecodeError, ValueError) as e:
                 logger.warning(f"Initial request to {initial_url} returned invalid JSON: {e}. Returning empty results.")
-                return {"results": [], "next": None, "count": 0}
+                yield {"results": [], "next": None, "count": 0}
+                return
                 
         except conn_error as error:
             logger.fatal(f"Connection error: {error}")
@@ -912,45 +1136,134 @@ class Udemy:
             logger.fatal(f"Response is None or invalid: {error}")
             logger.fatal(f"URL: {initial_url}")
             sys.exit(1)
-        else:
-            _next = data.get("next")
-            _count = data.get("count")
-            est_page_count = math.ceil(_count / 100)  # 100 is the max results per page
 
-            while _next:
-                logger.info(f"> Downloading data page {page + 1}/{est_page_count}")
-                try:
-                    resp = self.session._get(_next)
-                    # ✅ FIX: Check if response is None
-                    if resp is None:
-                        logger.error(f"Failed to fetch page {page + 1}, response is None")
-                        continue
-                    if not resp.ok:
-                        logger.error(f"Failed to fetch page {page + 1}, retrying...")
-                        continue
-                    
-                    # ✅ FIX: Handle JSON parsing errors from page 3
-                    try:
-                        resp = resp.json()
-                    except (json.JSONDecodeError, ValueError) as e:
-                        logger.warning(f"Page {page + 1} returned invalid JSON: {e}. Returning {len(data.get('results', []))} items from previous pages.")
+        _next = data.get("next")
+        _count = data.get("count")
+        est_page_count = math.ceil(_count / 100)  # 100 is the max results per page
+        if not isinstance(data.get("results"), list):
+            data["results"] = []
+
+        # if the api supports random page access, fetch the remaining pages concurrently
+        page_size = (initial_params or {}).get("page_size") or parse_qs(urlparse(initial_url).query).get("page_size", [None])[0]
+        page_urls = self._build_page_urls(_next, _count, page_size, len(data["results"]))
+        if not page_urls:
+            yield data
+        else:
+            est_page_count = len(page_urls) + 1
+            # submit the remaining pages before handing out the first one, so they load while it is processed
+            executor = ThreadPoolExecutor(max_workers=min(API_MAX_WORKERS, len(page_urls)))
+            futures = [executor.submit(self._fetch_page, page_url) for page_url in page_urls]
+            try:
+                yield data
+                for page_url, future in zip(page_urls, futures):
+                    results = future.result()
+                    if results is None:
+                        # fall back to walking the remaining pages one by one
+                        logger.warning(f"Failed to fetch page {page + 1} concurrently, continuing sequentially")
+                        _next = page_url
                         break
-                        
-                except conn_error as error:
-                    logger.fatal(f"Connection error: {error}")
-                    time.sleep(0.8)
-                    sys.exit(1)
-                except AttributeError as error:
-                    logger.error(f"Response is None on page {page + 1}: {error}")
-                    continue
+                    logger.info(f"> Downloading data page {page + 1}/{est_page_count}")
+                    page = page + 1
+                    yield {"results": results}
                 else:
-                    _next = resp.get("next")
-                    results = resp.get("results")
-                    if results and isinstance(results, list):
-                        for item in resp["results"]:
-                            data["results"].append(item)
-                        page = page + 1
-            return data
+                    _next = None
+            finally:
+                # the caller may stop early, don't keep fetching pages nobody will read
+                for f in futures:
+                    f.cancel()
+                executor.shutdown(wait=False)
+
+        attempt = 0
+        while _next:
+            if attempt >= PAGE_MAX_ATTEMPTS:
+                logger.fatal(f"Failed to fetch page {page + 1} after {PAGE_MAX_ATTEMPTS} attempts")
+                sys.exit(1)
+            if attempt:
+                time.sleep(backoff_delay(attempt - 1))
+            attempt += 1
+            logger.info(f"> Downloading data page {page + 1}/{est_page_count}")
+            try:
+                resp = self.session._get(_next)
+                # ✅ FIX: Check if response is None
+                if resp is None:
+                    logger.error(f"Failed to fetch page {page + 1}, response is None")
+                    continue
+                if not resp.ok:
+                    if resp.status_code not in RETRYABLE_STATUS_CODES:
+                        # a 403 / 404 page won't come back, the results would be incomplete
+                        logger.fatal(f"Failed to fetch page {page + 1}: {resp.status_code} {resp.reason}")
+                        sys.exit(1)
+                    logger.error(f"Failed to fetch page {page + 1}, retrying...")
+                    continue
+                
+                # ✅ FIX: Handle JSON parsing errors from page 3
+                try:
+                    resp = resp.json()
+                except (json.JSONDecodeError, ValueError) as e:
+                    logger.warning(f"Page {page + 1} returned invalid JSON: {e}. Stopping at page {page}.")
+                    break
+                    
+            except conn_error as error:
+                logger.fatal(f"Connection error: {error}")
+                time.sleep(0.8)
+                sys.exit(1)
+            except AttributeError as error:
+                logger.error(f"Response is None on page {page + 1}: {error}")
+                continue
+            else:
+                attempt = 0
+                _next = resp.get("next")
+                results = resp.get("results")
+                if results and isinstance(results, list):
+                    page = page + 1
+                    yield {"results": results}
+
+    def _build_page_urls(self, next_url, count, page_size, first_page_size):
+        """Builds the urls of all the remaining pages from the first `next` link
+
+        Args:
+            next_url (str): The `next` link of the first page
+            count (int): The total number of results reported by the api
+            page_size (int or str): The page_size that was requested
+            first_page_size (int): The number of results the api returned on the first page
+
+        Returns:
+            list: The urls of pages 2..n, or None if the api doesn't allow random page access or
+            the first page doesn't have the size that was asked for (the offsets would be wrong)
+        """
+        try:
+            page_size = int(page_size)
+        except (TypeError, ValueError):
+            return None
+        if not next_url or not count or page_size <= 0:
+            return None
+        if first_page_size != min(page_size, count):
+            logger.debug(f"First page has {first_page_size} results instead of {page_size}, fetching pages sequentially")
+            return None
+
+        parsed = urlparse(next_url)
+        query = parse_qs(parsed.query, keep_blank_values=True)
+        # cursor based pagination can't be fanned out, only plain page numbers can
+        if query.get("page") != ["2"]:
+            return None
+
+        page_urls = []
+        for page in range(2, math.ceil(count / page_size) + 1):
+            query["page"] = [str(page)]
+            page_urls.append(urlunparse(parsed._replace(query=urlencode(query, doseq=True))))
+        return page_urls
+
+    def _fetch_page(self, url):
+        """Fetches a single page and returns its results, or None if the page could not be fetched"""
+        resp = self.session._get(url)
+        if resp is None or not resp.ok:
+            return None
+        try:
+            resp = resp.json()
+        except (json.JSONDecodeError, ValueError):
+            return None
+        results = resp.get("results")
+        return results if isinstance(results, list) else None
 
     def _get_subscribed_courses(self, portal_name):
         """
@@ -973,11 +1286,27 @@ class Udemy:
         b = self._get_subscription_course_enrollments(portal_name)
         return a + b
 
+    def _search_course(self, portal_name, course_name):
+        """
+        Looks up a single course with the search endpoint instead of listing all courses
+        """
+        url = URLS.COURSE_SEARCH.format(portal_name=portal_name, course_name=quote(course_name.replace("-", " ")))
+        resp = self.session._get(url)
+        if resp is None or not resp.ok:
+            return {}
+        try:
+            results = resp.json().get("results", [])
+        except (json.JSONDecodeError, ValueError):
+            return {}
+        return self._extract_course(response=results, course_name=course_name)
+
     def _extract_course_info_json(self, url, course_id):
         # self.session._headers.update({"Referer": url})
         url = URLS.COURSE.format(portal_name=portal_name, course_id=course_id)
         try:
-            resp = self.session._get(url).json()
+            resp = self.session._get(url)
+            resp.raise_for_status()
+            resp = resp.json()
         except conn_error as error:
             logger.fatal(f"Connection error: {error}")
             time.sleep(0.8)
@@ -990,6 +1319,21 @@ class Udemy:
         url = URLS.CURRICULUM_ITEMS.format(portal_name=portal_name, course_id=course_id)
         return self._handle_pagination(url, CURRICULUM_ITEMS_PARAMS)
 
+    def _stream_course_curriculum(self, course_id, portal_name):
+        """
+        Like _extract_course_curriculum, but returns the curriculum items while they are still being fetched
+
+        Returns:
+            tuple: (total number of items, iterator over the items in curriculum order)
+        """
+        url = URLS.CURRICULUM_ITEMS.format(portal_name=portal_name, course_id=course_id)
+        pages = self._iter_pagination(url, CURRICULUM_ITEMS_PARAMS)
+        first_page = next(pages)
+        entries = itertools.chain(
+            first_page["results"], itertools.chain.from_iterable(page_data["results"] for page_data in pages)
+        )
+        return first_page.get("count"), entries
+
     def _extract_course(self, response, course_name):
         _temp = {}
         if response:
@@ -1005,7 +1349,9 @@ class Udemy:
         url = URLS.COLLECTION.format(portal_name=portal_name)
         courses_lists = []
         try:
-            webpage = self.session._get(url).json()
+            webpage = self.session._get(url)
+            webpage.raise_for_status()
+            webpage = webpage.json()
         except conn_error as error:
             logger.fatal(f"Connection error: {error}")
             time.sleep(0.8)
@@ -1025,7 +1371,9 @@ class Udemy:
         try:
             url = URLS.MY_COURSES.format(portal_name=portal_name)
             url = f"{url}&is_archived=true"
-            webpage = self.session._get(url).json()
+            webpage = self.session._get(url)
+            webpage.raise_for_status()
+            webpage = webpage.json()
         except conn_error as error:
             logger.fatal(f"Connection error: {error}")
             time.sleep(0.8)
@@ -1056,16 +1404,37 @@ class Udemy:
     def _extract_course_info(self, url):
         global portal_name
         portal_name, course_name = self.extract_course_name(url)
-        course = {"portal_name": portal_name}
+        course_index = get_course_index()
+
+        # try the persistent index first, then the search endpoint
+        course = course_index.get(portal_name, course_name)
+        if course:
+            course_index.record(OUTCOME_HIT)
+        else:
+            course = self._search_course(portal_name, course_name)
+            if course:
+                course_index.record(OUTCOME_SEARCH)
 
-        # get all the courses
-        results = self._get_courses(portal_name=portal_name)
-        # find the course that matches the url slug
-        course = self._extract_course(response=results, course_name=course_name)
         if not course:
-            # try archived courses
-            results = self._archived_courses(portal_name=portal_name)
+            # get all the courses
+            results = self._get_courses(portal_name=portal_name)
+            course_index.put_many(portal_name, results)
+            # find the course that matches the url slug
             course = self._extract_course(response=results, course_name=course_name)
+            if not course:
+                # try archived courses
+                results = self._archived_courses(portal_name=portal_name)
+                course_index.put_many(portal_name, results)
+                course = self._extract_course(response=results, course_name=course_name)
+            course_index.record(OUTCOME_MISS if course else OUTCOME_NOT_FOUND)
+
+        if course:
+            course_index.put(portal_name, course)
+        if logger.isEnabledFor(logging.DEBUG):
+            stats = course_index.stats()
+            logger.debug(
+                f"> Course index: {stats['index_hit_rate']:.0%} index hits, {stats['search_hit_rate']:.0%} search hits ({stats['total']} lookups)"
+            )
 
         # if not course or is_subscription_course:
         #     course_id = self._extract_subscription_course_info(url)
@@ -1114,17 +1483,19 @@ class Udemy:
                 if stream_urls and isinstance(stream_urls, dict):
                     sources = stream_urls.get("Video")
                     tracks = asset.get("captions")
-                    # duration = asset.get("time_estimation")
-                    sources = self._extract_sources(sources, skip_hls)
+                    duration = asset.get("time_estimation")
                     subtitles = self._extract_subtitles(tracks)
-                    sources_count = len(sources)
+                    sources_count = len(sources or [])
                     subtitle_count = len(subtitles)
                     lecture.pop("data")  # remove the raw data object after processing
                     lecture = {
                         **lecture,
                         "assets": retVal,
                         "assets_count": len(retVal),
-                        "sources": sources,
+                        # resolved lazily by _resolve_sources once a quality is requested
+                        "stream_sources": sources,
+                        "sources": None,
+                        "duration": duration,
                         "subtitles": subtitles,
                         "subtitle_count": subtitle_count,
                         "sources_count": sources_count,
@@ -1150,19 +1521,20 @@ class Udemy:
                 # encrypted
                 media_sources = asset.get("media_sources")
                 if media_sources and isinstance(media_sources, list):
-                    sources = self._extract_media_sources(media_sources)
                     tracks = asset.get("captions")
-                    # duration = asset.get("time_estimation")
+                    duration = asset.get("time_estimation")
                     subtitles = self._extract_subtitles(tracks)
-                    sources_count = len(sources)
+                    sources_count = len(media_sources)
                     subtitle_count = len(subtitles)
                     lecture.pop("data")  # remove the raw data object after processing
                     lecture = {
                         **lecture,
-                        # "duration": duration,
+                        "duration": duration,
                         "assets": retVal,
                         "assets_count": len(retVal),
-                        "video_sources": sources,
+                        # resolved lazily by _resolve_sources once a quality is requested
+                        "media_sources": media_sources,
+                        "video_sources": None,
                         "subtitles": subtitles,
                         "subtitle_count": subtitle_count,
                         "sources_count": sources_count,
@@ -1196,6 +1568,30 @@ class Udemy:
 
         return lecture
 
+    def _resolve_sources(self, lecture: dict, quality=None, all_qualities=False):
+        """
+        Resolves the stream descriptors of a parsed lecture into downloadable sources,
+        fetching the manifests only now. Unless all_qualities is set, hls variants
+        other than the one closest to `quality` are never fetched.
+
+        Returns:
+            list: The sources (video_sources for encrypted lectures)
+        """
+        if lecture.get("is_encrypted"):
+            if lecture.get("video_sources") is None:
+                lecture["video_sources"] = self._extract_media_sources(lecture.get("media_sources"))
+            return lecture["video_sources"]
+
+        # a targeted resolution may have pruned the other qualities, so redo it for all of them
+        if lecture.get("sources") is None or (all_qualities and not lecture.get("all_qualities")):
+            lecture["sources"] = self._extract_sources(lecture.get("stream_sources"), skip_hls, quality, all_qualities)
+            lecture["all_qualities"] = all_qualities
+        return lecture["sources"]
+
+
+# status codes worth retrying, everything else that isn't ok fails straight away
+RETRYABLE_STATUS_CODES = [408, 425, 429, 500, 502, 503, 504]
+
 
 class Session(object):
     def __init__(self):
@@ -1207,6 +1603,18 @@ class Session(object):
                 cipher_list="ECDHE-RSA-AES256-GCM-SHA384:ECDHE-ECDSA-AES256-GCM-SHA384:ECDHE-RSA-AES256-SHA384:ECDHE-ECDSA-AES256-SHA384:ECDHE-RSA-AES128-GCM-SHA256:ECDHE-RSA-AES128-SHA256:AES256-SH"
             ),
         )
+        # cleared when the token is rejected or the connection keeps failing, the session manager then replaces the session
+        self.healthy = True
+
+    def authenticate(self, bearer_token):
+        self._session.headers.update(
+            {
+                "x-udemyandroid-skip-local-cache": "true",
+                "cache-control": "no-cache",
+                "x-udemy-bearer-token": bearer_token,
+                "authorization": f"Bearer {bearer_token}",
+            }
+        )
 
     def visit(self, portal_name: str) -> bool:
         """
@@ -1224,21 +1632,65 @@ class Session(object):
     #     self._headers["X-Udemy-Authorization"] = "Bearer {}".format(bearer_token)
 
     def _get(self, url, params=None):
+        cache = get_http_cache() if HttpCache.is_cacheable(url) else None
+        # the payloads are per account (signed media urls), no identity means no caching
+        identity = account_identity(self._session.headers, cj) if cache else None
+        if identity is None:
+            cache = None
+        cached = None
+        headers = None
+        if cache:
+            cache_key = HttpCache.make_key(url, params, identity)
+            cached = cache.get(cache_key)
+            if cached and cached.is_fresh(cache.ttl):
+                logger.debug(f"HTTP cache hit: {url}")
+                return cached.to_response()
+            if cached:
+                # stale, ask the server if it changed
+                headers = cached.revalidation_headers()
+
+        host = urlparse(url).netloc
+        limiter = get_rate_limiter()
+        connection_failed = True
         for i in range(10):
+            limiter.acquire(host)
             try:
-                req = self._session.get(url, cookies=cj, params=params)
-                if req.ok or req.status_code in [502, 503]:
-                    return req
-                if not req.ok:
-                    logger.error("Failed request " + url)
-                    logger.error(f"{req.status_code} {req.reason}, retrying (attempt {i} )...")
-                    time.sleep(0.8)
+                req = self._session.get(url, cookies=cj, params=params, headers=headers)
             except Exception as e:
                 logger.error(f"Exception during request to {url}: {e}")
                 if i < 9:  # Don't sleep on last attempt
-                    time.sleep(0.8)
+                    time.sleep(backoff_delay(i))
+                continue
+
+            connection_failed = False
+            if req.status_code == 304 and cached:
+                logger.debug(f"HTTP cache revalidated: {url}")
+                cache.refresh(cache_key)
+                return cached.to_response()
+            if req.ok:
+                if cache:
+                    cache.store(cache_key, req)
+                return req
+            if req.status_code not in RETRYABLE_STATUS_CODES:
+                # other client errors won't get any better by retrying, the failed response is
+                # returned so callers can tell them apart from None (every attempt failed)
+                logger.error(f"Failed request {url}: {req.status_code} {req.reason}")
+                if req.status_code == 401:
+                    self.healthy = False
+                return req
+
+            retry_after = parse_retry_after(req.headers.get("Retry-After"))
+            if req.status_code == 429:
+                limiter.penalize(host, retry_after)
+            delay = retry_after if retry_after is not None else backoff_delay(i)
+            logger.error("Failed request " + url)
+            logger.error(f"{req.status_code} {req.reason}, retrying in {delay:.1f}s (attempt {i} )...")
+            if i < 9:
+                time.sleep(delay)
         # ✅ FIX: Return None if all retries failed
         logger.error(f"All retries failed for {url}")
+        if connection_failed:
+            self.healthy = False
         return None
 
     def _post(self, url, data, redirect=True):
@@ -1253,6 +1705,13 @@ class Session(object):
     #     return
 
 
+def create_session(bearer_token):
+    """A new session authenticated with `bearer_token`, the visit request is left to the session manager"""
+    session = Session()
+    session.authenticate(bearer_token)
+    return session
+
+
 class UdemyAuth(object):
     def __init__(self, username="", password="", cache_session=False):
         self.username = username
@@ -1302,21 +1761,13 @@ def mux_process(
     audio_key: Union[str | None] = None,
     video_key: Union[str | None] = None,
 ):
-    codec = "hevc_nvenc" if use_nvenc else "libx265"
-    transcode = "-hwaccel cuda -hwaccel_output_format cuda" if use_nvenc else ""
     audio_decryption_arg = f"-decryption_key {audio_key}" if audio_key is not None else ""
     video_decryption_arg = f"-decryption_key {video_key}" if video_key is not None else ""
 
     if os.name == "nt":
-        if use_h265:
-            command = f'ffmpeg {transcode} -y {video_decryption_arg} -i "{video_filepath}" {audio_decryption_arg} -i "{audio_filepath}" -c:v {codec} -vtag hvc1 -crf {h265_crf} -preset {h265_preset} -c:a copy -fflags +bitexact -shortest -map_metadata -1 -metadata title="{video_title}" -metadata comment="Downloaded with Udemy-Downloader by Puyodead1 (https://github.com/Puyodead1/udemy-downloader)" "{output_path}"'
-        else:
-            command = f'ffmpeg -y {video_decryption_arg} -i "{video_filepath}" {audio_decryption_arg} -i "{audio_filepath}" -c copy -fflags +bitexact -shortest -map_metadata -1 -metadata title="{video_title}" -metadata comment="Downloaded with Udemy-Downloader by Puyodead1 (https://github.com/Puyodead1/udemy-downloader)" "{output_path}"'
+        command = f'ffmpeg -y {video_decryption_arg} -i "{video_filepath}" {audio_decryption_arg} -i "{audio_filepath}" -c copy -fflags +bitexact -shortest -map_metadata -1 -metadata title="{video_title}" -metadata comment="Downloaded with Udemy-Downloader by Puyodead1 (https://github.com/Puyodead1/udemy-downloader)" "{output_path}"'
     else:
-        if use_h265:
-            command = f'nice -n 7 ffmpeg {transcode} -y {video_decryption_arg} -i "{video_filepath}" {audio_decryption_arg} -i "{audio_filepath}" -c:v {codec} -vtag hvc1 -crf {h265_crf} -preset {h265_preset} -c:a copy -fflags +bitexact -shortest -map_metadata -1 -metadata title="{video_title}" -metadata comment="Downloaded with Udemy-Downloader by Puyodead1 (https://github.com/Puyodead1/udemy-downloader)" "{output_path}"'
-        else:
-            command = f'nice -n 7 ffmpeg -y {video_decryption_arg} -i "{video_filepath}" {audio_decryption_arg} -i "{audio_filepath}" -c copy -fflags +bitexact -shortest -map_metadata -1 -metadata title="{video_title}" -metadata comment="Downloaded with Udemy-Downloader by Puyodead1 (https://github.com/Puyodead1/udemy-downloader)" "{output_path}"'
+        command = f'nice -n 7 ffmpeg -y {video_decryption_arg} -i "{video_filepath}" {audio_decryption_arg} -i "{audio_filepath}" -c copy -fflags +bitexact -shortest -map_metadata -1 -metadata title="{video_title}" -metadata comment="Downloaded with Udemy-Downloader by Puyodead1 (https://github.com/Puyodead1/udemy-downloader)" "{output_path}"'
 
     process = subprocess.Popen(command, shell=True)
     log_subprocess_output("FFMPEG-STDOUT", process.stdout)
@@ -1328,11 +1779,38 @@ def mux_process(
     return ret_code
 
 
-def handle_segments(url, format_id, lecture_id, video_title, output_path, chapter_dir):
-    os.chdir(os.path.join(chapter_dir))
+def fragment_concurrency():
+    """How many connections a single lecture may open, within the host-wide budget"""
+    if download_lease is None:
+        return concurrent_downloads
+    return max(1, min(concurrent_downloads, download_lease.connections // concurrent_lectures))
+
+
+def lecture_rate_limit():
+    """The bytes/sec a single lecture may use, None for unlimited"""
+    if download_lease is None or not download_lease.rate:
+        return None
+    return max(1, download_lease.rate // concurrent_lectures)
+
+
+def ytdlp_rate_args():
+    rate = lecture_rate_limit()
+    return ["--limit-rate", str(rate)] if rate else []
 
-    video_filepath_enc = lecture_id + ".encrypted.mp4"
-    audio_filepath_enc = lecture_id + ".encrypted.m4a"
+
+def apply_download_budget(lease):
+    logger.info(f"> Download budget: {lease}")
+    # the aria2 daemon is only started by the first aria2 download, it picks up the limit then
+    try:
+        set_download_limit(lease.rate)
+    except Exception as e:
+        logger.debug(f"Failed to update the aria2 download limit: {e}")
+
+
+def handle_segments(url, format_id, lecture_id, video_title, output_path, chapter_dir):
+    # no os.chdir here, several lectures can be downloading at the same time
+    video_filepath_enc = os.path.join(chapter_dir, lecture_id + ".encrypted.mp4")
+    audio_filepath_enc = os.path.join(chapter_dir, lecture_id + ".encrypted.m4a")
     temp_output_path = os.path.join(chapter_dir, lecture_id + ".mp4")
 
     logger.info("> Downloading Lecture Tracks...")
@@ -1342,7 +1820,8 @@ def handle_segments(url, format_id, lecture_id, video_title, output_path, chapte
         "--force-generic-extractor",
         "--allow-unplayable-formats",
         "--concurrent-fragments",
-        f"{concurrent_downloads}",
+        f"{fragment_concurrency()}",
+        *ytdlp_rate_args(),
         "--downloader",
         "aria2c",
         "--downloader-args",
@@ -1356,10 +1835,18 @@ def handle_segments(url, format_id, lecture_id, video_title, output_path, chapte
         format_id,
         f"{url}",
     ]
-    process = subprocess.Popen(args)
-    log_subprocess_output("YTDLP-STDOUT", process.stdout)
-    log_subprocess_output("YTDLP-STDERR", process.stderr)
-    ret_code = process.wait()
+    try:
+        process = subprocess.Popen(args, cwd=chapter_dir)
+        log_subprocess_output("YTDLP-STDOUT", process.stdout)
+        log_subprocess_output("YTDLP-STDERR", process.stderr)
+        ret_code = process.wait()
+    finally:
+        # if the url is a file url, we need to remove the file after we're done with it
+        if url.startswith("file://"):
+            try:
+                os.unlink(url[7:])
+            except:
+                pass
     logger.info("> Lecture Tracks Downloaded")
 
     if ret_code != 0:
@@ -1404,6 +1891,23 @@ def handle_segments(url, format_id, lecture_id, video_title, output_path, chapte
             )
             return
 
+    # the network isn't needed any more, let the next lecture download while this one is muxed
+    return submit_postprocess(
+        video_title,
+        mux_segments,
+        video_filepath_enc,
+        audio_filepath_enc,
+        video_title,
+        temp_output_path,
+        output_path,
+        audio_key,
+        video_key,
+    )
+
+
+def mux_segments(
+    video_filepath_enc, audio_filepath_enc, video_title, temp_output_path, output_path, audio_key, video_key
+):
     try:
         # logger.info("> Decrypting video, this might take a minute...")
         # ret_code = decrypt(video_kid, video_filepath_enc, video_filepath_dec)
@@ -1426,9 +1930,6 @@ def handle_segments(url, format_id, lecture_id, video_title, output_path, chapte
             audio_key,
             video_key,
         )
-        if ret_code != 0:
-            logger.error("> Return code from ffmpeg was non-0 (error), skipping!")
-            return
         logger.info("> Merging complete, renaming final file...")
         os.rename(temp_output_path, output_path)
         logger.info("> Cleaning up temporary files...")
@@ -1436,14 +1937,8 @@ def handle_segments(url, format_id, lecture_id, video_title, output_path, chapte
         os.remove(audio_filepath_enc)
     except Exception as e:
         logger.exception(f"Muxing error: {e}")
-    finally:
-        os.chdir(HOME_DIR)
-        # if the url is a file url, we need to remove the file after we're done with it
-        if url.startswith("file://"):
-            try:
-                os.unlink(url[7:])
-            except:
-                pass
+        return
+    return submit_transcode(output_path, video_title)
 
 
 def check_for_aria():
@@ -1517,6 +2012,41 @@ def download_aria(url, file_dir, filename):
     """
     @author Puyodead1
     """
+    daemon = get_aria2_daemon()
+    if daemon:
+        return daemon.download(url, file_dir, filename)
+    return spawn_aria(url, file_dir, filename)
+
+
+def download_aria_many(downloads):
+    """
+    Downloads several (url, file_dir, filename) at once through the aria2 daemon
+    Failures are logged, they don't stop the other downloads
+
+    Returns:
+        list: Per download, None on success or the error message
+    """
+    daemon = get_aria2_daemon()
+    if daemon:
+        errors = daemon.download_many(downloads)
+    else:
+        errors = []
+        for url, file_dir, filename in downloads:
+            try:
+                spawn_aria(url, file_dir, filename)
+                errors.append(None)
+            except Exception as e:
+                errors.append(str(e))
+    for (_, _, filename), error in zip(downloads, errors):
+        if error:
+            logger.error(f"> Error downloading asset '{filename}': {error}")
+        else:
+            logger.debug(f"      > Downloaded asset '{filename}'")
+    return errors
+
+
+def spawn_aria(url, file_dir, filename):
+    """Downloads a single file with its own aria2c process (when the rpc daemon is unavailable)"""
     args = [
         "aria2c",
         url,
@@ -1533,6 +2063,9 @@ def download_aria(url, file_dir, filename):
         "--disable-ipv6",
         "--follow-torrent=false",
     ]
+    rate = lecture_rate_limit()
+    if rate:
+        args.append(f"--max-download-limit={rate}")
     process = subprocess.Popen(args)
     log_subprocess_output("ARIA2-STDOUT", process.stdout)
     log_subprocess_output("ARIA2-STDERR", process.stderr)
@@ -1542,7 +2075,17 @@ def download_aria(url, file_dir, filename):
     return ret_code
 
 
-def process_caption(caption, lecture_title, lecture_dir, tries=0):
+def wanted_caption(caption):
+    lang = caption.get("language")
+    if caption_locale == "all":
+        # Nếu tham số là 'all', chỉ chấp nhận 'en' hoặc 'vi'
+        return lang in ["en", "vi"]
+    # Nếu chỉ định rõ 1 ngôn ngữ cụ thể (ví dụ -l vi) thì chạy bình thường
+    return lang == caption_locale
+
+
+def process_caption(udemy: Udemy, caption, lecture_title, lecture_dir):
+    """Fetch a caption track with the session and write it, vtt tracks are converted in memory and only the srt is written"""
     filename = f"%s_%s.%s" % (
         sanitize_filename(lecture_title),
         caption.get("language"),
@@ -1553,47 +2096,122 @@ def process_caption(caption, lecture_title, lecture_dir, tries=0):
         caption.get("language"),
     )
     filepath = os.path.join(lecture_dir, filename)
-
-    if os.path.isfile(filepath):
+    is_vtt = caption.get("extension") == "vtt"
+    # vtt captions are journaled as the srt they are converted to
+    final_path = os.path.join(lecture_dir, filename_no_ext + ".srt") if is_vtt else filepath
+    if journal.check(KIND_CAPTION, final_path):
         logger.info("    > Caption '%s' already downloaded." % filename)
-    else:
-        logger.info(f"    >  Downloading caption: '%s'" % filename)
-        try:
-            ret_code = download_aria(caption.get("download_url"), lecture_dir, filename)
-            logger.debug(f"      > Download return code: {ret_code}")
-        except Exception as e:
-            if tries >= 3:
-                logger.error(f"    > Error downloading caption: {e}. Exceeded retries, skipping.")
-                return
-            else:
-                logger.error(f"    > Error downloading caption: {e}. Will retry {3-tries} more times.")
-                process_caption(caption, lecture_title, lecture_dir, tries + 1)
-        if caption.get("extension") == "vtt":
+        return
+    journal.start(KIND_CAPTION, final_path)
+
+    # the cache holds the converted srt, so it can't serve --keep-vtt
+    asset_cache = get_asset_cache() if not keep_vtt else None
+    if asset_cache and asset_cache.fetch(KIND_CAPTION, None, caption.get("download_url"), final_path, verify=False):
+        logger.info("    > Caption '%s' taken from the asset cache" % filename)
+        journal.complete(KIND_CAPTION, final_path)
+        return
+
+    logger.info(f"    >  Downloading caption: '%s'" % filename)
+    # the session retries on its own
+    r = udemy.session._get(caption.get("download_url"))
+    if r is None or not r.ok:
+        logger.error(f"    > Error downloading caption '{filename}', skipping.")
+        journal.fail(KIND_CAPTION, final_path, "caption download failed")
+        return
+
+    try:
+        text = r.content.decode("utf-8", errors="ignore")
+        if is_vtt:
+            if keep_vtt:
+                with open(filepath, mode="w", encoding="utf8") as f:
+                    f.write(text)
+            text = vtt_to_srt(text)
+        # written under a temporary name, a partial srt is never left behind
+        with open(final_path + ".part", mode="w", encoding="utf8", errors="ignore") as f:
+            f.write(text)
+        os.replace(final_path + ".part", final_path)
+    except Exception as e:
+        logger.exception(f"    > Error converting caption")
+        journal.fail(KIND_CAPTION, final_path, e)
+        return
+    if journal.complete(KIND_CAPTION, final_path) and asset_cache:
+        asset_cache.store(KIND_CAPTION, None, caption.get("download_url"), final_path)
+
+
+def process_chapter_captions(udemy: Udemy, chapter, chapter_dir):
+    """Fetch the caption tracks of every video lecture of a chapter at once"""
+    captions = []
+    for lecture in chapter.get("lectures"):
+        if lecture.get("_class") != "lecture":
+            continue
+        asset = (lecture.get("data") or {}).get("asset")
+        if not isinstance(asset, dict) or (asset.get("asset_type") or "").lower() != "video":
+            continue
+        for caption in udemy._extract_subtitles(asset.get("captions")):
+            if wanted_caption(caption):
+                captions.append((caption, lecture.get("lecture_title")))
+    if not captions:
+        return
+
+    logger.info("Processing {} caption(s) of the chapter...".format(len(captions)))
+    with ThreadPoolExecutor(max_workers=API_MAX_WORKERS, thread_name_prefix="captions") as executor:
+        futures = [
+            executor.submit(process_caption, udemy, caption, lecture_title, chapter_dir)
+            for caption, lecture_title in captions
+        ]
+        for future in futures:
             try:
-                logger.info("    > Converting caption to SRT format...")
-                convert(lecture_dir, filename_no_ext)
-                logger.info("    > Caption conversion complete.")
-                if not keep_vtt:
-                    os.remove(filepath)
+                future.result()
             except Exception:
-                logger.exception(f"    > Error converting caption")
+                logger.exception("    > Error processing caption")
+
+
+def download_hls_ytdlp(udemy: Udemy, playlist_key, lecture_id, lecture_path, chapter_dir):
+    """Downloads an hls variant playlist with yt-dlp + aria2c (encrypted playlists, or when the native downloader failed)"""
+    # yt-dlp needs the variant playlist as a file, write it next to the lecture
+    playlist_path = udemy.hls_playlists.write(playlist_key, os.path.join(chapter_dir, f"{lecture_id}.m3u8"))
+    if not playlist_path:
+        raise Exception("Failed to fetch the hls playlist")
+    url = Path(playlist_path).as_uri()
+    temp_filepath = lecture_path.replace(".mp4", ".%(ext)s")
+    cmd = [
+        "yt-dlp",
+        "--enable-file-urls",
+        "--force-generic-extractor",
+        "--concurrent-fragments",
+        f"{fragment_concurrency()}",
+        *ytdlp_rate_args(),
+        "--downloader",
+        "aria2c",
+        "--downloader-args",
+        'aria2c:"--disable-ipv6"',
+        "-o",
+        f"{temp_filepath}",
+        f"{url}",
+    ]
+    try:
+        process = subprocess.Popen(cmd)
+        log_subprocess_output("YTDLP-STDOUT", process.stdout)
+        log_subprocess_output("YTDLP-STDERR", process.stderr)
+        return process.wait()
+    finally:
+        os.unlink(playlist_path)
 
 
-def process_lecture(lecture, lecture_path, chapter_dir):
+def process_lecture(udemy: Udemy, lecture, lecture_path, chapter_dir):
     lecture_id = lecture.get("id")
     lecture_title = lecture.get("lecture_title")
     is_encrypted = lecture.get("is_encrypted")
-    lecture_sources = lecture.get("video_sources")
 
     if is_encrypted:
+        lecture_sources = udemy._resolve_sources(lecture, quality)
         if len(lecture_sources) > 0:
-            source = lecture_sources[-1]  # last index is the best quality
-            if isinstance(quality, int):
-                source = min(lecture_sources, key=lambda x: abs(int(x.get("height")) - quality))
+            source = select_source(lecture_sources, quality)
             logger.info(
                 f"      > Lecture '{lecture_title}' has DRM, attempting to download. Selected quality: {source.get('height')}"
             )
-            handle_segments(
+            log_projected_size(source, lecture)
+            return handle_segments(
                 source.get("download_url"),
                 source.get("format_id"),
                 str(lecture_id),
@@ -1605,7 +2223,7 @@ def process_lecture(lecture, lecture_path, chapter_dir):
             logger.info(f"      > Lecture '{lecture_title}' is missing media links")
             logger.debug(f"Lecture source count: {len(lecture_sources)}")
     else:
-        sources = lecture.get("sources")
+        sources = udemy._resolve_sources(lecture, quality)
         sources = sorted(sources, key=lambda x: int(x.get("height")), reverse=True)
         if sources:
             # DEBUG: Log all available sources
@@ -1615,69 +2233,40 @@ def process_lecture(lecture, lecture_path, chapter_dir):
             
             if not os.path.isfile(lecture_path):
                 logger.info("      > Lecture doesn't have DRM, attempting to download...")
-                source = sources[0]  # first index is the best quality
-                if isinstance(quality, int):
-                    source = min(sources, key=lambda x: abs(int(x.get("height")) - quality))
+                source = select_source(sources, quality)
                 try:
                     logger.info(
                         "      ====== Selected quality: %s %s",
                         source.get("type"),
                         source.get("height"),
                     )
+                    log_projected_size(source, lecture)
                     url = source.get("download_url")
                     source_type = source.get("type")
                     if source_type == "hls":
-                        temp_filepath = lecture_path.replace(".mp4", ".%(ext)s")
-                        cmd = [
-                            "yt-dlp",
-                            "--enable-file-urls",
-                            "--force-generic-extractor",
-                            "--concurrent-fragments",
-                            f"{concurrent_downloads}",
-                            "--downloader",
-                            "aria2c",
-                            "--downloader-args",
-                            'aria2c:"--disable-ipv6"',
-                            "-o",
-                            f"{temp_filepath}",
-                            f"{url}",
-                        ]
-                        process = subprocess.Popen(cmd)
-                        log_subprocess_output("YTDLP-STDOUT", process.stdout)
-                        log_subprocess_output("YTDLP-STDERR", process.stderr)
-                        ret_code = process.wait()
+                        playlist_key = source.get("playlist_key")
+                        try:
+                            playlist = udemy.hls_playlists.get(playlist_key)
+                            if playlist is None:
+                                raise Exception("Failed to fetch the hls playlist")
+                            ret_code = 1
+                            downloader = SegmentDownloader(
+                                max_workers=fragment_concurrency(), rate_limit=lecture_rate_limit
+                            )
+                            try:
+                                if downloader.download(playlist, url, lecture_path):
+                                    ret_code = 0
+                                else:
+                                    logger.info("      > Falling back to yt-dlp for this playlist")
+                            finally:
+                                downloader.close()
+                            if ret_code != 0:
+                                ret_code = download_hls_ytdlp(udemy, playlist_key, lecture_id, lecture_path, chapter_dir)
+                        finally:
+                            udemy.hls_playlists.discard(playlist_key)
                         if ret_code == 0:
-                            tmp_file_path = lecture_path + ".tmp"
                             logger.info("      > HLS Download success")
-                            if use_h265:
-                                codec = "hevc_nvenc" if use_nvenc else "libx265"
-                                transcode = "-hwaccel cuda -hwaccel_output_format cuda".split(" ") if use_nvenc else []
-                                cmd = [
-                                    "ffmpeg",
-                                    *transcode,
-                                    "-y",
-                                    "-i",
-                                    lecture_path,
-                                    "-c:v",
-                                    codec,
-                                    "-c:a",
-                                    "copy",
-                                    "-f",
-                                    "mp4",
-                                    "-metadata",
-                                    'comment="Downloaded with Udemy-Downloader by Puyodead1 (https://github.com/Puyodead1/udemy-downloader)"',
-                                    tmp_file_path,
-                                ]
-                                process = subprocess.Popen(cmd)
-                                log_subprocess_output("FFMPEG-STDOUT", process.stdout)
-                                log_subprocess_output("FFMPEG-STDERR", process.stderr)
-                                ret_code = process.wait()
-                                if ret_code == 0:
-                                    os.unlink(lecture_path)
-                                    os.rename(tmp_file_path, lecture_path)
-                                    logger.info("      > Encoding complete")
-                                else:
-                                    logger.error("      > Encoding returned non-zero return code")
+                            return submit_transcode(lecture_path, lecture_title)
                     else:
                         ret_code = download_aria(url, chapter_dir, lecture_title + ".mp4")
                         logger.debug(f"      > Download return code: {ret_code}")
@@ -1689,8 +2278,237 @@ def process_lecture(lecture, lecture_path, chapter_dir):
             logger.error("      > Missing sources for lecture", lecture)
 
 
-def process_quiz(udemy: Udemy, lecture, chapter_dir):
-    quiz = udemy._get_quiz_with_info(lecture.get("id"))
+def log_projected_size(source, lecture):
+    estimate = projected_size(source, lecture.get("duration"))
+    if estimate is not None:
+        logger.info(f"      > Projected size: {format_size(estimate)}")
+
+
+def course_video_seconds(chapters):
+    """Total length of the video lectures of a parsed curriculum, from the asset time estimations"""
+    total = 0
+    for chapter in chapters:
+        for lecture in chapter.get("lectures", []):
+            asset = (lecture.get("data") or {}).get("asset")
+            if isinstance(asset, dict) and (asset.get("asset_type") or "").lower() == "video":
+                total += asset.get("time_estimation") or 0
+    return total
+
+
+def apply_size_budget(chapters):
+    """Turn --size-budget into a bytes-per-minute budget for the course"""
+    global max_bytes_per_minute
+    total_seconds = course_video_seconds(chapters)
+    per_minute = budget_per_minute(size_budget, total_seconds)
+    if per_minute is None:
+        logger.warning("> The course has no video durations, the size budget can't be applied")
+        return
+    if max_bytes_per_minute:
+        per_minute = min(per_minute, max_bytes_per_minute)
+    max_bytes_per_minute = per_minute
+    logger.info(
+        f"> Size budget: {format_size(size_budget)} for {total_seconds / 3600:.1f}h of video,"
+        f" at most {format_size(per_minute)} per minute"
+    )
+
+
+class PostProcessor:
+    """
+    Runs the ffmpeg stages (mux, transcode) of downloaded lectures in the background
+
+    Downloads hand their post processing step over and carry on with the next
+    lecture. ffmpeg is CPU bound, so the number of steps running at once
+    follows the CPU count. The queue is bounded: submit() blocks once
+    max_workers more steps are waiting, so downloads can't run arbitrarily
+    far ahead of the muxing.
+    """
+
+    def __init__(self, max_workers):
+        self.max_workers = max_workers
+        self._executor = ThreadPoolExecutor(max_workers=max_workers, thread_name_prefix="postprocess")
+        self._slots = threading.BoundedSemaphore(max_workers * 2)
+        self._futures = []
+        self._lock = threading.Lock()
+
+    def submit(self, label, fn, *args):
+        """
+        Returns:
+            Future: Done once the step has run (whether it succeeded or not)
+        """
+        self._slots.acquire()
+        future = self._executor.submit(self._run, label, fn, *args)
+        future.add_done_callback(lambda _: self._slots.release())
+        with self._lock:
+            self._futures = [f for f in self._futures if not f.done()]
+            self._futures.append(future)
+        return future
+
+    @staticmethod
+    def _run(label, fn, *args):
+        try:
+            return fn(*args)
+        except Exception:
+            logger.exception(f"  > Error post processing '{label}'")
+
+    def join(self):
+        """Wait for every submitted step"""
+        with self._lock:
+            futures = list(self._futures)
+        if futures:
+            logger.info(f"> Waiting for {sum(1 for f in futures if not f.done())} lecture(s) to finish processing...")
+        for future in futures:
+            future.result()
+
+    def close(self):
+        self._executor.shutdown(wait=False, cancel_futures=True)
+
+
+def postprocess_workers():
+    """ffmpeg stages that can run at once, muxing is mostly I/O"""
+    return max(1, (os.cpu_count() or 1) // 2)
+
+
+def submit_postprocess(label, fn, *args):
+    """
+    Hand a post processing step to the pool, or run it right away outside of parse_new
+
+    Returns:
+        Future or None: What the step returned if it already ran
+    """
+    if post_processor is None:
+        return fn(*args)
+    return post_processor.submit(label, fn, *args)
+
+
+def submit_transcode(path, label):
+    """
+    Queue the h265 encode of a finished lecture, if --use-h265 is set
+
+    Returns:
+        Future or None: None if nothing was queued
+    """
+    if transcode_queue is None:
+        return None
+    return transcode_queue.submit(path, label)
+
+
+def when_lecture_done(pending, callback):
+    """
+    Call `callback` once the post processing of a lecture has finished
+
+    A mux step resolves to the future of the encode it queued, so the chain is
+    followed until a step doesn't hand anything on.
+    """
+    if pending is None:
+        callback()
+        return
+
+    def done(future):
+        result = None
+        if not future.cancelled() and future.exception() is None:
+            result = future.result()
+        when_lecture_done(result if isinstance(result, Future) else None, callback)
+
+    pending.add_done_callback(done)
+
+
+class LectureScheduler:
+    """
+    Runs up to `max_workers` lectures at the same time
+
+    Lectures are started in curriculum order and reported as finished in that
+    same order, whatever order they actually complete in. At most
+    2 * max_workers lectures are queued, so a streamed curriculum isn't read
+    further ahead than needed. With a single worker lectures run inline.
+    """
+
+    def __init__(self, max_workers=1):
+        self.max_workers = max_workers
+        self._executor = (
+            ThreadPoolExecutor(max_workers=max_workers, thread_name_prefix="lecture") if max_workers > 1 else None
+        )
+        self._pending = deque()
+
+    def submit(self, label, fn, *args):
+        if self._executor is None:
+            self._run(label, fn, *args)
+            return
+        while len(self._pending) >= self.max_workers * 2:
+            self._wait_oldest()
+        self._pending.append((label, self._executor.submit(self._run, label, fn, *args)))
+
+    @staticmethod
+    def _run(label, fn, *args):
+        try:
+            fn(*args)
+        except Exception:
+            logger.exception(f"  > Error processing '{label}'")
+
+    def _wait_oldest(self):
+        label, future = self._pending.popleft()
+        future.result()
+        logger.info(f"  > Finished '{label}'")
+
+    def join(self):
+        """Wait for every submitted lecture"""
+        while self._pending:
+            self._wait_oldest()
+
+    def close(self):
+        """Drop the lectures that haven't started yet (after an error or interrupt)"""
+        self._pending.clear()
+        if self._executor is not None:
+            self._executor.shutdown(wait=False, cancel_futures=True)
+
+
+class QuizPrefetcher:
+    """
+    Fetches quiz assessments in the background
+
+    Chapters are submitted as they come out of the curriculum stream, so the
+    quizzes of a chapter are usually ready by the time its lectures are done.
+    """
+
+    def __init__(self, udemy: Udemy):
+        self.udemy = udemy
+        self._executor = ThreadPoolExecutor(max_workers=API_MAX_WORKERS)
+        self._futures = {}
+
+    def submit(self, chapter):
+        quiz_ids = [
+            lecture.get("id")
+            for lecture in chapter.get("lectures")
+            if lecture.get("_class") == "quiz" and lecture.get("id") and lecture.get("id") not in self._futures
+        ]
+        if quiz_ids:
+            logger.info(f"> Prefetching {len(quiz_ids)} quiz(zes)...")
+        for quiz_id in quiz_ids:
+            self._futures[quiz_id] = self._executor.submit(self.udemy._get_quiz_with_info, quiz_id)
+
+    def get(self, quiz_id):
+        """
+        Returns:
+            dict or None: The quiz info, None if it wasn't prefetched or the fetch failed
+        """
+        future = self._futures.pop(quiz_id, None)
+        if future is None:
+            return None
+        try:
+            return future.result()
+        except Exception:
+            logger.warning(f"Failed to prefetch quiz {quiz_id}, it will be fetched when processed")
+            return None
+
+    def close(self):
+        for future in self._futures.values():
+            future.cancel()
+        self._futures.clear()
+        self._executor.shutdown(wait=False)
+
+
+def process_quiz(udemy: Udemy, lecture, chapter_dir, quiz=None):
+    if quiz is None:
+        quiz = udemy._get_quiz_with_info(lecture.get("id"))
     if quiz["_type"] == "coding-problem":
         process_coding_assignment(quiz, lecture, chapter_dir)
     else:  # Normal quiz
@@ -1745,8 +2563,10 @@ def process_coding_assignment(quiz, lecture, chapter_dir):
 
 
 def parse_new(udemy: Udemy, udemy_object: dict):
-    total_chapters = udemy_object.get("total_chapters")
-    total_lectures = udemy_object.get("total_lectures")
+    global download_lease, journal, post_processor, transcode_queue
+    # the totals are unknown while the curriculum is still streaming
+    total_chapters = udemy_object.get("total_chapters") or "?"
+    total_lectures = udemy_object.get("total_lectures") or "?"
     logger.info(f"Chapter(s) ({total_chapters})")
     logger.info(f"Lecture(s) ({total_lectures})")
 
@@ -1755,154 +2575,306 @@ def parse_new(udemy: Udemy, udemy_object: dict):
     if not os.path.exists(course_dir):
         os.mkdir(course_dir)
 
-    for chapter in udemy_object.get("chapters"):
-        current_chapter_index = int(chapter.get("chapter_index"))
-        # Skip chapters not in the filter if a filter is provided
-        if chapter_filter is not None and current_chapter_index not in chapter_filter:
-            logger.info(
-                "Skipping chapter %s as it is not in the specified filter",
-                current_chapter_index,
-            )
+    # the journal lives next to the course folder, retries of the same task pick it up
+    journal = DownloadJournal(DOWNLOAD_DIR)
+    quizzes = QuizPrefetcher(udemy) if dl_quizzes else None
+    scheduler = LectureScheduler(concurrent_lectures)
+    post_processor = PostProcessor(postprocess_workers())
+    if use_h265:
+        transcode_queue = TranscodeQueue(crf=h265_crf, preset=h265_preset, use_nvenc=use_nvenc)
+        logger.info(f"> Encoding to h265 on {transcode_queue.max_workers} worker(s)")
+    download_lease = get_budget().acquire(
+        STAGE_DOWNLOAD,
+        task_id or os.getpid(),
+        concurrent_downloads * concurrent_lectures,
+        on_change=apply_download_budget,
+    )
+    apply_download_budget(download_lease)
+    try:
+        # chapters can be a generator fed by the curriculum stream, so only look at each one once
+        for chapter in udemy_object.get("chapters"):
+            current_chapter_index = int(chapter.get("chapter_index"))
+            # Skip chapters not in the filter if a filter is provided
+            if chapter_filter is not None and current_chapter_index not in chapter_filter:
+                logger.info(
+                    "Skipping chapter %s as it is not in the specified filter",
+                    current_chapter_index,
+                )
+                continue
+
+            if quizzes:
+                quizzes.submit(chapter)
+            _process_chapter(udemy, scheduler, chapter, course_dir, quizzes, total_chapters, total_lectures)
+        scheduler.join()
+        post_processor.join()
+        # muxing queues encodes, so this goes last
+        if transcode_queue is not None:
+            transcode_queue.join()
+    finally:
+        scheduler.close()
+        post_processor.close()
+        post_processor = None
+        if transcode_queue is not None:
+            transcode_queue.close()
+            transcode_queue = None
+        if quizzes:
+            quizzes.close()
+        download_lease.release()
+        download_lease = None
+
+    summary = journal.summary()
+    if summary:
+        logger.info(f"> Download summary: { {k: v for k, v in summary.items() if k != 'failed_items'} }")
+    asset_cache = get_asset_cache()
+    if asset_cache and (asset_cache.stats["hits"] or asset_cache.stats["misses"]):
+        stats = asset_cache.stats
+        logger.info(
+            f"> Asset cache: {stats['hits']} hit(s), {stats['misses']} miss(es), {stats['stale']} stale,"
+            f" {format_size(stats['bytes_saved'])} not downloaded"
+        )
+
+
+def _process_chapter(udemy: Udemy, scheduler, chapter, course_dir, quizzes, total_chapters, total_lectures):
+    chapter_title = chapter.get("chapter_title")
+    chapter_index = chapter.get("chapter_index")
+    chapter_dir = os.path.join(course_dir, chapter_title)
+    if not os.path.exists(chapter_dir):
+        os.mkdir(chapter_dir)
+    logger.info(f"======= Processing chapter {chapter_index} of {total_chapters} =======")
+
+    if dl_captions:
+        # before the lectures are scheduled, parsing a lecture drops its raw data
+        process_chapter_captions(udemy, chapter, chapter_dir)
+
+    for lecture in chapter.get("lectures"):
+        # skip the quiz if we dont want to download it
+        if lecture.get("_class") == "quiz" and not dl_quizzes:
             continue
+        scheduler.submit(
+            lecture.get("lecture_title"), _process_lecture_item, udemy, lecture, chapter_dir, quizzes, total_lectures
+        )
 
-        chapter_title = chapter.get("chapter_title")
-        chapter_index = chapter.get("chapter_index")
-        chapter_dir = os.path.join(course_dir, chapter_title)
-        if not os.path.exists(chapter_dir):
-            os.mkdir(chapter_dir)
-        logger.info(f"======= Processing chapter {chapter_index} of {total_chapters} =======")
 
-        for lecture in chapter.get("lectures"):
-            clazz = lecture.get("_class")
+def _process_lecture_item(udemy: Udemy, lecture, chapter_dir, quizzes, total_lectures):
+    """Downloads one lecture or quiz of a chapter, may run on a scheduler thread"""
+    clazz = lecture.get("_class")
 
-            if clazz == "quiz":
-                # skip the quiz if we dont want to download it
-                if not dl_quizzes:
-                    continue
-                process_quiz(udemy, lecture, chapter_dir)
-                continue
+    if clazz == "quiz":
+        process_quiz(udemy, lecture, chapter_dir, quizzes.get(lecture.get("id")) if quizzes else None)
+        return
 
-            index = lecture.get("index")  # this is lecture_counter
-            # lecture_index = lecture.get("lecture_index")  # this is the raw object index from udemy
+    index = lecture.get("index")  # this is lecture_counter
+    # lecture_index = lecture.get("lecture_index")  # this is the raw object index from udemy
 
-            lecture_title = lecture.get("lecture_title")
-            parsed_lecture = udemy._parse_lecture(lecture)
+    lecture_title = lecture.get("lecture_title")
+    parsed_lecture = udemy._parse_lecture(lecture)
+
+    lecture_extension = parsed_lecture.get("extension")
+    extension = "mp4"  # video lectures dont have an extension property, so we assume its mp4
+    if lecture_extension != None:
+        # if the lecture extension property isnt none, set the extension to the lecture extension
+        extension = lecture_extension
+    lecture_file_name = sanitize_filename(lecture_title + "." + extension)
+    lecture_file_name = deEmojify(lecture_file_name)
+    lecture_path = os.path.join(chapter_dir, lecture_file_name)
 
-            lecture_extension = parsed_lecture.get("extension")
-            extension = "mp4"  # video lectures dont have an extension property, so we assume its mp4
-            if lecture_extension != None:
-                # if the lecture extension property isnt none, set the extension to the lecture extension
-                extension = lecture_extension
-            lecture_file_name = sanitize_filename(lecture_title + "." + extension)
-            lecture_file_name = deEmojify(lecture_file_name)
-            lecture_path = os.path.join(chapter_dir, lecture_file_name)
-
-            if not skip_lectures:
-                logger.info(f"  > Processing lecture {index} of {total_lectures}")
-
-                # Check if the lecture is already downloaded
-                if os.path.isfile(lecture_path):
-                    logger.info("      > Lecture '%s' is already downloaded, skipping..." % lecture_title)
+    if not skip_lectures:
+        logger.info(f"  > Processing lecture {index} of {total_lectures}")
+
+        # Check if the lecture is already downloaded (and verified by the journal of a previous attempt)
+        if journal.check(KIND_LECTURE, lecture_path):
+            logger.info("      > Lecture '%s' is already downloaded, skipping..." % lecture_title)
+        else:
+            # Check if the file is an html file
+            if extension == "html":
+                # if the html content is None or an empty string, skip it so we dont save empty html files
+                if parsed_lecture.get("html_content") != None and parsed_lecture.get("html_content") != "":
+                    html_content = parsed_lecture.get("html_content").encode("utf8", "ignore").decode("utf8")
+                    lecture_path = os.path.join(
+                        chapter_dir,
+                        "{}.html".format(sanitize_filename(lecture_title)),
+                    )
+                    journal.start(KIND_LECTURE, lecture_path)
+                    try:
+                        with open(lecture_path, encoding="utf8", mode="w") as f:
+                            f.write(html_content)
+                        journal.complete(KIND_LECTURE, lecture_path)
+                    except Exception as e:
+                        logger.exception("    > Failed to write html file")
+                        journal.fail(KIND_LECTURE, lecture_path, e)
+            else:
+                journal.start(KIND_LECTURE, lecture_path)
+                pending = process_lecture(udemy, parsed_lecture, lecture_path, chapter_dir)
+                # the file is only final once it has been muxed / encoded
+                when_lecture_done(pending, lambda: journal.complete(KIND_LECTURE, lecture_path))
+
+    # the captions of the whole chapter are fetched by process_chapter_captions
+
+    if dl_assets:
+        assets = parsed_lecture.get("assets")
+        logger.info("    > Processing {} asset(s) for lecture...".format(len(assets)))
+        aria_downloads = []  # file assets, downloaded together once all assets are processed
+        asset_ids = []  # the asset id of each of aria_downloads, for the asset cache
+        asset_cache = get_asset_cache()
+
+        for asset in assets:
+            asset_type = asset.get("type")
+            filename = asset.get("filename")
+            download_url = asset.get("download_url")
+
+            if asset_type == "article":
+                body = asset.get("body")
+                # stip the 03d prefix
+                lecture_path = os.path.join(
+                    chapter_dir,
+                    "{}.html".format(sanitize_filename(lecture_title)),
+                )
+                try:
+                    template_path = os.path.join(MAIN_SCRIPT_PATH, "templates", "article_template.html")
+                    with open(template_path, "r") as f:
+                        content = f.read()
+                        content = content.replace("__title_placeholder__", lecture_title[4:])
+                        content = content.replace("__data_placeholder__", body)
+                        with open(lecture_path, encoding="utf8", mode="w") as f:
+                            f.write(content)
+                except Exception as e:
+                    print("Failed to write html file: ", e)
+                    continue
+            elif asset_type == "video":
+                logger.warning(
+                    "If you're seeing this message, that means that you reached a secret area that I haven't finished! jk I haven't implemented handling for this asset type, please report this at https://github.com/Puyodead1/udemy-downloader/issues so I can add it. When reporting, please provide the following information: "
+                )
+                logger.warning("AssetType: Video; AssetData: ", asset)
+            elif (
+                asset_type == "audio"
+                or asset_type == "e-book"
+                or asset_type == "file"
+                or asset_type == "presentation"
+                or asset_type == "ebook"
+                or asset_type == "source_code"
+            ):
+                asset_path = os.path.join(chapter_dir, filename)
+                if journal.check(KIND_ASSET, asset_path):
+                    logger.info(f"      > Asset '{filename}' is already downloaded, skipping...")
+                elif asset_cache and asset_cache.fetch(KIND_ASSET, asset.get("id"), download_url, asset_path):
+                    logger.info(f"      > Asset '{filename}' taken from the asset cache")
+                    journal.complete(KIND_ASSET, asset_path)
                 else:
-                    # Check if the file is an html file
-                    if extension == "html":
-                        # if the html content is None or an empty string, skip it so we dont save empty html files
-                        if parsed_lecture.get("html_content") != None and parsed_lecture.get("html_content") != "":
-                            html_content = parsed_lecture.get("html_content").encode("utf8", "ignore").decode("utf8")
-                            lecture_path = os.path.join(
-                                chapter_dir,
-                                "{}.html".format(sanitize_filename(lecture_title)),
-                            )
-                            try:
-                                with open(lecture_path, encoding="utf8", mode="w") as f:
-                                    f.write(html_content)
-                            except Exception:
-                                logger.exception("    > Failed to write html file")
-                    else:
-                        process_lecture(parsed_lecture, lecture_path, chapter_dir)
-
-            # download subtitles for this lecture
-            subtitles = parsed_lecture.get("subtitles")
-            if dl_captions and subtitles != None and lecture_extension == None:
-                logger.info("Processing {} caption(s)...".format(len(subtitles)))
-                for subtitle in subtitles:
-                    lang = subtitle.get("language")
-                    if caption_locale == "all":
-                        # Nếu tham số là 'all', chỉ chấp nhận 'en' hoặc 'vi'
-                        if lang in ["en", "vi"]:
-                            process_caption(subtitle, lecture_title, chapter_dir)
-                    elif lang == caption_locale:
-                        # Nếu chỉ định rõ 1 ngôn ngữ cụ thể (ví dụ -l vi) thì chạy bình thường
-                        process_caption(subtitle, lecture_title, chapter_dir)
-                    # --- KẾT THÚC ĐOẠN SỬA ---
-
-            if dl_assets:
-                assets = parsed_lecture.get("assets")
-                logger.info("    > Processing {} asset(s) for lecture...".format(len(assets)))
-
-                for asset in assets:
-                    asset_type = asset.get("type")
-                    filename = asset.get("filename")
-                    download_url = asset.get("download_url")
-
-                    if asset_type == "article":
-                        body = asset.get("body")
-                        # stip the 03d prefix
-                        lecture_path = os.path.join(
-                            chapter_dir,
-                            "{}.html".format(sanitize_filename(lecture_title)),
-                        )
-                        try:
-                            template_path = os.path.join(MAIN_SCRIPT_PATH, "templates", "article_template.html")
-                            with open(template_path, "r") as f:
-                                content = f.read()
-                                content = content.replace("__title_placeholder__", lecture_title[4:])
-                                content = content.replace("__data_placeholder__", body)
-                                with open(lecture_path, encoding="utf8", mode="w") as f:
-                                    f.write(content)
-                        except Exception as e:
-                            print("Failed to write html file: ", e)
-                            continue
-                    elif asset_type == "video":
-                        logger.warning(
-                            "If you're seeing this message, that means that you reached a secret area that I haven't finished! jk I haven't implemented handling for this asset type, please report this at https://github.com/Puyodead1/udemy-downloader/issues so I can add it. When reporting, please provide the following information: "
-                        )
-                        logger.warning("AssetType: Video; AssetData: ", asset)
-                    elif (
-                        asset_type == "audio"
-                        or asset_type == "e-book"
-                        or asset_type == "file"
-                        or asset_type == "presentation"
-                        or asset_type == "ebook"
-                        or asset_type == "source_code"
-                    ):
-                        try:
-                            ret_code = download_aria(download_url, chapter_dir, filename)
-                            logger.debug(f"      > Download return code: {ret_code}")
-                        except Exception:
-                            logger.exception("> Error downloading asset")
-                    elif asset_type == "external_link":
-                        # write the external link to a shortcut file
-                        file_path = os.path.join(chapter_dir, f"{filename}.url")
-                        file = open(file_path, "w")
-                        file.write("[InternetShortcut]\n")
-                        file.write(f"URL={download_url}")
-                        file.close()
-
-                        # save all the external links to a single file
-                        savedirs, name = os.path.split(os.path.join(chapter_dir, filename))
-                        filename = "external-links.txt"
-                        filename = os.path.join(savedirs, filename)
-                        file_data = []
-                        if os.path.isfile(filename):
-                            file_data = [
-                                i.strip().lower() for i in open(filename, encoding="utf-8", errors="ignore") if i
-                            ]
-
-                        content = "\n{}\n{}\n".format(name, download_url)
-                        if name.lower() not in file_data:
-                            with open(filename, "a", encoding="utf-8", errors="ignore") as f:
-                                f.write(content)
+                    aria_downloads.append((download_url, chapter_dir, filename))
+                    asset_ids.append(asset.get("id"))
+            elif asset_type == "external_link":
+                # write the external link to a shortcut file
+                file_path = os.path.join(chapter_dir, f"{filename}.url")
+                file = open(file_path, "w")
+                file.write("[InternetShortcut]\n")
+                file.write(f"URL={download_url}")
+                file.close()
+
+                # save all the external links to a single file
+                savedirs, name = os.path.split(os.path.join(chapter_dir, filename))
+                filename = "external-links.txt"
+                filename = os.path.join(savedirs, filename)
+                # the lectures of a chapter can run concurrently and all append to this file
+                with external_links_lock:
+                    file_data = []
+                    if os.path.isfile(filename):
+                        file_data = [
+                            i.strip().lower() for i in open(filename, encoding="utf-8", errors="ignore") if i
+                        ]
+
+                    content = "\n{}\n{}\n".format(name, download_url)
+                    if name.lower() not in file_data:
+                        with open(filename, "a", encoding="utf-8", errors="ignore") as f:
+                            f.write(content)
+
+        if aria_downloads:
+            for _, file_dir, filename in aria_downloads:
+                journal.start(KIND_ASSET, os.path.join(file_dir, filename))
+            try:
+                errors = download_aria_many(aria_downloads)
+            except Exception as e:
+                logger.exception("> Error downloading assets")
+                errors = [str(e)] * len(aria_downloads)
+            for (url, file_dir, filename), asset_id, error in zip(aria_downloads, asset_ids, errors):
+                if error:
+                    journal.fail(KIND_ASSET, os.path.join(file_dir, filename), error)
+                elif journal.complete(KIND_ASSET, os.path.join(file_dir, filename)) and asset_cache:
+                    asset_cache.store(KIND_ASSET, asset_id, url, os.path.join(file_dir, filename))
+
+
+def iter_course_chapters(entries, total_entries=None):
+    """
+    Groups curriculum items into chapters
+
+    A chapter is yielded as soon as the item that follows it is seen, so this
+    can consume the curriculum while its later pages are still being fetched.
+
+    Args:
+        entries (iterable): Curriculum items in curriculum order
+        total_entries (int, optional): The number of items, only used for progress logging
+
+    Yields:
+        dict: The chapter with its lectures and quizzes
+    """
+    chapter = None
+    lecture_counter = 0
+
+    for position, entry in enumerate(entries, start=1):
+        clazz = entry.get("_class")
+
+        if clazz == "chapter":
+            if chapter is not None:
+                yield chapter
+            # reset lecture tracking
+            if not use_continuous_lecture_numbers:
+                lecture_counter = 0
+
+            chapter_index = entry.get("object_index")
+            chapter_title = "{0:02d} - ".format(chapter_index) + sanitize_filename(entry.get("title"))
+            chapter = {
+                "chapter_title": chapter_title,
+                "chapter_id": entry.get("id"),
+                "chapter_index": chapter_index,
+                "lectures": [],
+                "lecture_count": 0,
+            }
+        elif clazz == "lecture" or clazz == "quiz":
+            lecture_counter += 1
+            lecture_id = entry.get("id")
+            if chapter is None:
+                # dummy chapters to handle lectures without chapters
+                chapter_index = entry.get("object_index")
+                chapter_title = "{0:02d} - ".format(chapter_index) + sanitize_filename(entry.get("title"))
+                chapter = {
+                    "chapter_title": chapter_title,
+                    "chapter_id": lecture_id,
+                    "chapter_index": chapter_index,
+                    "lectures": [],
+                    "lecture_count": 0,
+                }
+
+            if lecture_id:
+                logger.info(f"Processing {position} of {total_entries or '?'}")
+
+                lecture_index = entry.get("object_index")
+                lecture_title = "{0:03d} ".format(lecture_counter) + sanitize_filename(entry.get("title"))
+
+                chapter["lectures"].append(
+                    {
+                        "index": lecture_counter,
+                        "lecture_index": lecture_index,
+                        "lecture_title": lecture_title,
+                        "_class": clazz,
+                        "id": lecture_id,
+                        "data": entry,
+                    }
+                )
+                chapter["lecture_count"] = len(chapter["lectures"])
+            else:
+                logger.debug(f"{clazz.capitalize()}: ID is None, skipping")
+
+    if chapter is not None:
+        yield chapter
 
 
 def _print_course_info(udemy: Udemy, udemy_object: dict):
@@ -1924,6 +2896,8 @@ def _print_course_info(udemy: Udemy, udemy_object: dict):
     logger.info("> Total Lectures: {}".format(lecture_count))
     logger.info("\n")
 
+    projected_total = 0
+    unknown_sizes = 0
     chapters = udemy_object.get("chapters")
     for chapter in chapters:
         current_chapter_index = int(chapter.get("chapter_index"))
@@ -1942,6 +2916,8 @@ def _print_course_info(udemy: Udemy, udemy_object: dict):
             lecture_index = lecture.get("lecture_index")  # this is the raw object index from udemy
             lecture_title = lecture.get("lecture_title")
             parsed_lecture = udemy._parse_lecture(lecture)
+            if parsed_lecture.get("stream_sources") is not None or parsed_lecture.get("media_sources") is not None:
+                udemy._resolve_sources(parsed_lecture, all_qualities=True)
 
             lecture_sources = parsed_lecture.get("sources")
             lecture_is_encrypted = parsed_lecture.get("is_encrypted", None)
@@ -1985,26 +2961,58 @@ def _print_course_info(udemy: Udemy, udemy_object: dict):
             if lecture_qualities:
                 logger.info("    > Qualities: {}".format(lecture_qualities))
 
+            selectable = lecture_video_sources if lecture_is_encrypted else lecture_sources
+            if selectable:
+                selected = select_source(selectable, quality)
+                estimate = projected_size(selected, parsed_lecture.get("duration"))
+                if estimate is None:
+                    unknown_sizes += 1
+                    logger.info("    > Selected: {}@{}".format(selected.get("type"), selected.get("height")))
+                else:
+                    projected_total += estimate
+                    logger.info(
+                        "    > Selected: {}@{}, ~{}".format(
+                            selected.get("type"), selected.get("height"), format_size(estimate)
+                        )
+                    )
+
         if chapter_index != chapter_count:
             logger.info("==========================================")
 
+    logger.info("> Projected course size: {} (videos only)".format(format_size(projected_total)))
+    if unknown_sizes:
+        logger.info("> {} lecture(s) don't advertise a bitrate and aren't included".format(unknown_sizes))
 
-def main():
-    global bearer_token, portal_name
-    aria_ret_val = check_for_aria()
-    if not aria_ret_val:
-        logger.fatal("> Aria2c is missing from your system or path!")
-        sys.exit(1)
 
-    ffmpeg_ret_val = check_for_ffmpeg()
-    if not ffmpeg_ret_val and not skip_lectures:
-        logger.fatal("> FFMPEG is missing from your system or path!")
-        sys.exit(1)
+def check_tools():
+    """Probe aria2c, ffmpeg and shaka-packager, each of them only until it was found once in this process"""
+    if "aria2c" not in _tools_found:
+        if not check_for_aria():
+            logger.fatal("> Aria2c is missing from your system or path!")
+            sys.exit(1)
+        _tools_found.add("aria2c")
+
+    if skip_lectures:
+        return
+    if "ffmpeg" not in _tools_found:
+        if not check_for_ffmpeg():
+            logger.fatal("> FFMPEG is missing from your system or path!")
+            sys.exit(1)
+        _tools_found.add("ffmpeg")
+
+    if "shaka-packager" not in _tools_found:
+        if not check_for_shaka():
+            logger.fatal("> Shaka Packager is missing from your system or path!")
+            sys.exit(1)
+        _tools_found.add("shaka-packager")
+
+
+_tools_found = set()
 
-    shaka_ret_val = check_for_shaka()
-    if not shaka_ret_val and not skip_lectures:
-        logger.fatal("> Shaka Packager is missing from your system or path!")
-        sys.exit(1)
+
+def main():
+    global bearer_token, portal_name
+    check_tools()
 
     if load_from_file:
         logger.info("> 'load_from_file' was specified, data will be loaded from json files instead of fetched")
@@ -2043,24 +3051,17 @@ def main():
     udemy = Udemy(bearer_token)
     portal_name = udemy.extract_portal_name(course_url)
     
-    # ✅ FIX: Set bearer token headers BEFORE visit() call
-    if bearer_token:
-        udemy.session._session.headers.update(
-            {
-                "x-udemyandroid-skip-local-cache": "true",
-                "cache-control": "no-cache",
-                "x-udemy-bearer-token": bearer_token,
-                "authorization": f"Bearer {bearer_token}",
-            }
-        )
-    else:
+    if not bearer_token:
         logger.fatal("> use a bearer token")
         sys.exit(1)
-    
-    visit_status = udemy.session.visit(portal_name)
-    if not visit_status:
+
+    # ✅ FIX: Set bearer token headers BEFORE visit() call
+    # sessions are pooled per process, and the visit is stored on disk so jobs in their own process reuse it too
+    session = get_session_manager().get(portal_name, bearer_token, lambda: create_session(bearer_token))
+    if session is None:
         logger.fatal("> Visit request failed")
         sys.exit(1)
+    udemy.session = session
 
     logger.info("> Fetching course information, this may take a minute...")
     if not load_from_file:
@@ -2070,6 +3071,20 @@ def main():
             title = sanitize_filename(course_info.get("title"))
             course_title = course_info.get("published_title")
 
+    # the curriculum only has to be complete before anything else happens when it is saved or printed,
+    # otherwise it is streamed and the first chapter is downloaded while the next pages are fetched
+    if not load_from_file and not save_to_file and not info and not size_budget:
+        logger.info("> Streaming course curriculum, downloads start with the first chapter...")
+        total_entries, entries = udemy._stream_course_curriculum(course_id, portal_name)
+        udemy_object = {}
+        udemy_object["bearer_token"] = bearer_token
+        udemy_object["course_id"] = course_id
+        udemy_object["title"] = title
+        udemy_object["course_title"] = course_title
+        udemy_object["chapters"] = iter_course_chapters(entries, total_entries)
+        parse_new(udemy, udemy_object)
+        return
+
     logger.info("> Fetching course curriculum, this may take a minute...")
     if load_from_file:
         course_json = json.loads(
@@ -2106,6 +3121,8 @@ def main():
                 mode="r",
             ).read()
         )
+        if size_budget:
+            apply_size_budget(udemy_object["chapters"])
         if info:
             _print_course_info(udemy, udemy_object)
         else:
@@ -2117,7 +3134,6 @@ def main():
         udemy_object["title"] = title
         udemy_object["course_title"] = course_title
         udemy_object["chapters"] = []
-        chapter_index_counter = -1
 
         # if resource:
         #     logger.info("> Terminating Session...")
@@ -2126,106 +3142,7 @@ def main():
 
         if course:
             logger.info("> Processing course data, this may take a minute. ")
-            lecture_counter = 0
-            lectures = []
-
-            for entry in course:
-                clazz = entry.get("_class")
-
-                if clazz == "chapter":
-                    # reset lecture tracking
-                    if not use_continuous_lecture_numbers:
-                        lecture_counter = 0
-                    lectures = []
-
-                    chapter_index = entry.get("object_index")
-                    chapter_title = "{0:02d} - ".format(chapter_index) + sanitize_filename(entry.get("title"))
-
-                    if chapter_title not in udemy_object["chapters"]:
-                        udemy_object["chapters"].append(
-                            {
-                                "chapter_title": chapter_title,
-                                "chapter_id": entry.get("id"),
-                                "chapter_index": chapter_index,
-                                "lectures": [],
-                            }
-                        )
-                        chapter_index_counter += 1
-                elif clazz == "lecture":
-                    lecture_counter += 1
-                    lecture_id = entry.get("id")
-                    if len(udemy_object["chapters"]) == 0:
-                        # dummy chapters to handle lectures without chapters
-                        chapter_index = entry.get("object_index")
-                        chapter_title = "{0:02d} - ".format(chapter_index) + sanitize_filename(entry.get("title"))
-                        if chapter_title not in udemy_object["chapters"]:
-                            udemy_object["chapters"].append(
-                                {
-                                    "chapter_title": chapter_title,
-                                    "chapter_id": lecture_id,
-                                    "chapter_index": chapter_index,
-                                    "lectures": [],
-                                }
-                            )
-                            chapter_index_counter += 1
-                    if lecture_id:
-                        logger.info(f"Processing {course.index(entry) + 1} of {len(course)}")
-
-                        lecture_index = entry.get("object_index")
-                        lecture_title = "{0:03d} ".format(lecture_counter) + sanitize_filename(entry.get("title"))
-
-                        lectures.append(
-                            {
-                                "index": lecture_counter,
-                                "lecture_index": lecture_index,
-                                "lecture_title": lecture_title,
-                                "_class": entry.get("_class"),
-                                "id": lecture_id,
-                                "data": entry,
-                            }
-                        )
-                    else:
-                        logger.debug("Lecture: ID is None, skipping")
-                elif clazz == "quiz":
-                    lecture_counter += 1
-                    lecture_id = entry.get("id")
-                    if len(udemy_object["chapters"]) == 0:
-                        # dummy chapters to handle lectures without chapters
-                        chapter_index = entry.get("object_index")
-                        chapter_title = "{0:02d} - ".format(chapter_index) + sanitize_filename(entry.get("title"))
-                        if chapter_title not in udemy_object["chapters"]:
-                            udemy_object["chapters"].append(
-                                {
-                                    "chapter_title": chapter_title,
-                                    "chapter_id": lecture_id,
-                                    "chapter_index": chapter_index,
-                                    "lectures": [],
-                                }
-                            )
-                            chapter_index_counter += 1
-
-                    if lecture_id:
-                        logger.info(f"Processing {course.index(entry) + 1} of {len(course)}")
-
-                        lecture_index = entry.get("object_index")
-                        lecture_title = "{0:03d} ".format(lecture_counter) + sanitize_filename(entry.get("title"))
-
-                        lectures.append(
-                            {
-                                "index": lecture_counter,
-                                "lecture_index": lecture_index,
-                                "lecture_title": lecture_title,
-                                "_class": entry.get("_class"),
-                                "id": lecture_id,
-                                "data": entry,
-                            }
-                        )
-                    else:
-                        logger.debug("Quiz: ID is None, skipping")
-
-                udemy_object["chapters"][chapter_index_counter]["lectures"] = lectures
-                udemy_object["chapters"][chapter_index_counter]["lecture_count"] = len(lectures)
-
+            udemy_object["chapters"] = list(iter_course_chapters(course, len(course)))
             udemy_object["total_chapters"] = len(udemy_object["chapters"])
             udemy_object["total_lectures"] = sum(
                 [entry.get("lecture_count", 0) for entry in udemy_object["chapters"] if entry]
@@ -2243,6 +3160,8 @@ def main():
                 f.write(json.dumps(udemy_object))
             logger.info("> Saved parsed data to json")
 
+        if size_budget:
+            apply_size_budget(udemy_object["chapters"])
         if info:
             _print_course_info(udemy, udemy_object)
         else:
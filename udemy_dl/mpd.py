@@ -0,0 +1,155 @@
+"""
+MPD Parser
+Lightweight DASH manifest parser, lists the formats of an MPD without
+spinning up a yt_dlp.YoutubeDL instance for every lecture
+
+The returned format dicts use the same keys (and format ids) as yt-dlp's
+generic extractor, so they can still be passed to yt-dlp with -f.
+"""
+
+import hashlib
+import sys
+import time
+import xml.etree.ElementTree as ET
+from collections import OrderedDict
+
+MIME_EXTENSIONS = {
+    "video/mp4": "mp4",
+    "audio/mp4": "m4a",
+    "video/webm": "webm",
+    "audio/webm": "webm",
+}
+
+VIDEO_CODEC_PREFIXES = ("avc", "hvc", "hev", "vp8", "vp9", "vp09", "av01", "dvh", "dvhe")
+AUDIO_CODEC_PREFIXES = ("mp4a", "ac-3", "ec-3", "opus", "vorbis", "flac")
+
+# parsed manifests, keyed by a digest of their content
+_PARSE_CACHE_SIZE = 64
+_parse_cache = OrderedDict()
+
+
+def _int_or_none(value):
+    try:
+        return int(value)
+    except (TypeError, ValueError):
+        return None
+
+
+def _content_type(attrs):
+    """Work out whether a representation is video, audio or something else"""
+    content_type = attrs.get("contentType")
+    mime_type = attrs.get("mimeType") or ""
+    if not content_type and mime_type:
+        content_type = mime_type.split("/")[0]
+    if content_type in ("video", "audio", "text", "image"):
+        return content_type
+    codecs = (attrs.get("codecs") or "").lower()
+    if codecs.startswith(VIDEO_CODEC_PREFIXES):
+        return "video"
+    if codecs.startswith(AUDIO_CODEC_PREFIXES):
+        return "audio"
+    return None
+
+
+def _parse(data):
+    root = ET.fromstring(data)
+    formats = []
+    seen = set()
+    for period in root.findall("{*}Period"):
+        for adaptation_set in period.findall("{*}AdaptationSet"):
+            for representation in adaptation_set.findall("{*}Representation"):
+                # representations inherit the attributes of their adaptation set
+                attrs = {**adaptation_set.attrib, **representation.attrib}
+                content_type = _content_type(attrs)
+                if content_type not in ("video", "audio"):
+                    continue
+                format_id = attrs.get("id")
+                if not format_id or format_id in seen:
+                    continue
+                seen.add(format_id)
+
+                bandwidth = _int_or_none(attrs.get("bandwidth"))
+                codecs = attrs.get("codecs") or None
+                formats.append(
+                    {
+                        "format_id": format_id,
+                        "ext": MIME_EXTENSIONS.get(attrs.get("mimeType"), "mp4"),
+                        "width": _int_or_none(attrs.get("width")) if content_type == "video" else None,
+                        "height": _int_or_none(attrs.get("height")) if content_type == "video" else None,
+                        "tbr": bandwidth / 1000 if bandwidth else None,
+                        "vcodec": codecs if content_type == "video" else "none",
+                        "acodec": codecs if content_type == "audio" else "none",
+                    }
+                )
+    return formats
+
+
+def parse_mpd(data):
+    """
+    Parse an MPD manifest
+
+    Args:
+        data (bytes): The manifest
+
+    Returns:
+        list: Format dicts with format_id, ext, width, height, tbr, vcodec and acodec
+    """
+    key = hashlib.sha1(data).hexdigest()
+    formats = _parse_cache.get(key)
+    if formats is None:
+        formats = _parse(data)
+        _parse_cache[key] = formats
+        if len(_parse_cache) > _PARSE_CACHE_SIZE:
+            _parse_cache.popitem(last=False)
+    else:
+        _parse_cache.move_to_end(key)
+    return [dict(f) for f in formats]
+
+
+def extract_formats_ytdlp(mpd_path):
+    """List the formats of an MPD file with yt-dlp's generic extractor (the old, slow path)"""
+    import yt_dlp
+
+    ytdl = yt_dlp.YoutubeDL(
+        {
+            "quiet": True,
+            "no_warnings": True,
+            "allow_unplayable_formats": True,
+            "enable_file_urls": True,
+        }
+    )
+    results = ytdl.extract_info(mpd_path.as_uri(), download=False, force_generic_extractor=True)
+    return results.get("formats", [])
+
+
+if __name__ == "__main__":
+    """
+    Benchmark the native parser against yt-dlp
+    Usage: python3 mpd.py <manifest.mpd> [iterations]
+    """
+    from pathlib import Path
+
+    if len(sys.argv) < 2:
+        print("Usage: python3 mpd.py <manifest.mpd> [iterations]")
+        sys.exit(1)
+
+    mpd_path = Path(sys.argv[1]).resolve()
+    iterations = int(sys.argv[2]) if len(sys.argv) > 2 else 20
+    data = mpd_path.read_bytes()
+
+    start = time.perf_counter()
+    for _ in range(iterations):
+        native_formats = _parse(data)
+    native_time = (time.perf_counter() - start) / iterations
+
+    start = time.perf_counter()
+    for _ in range(iterations):
+        ytdlp_formats = extract_formats_ytdlp(mpd_path)
+    ytdlp_time = (time.perf_counter() - start) / iterations
+
+    native_ids = sorted(f["format_id"] for f in native_formats)
+    ytdlp_ids = sorted(f["format_id"] for f in ytdlp_formats)
+    print(f"native: {native_time * 1000:.2f} ms/manifest, {len(native_formats)} formats")
+    print(f"yt-dlp: {ytdlp_time * 1000:.2f} ms/manifest, {len(ytdlp_formats)} formats")
+    print(f"speedup: {ytdlp_time / native_time:.1f}x")
+    print(f"format ids match: {native_ids == ytdlp_ids}")
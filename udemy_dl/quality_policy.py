@@ -0,0 +1,94 @@
+"""
+Quality Policy
+Bitrate-aware rendition selection
+Picks the rendition closest to the requested height among the ones that fit
+a bytes-per-minute budget. A course-wide byte budget is turned into a
+bytes-per-minute budget from the video duration of the curriculum.
+"""
+
+import re
+
+SIZE_UNITS = {"": 1, "K": 1024, "M": 1024**2, "G": 1024**3, "T": 1024**4}
+
+
+def parse_size(value):
+    """
+    Parse a human readable size, '750M', '2.5G', '1048576'
+
+    Returns:
+        int: The size in bytes
+    """
+    match = re.fullmatch(r"\s*(\d+(?:\.\d+)?)\s*([KMGT]?)i?B?\s*", str(value), re.IGNORECASE)
+    if not match:
+        raise ValueError(f"Invalid size: {value}")
+    return int(float(match.group(1)) * SIZE_UNITS[match.group(2).upper()])
+
+
+def format_size(size):
+    for unit in ("B", "KiB", "MiB", "GiB"):
+        if abs(size) < 1024:
+            return f"{size:.1f} {unit}"
+        size /= 1024
+    return f"{size:.1f} TiB"
+
+
+def source_bitrate(source):
+    """
+    The total bitrate of a source in kbit/s, video and audio
+
+    Returns:
+        float or None: None if the manifest didn't say (progressive mp4 sources)
+    """
+    tbr = source.get("tbr")
+    if not tbr:
+        return None
+    return tbr + (source.get("audio_tbr") or 0)
+
+
+def bytes_per_minute(source):
+    bitrate = source_bitrate(source)
+    if bitrate is None:
+        return None
+    return bitrate * 1000 / 8 * 60
+
+
+def projected_size(source, duration):
+    """
+    Expected size of a lecture downloaded from `source`
+
+    Args:
+        duration (int): The length of the lecture in seconds
+
+    Returns:
+        int or None: None if the bitrate or duration is unknown
+    """
+    per_minute = bytes_per_minute(source)
+    if per_minute is None or not duration:
+        return None
+    return int(per_minute * duration / 60)
+
+
+def budget_per_minute(size_budget, total_seconds):
+    """Spread a course-wide byte budget over its video minutes, None if the duration is unknown"""
+    if not total_seconds:
+        return None
+    return size_budget / (total_seconds / 60)
+
+
+def fit_to_budget(sources, max_bytes_per_minute):
+    """
+    The sources that fit a bytes-per-minute budget
+
+    If none fit, the cheapest source is the only candidate. Sources without a
+    known bitrate are only kept when no source has one, the budget can't be
+    applied then.
+    """
+    if not max_bytes_per_minute:
+        return sources
+    known = [s for s in sources if bytes_per_minute(s) is not None]
+    if not known:
+        return sources
+    fitting = [s for s in known if bytes_per_minute(s) <= max_bytes_per_minute]
+    if fitting:
+        return fitting
+    return [min(known, key=bytes_per_minute)]
@@ -0,0 +1,226 @@
+"""
+Rate Limiter
+Per-host token bucket shared by every worker process through Redis
+Falls back to an in-process bucket when Redis is not reachable
+Only the Udemy API hosts (*.udemy.com) get the strict rate, the CDN hosts
+(captions, playlists, manifests) have their own, much higher one.
+
+The bucket rate is adaptive: a 429 halves it (and pauses the host for the
+Retry-After period for all workers), then it recovers linearly over time.
+"""
+
+import email.utils
+import logging
+import os
+import random
+import threading
+import time
+from datetime import datetime, timezone
+
+import redis
+
+logger = logging.getLogger("udemy-downloader")
+
+RATE_LIMIT_RATE = float(os.getenv("UDEMY_RATE_LIMIT", 5))  # requests per second per API host (all workers)
+RATE_LIMIT_BURST = float(os.getenv("UDEMY_RATE_BURST", 10))
+RATE_LIMIT_MIN_RATE = float(os.getenv("UDEMY_RATE_MIN", 0.5))
+RATE_LIMIT_RECOVERY = float(os.getenv("UDEMY_RATE_RECOVERY", 0.05))  # requests per second regained per second
+CDN_RATE_LIMIT_RATE = float(os.getenv("UDEMY_CDN_RATE_LIMIT", 50))  # requests per second per non-API host
+CDN_RATE_LIMIT_BURST = float(os.getenv("UDEMY_CDN_RATE_BURST", 100))
+
+API_DOMAIN = "udemy.com"
+
+BACKOFF_BASE = 0.8
+BACKOFF_CAP = 30
+MAX_RETRY_AFTER = 120
+
+# Reserve one token and return how long the caller has to wait for it (seconds, as a string)
+ACQUIRE_SCRIPT = """
+local now = tonumber(ARGV[1])
+local max_rate = tonumber(ARGV[2])
+local burst = tonumber(ARGV[3])
+local recovery = tonumber(ARGV[4])
+local data = redis.call('HMGET', KEYS[1], 'tokens', 'ts', 'rate', 'blocked_until')
+local ts = tonumber(data[2]) or now
+local elapsed = math.max(0, now - ts)
+local rate = math.min(max_rate, (tonumber(data[3]) or max_rate) + elapsed * recovery)
+local tokens = math.min(burst, (tonumber(data[1]) or burst) + elapsed * rate)
+local blocked_until = tonumber(data[4]) or 0
+tokens = tokens - 1
+local wait = 0
+if tokens < 0 then
+    wait = -tokens / rate
+end
+if blocked_until > now + wait then
+    wait = blocked_until - now
+end
+redis.call('HSET', KEYS[1], 'tokens', tokens, 'ts', now, 'rate', rate, 'blocked_until', blocked_until)
+redis.call('EXPIRE', KEYS[1], 3600)
+return tostring(wait)
+"""
+
+# Halve the rate and block the host until now + retry_after
+PENALIZE_SCRIPT = """
+local now = tonumber(ARGV[1])
+local max_rate = tonumber(ARGV[2])
+local min_rate = tonumber(ARGV[3])
+local retry_after = tonumber(ARGV[4])
+local rate = tonumber(redis.call('HGET', KEYS[1], 'rate')) or max_rate
+rate = math.max(min_rate, rate / 2)
+local blocked_until = math.max(tonumber(redis.call('HGET', KEYS[1], 'blocked_until')) or 0, now + retry_after)
+redis.call('HSET', KEYS[1], 'rate', rate, 'blocked_until', blocked_until)
+redis.call('EXPIRE', KEYS[1], 3600)
+return tostring(rate)
+"""
+
+
+class RateLimiter:
+    def __init__(
+        self,
+        rate=RATE_LIMIT_RATE,
+        burst=RATE_LIMIT_BURST,
+        min_rate=RATE_LIMIT_MIN_RATE,
+        recovery=RATE_LIMIT_RECOVERY,
+        cdn_rate=CDN_RATE_LIMIT_RATE,
+        cdn_burst=CDN_RATE_LIMIT_BURST,
+    ):
+        self.rate = rate
+        self.burst = burst
+        self.cdn_rate = cdn_rate
+        self.cdn_burst = cdn_burst
+        self.min_rate = min_rate
+        self.recovery = recovery
+        self._lock = threading.Lock()
+        self._local_buckets = {}
+        self.redis_client = None
+
+        try:
+            redis_password = os.getenv("REDIS_PASSWORD", None)
+            client = redis.Redis(
+                host=os.getenv("REDIS_HOST", "localhost"),
+                port=int(os.getenv("REDIS_PORT", 6379)),
+                password=redis_password if redis_password else None,
+                db=int(os.getenv("REDIS_DB", 0)),
+                decode_responses=True,
+                socket_connect_timeout=2,
+                socket_timeout=2,
+            )
+            client.ping()
+            self.redis_client = client
+            self._acquire_script = client.register_script(ACQUIRE_SCRIPT)
+            self._penalize_script = client.register_script(PENALIZE_SCRIPT)
+        except Exception as e:
+            logger.debug(f"Rate limiter is not shared between workers, Redis unavailable: {e}")
+
+    @staticmethod
+    def _key(host):
+        return f"ratelimit:{host}"
+
+    @staticmethod
+    def is_api_host(host):
+        hostname = host.split(":")[0].lower()
+        return hostname == API_DOMAIN or hostname.endswith("." + API_DOMAIN)
+
+    def _limits(self, host):
+        """Returns: tuple: (rate, burst) of `host`"""
+        if self.is_api_host(host):
+            return self.rate, self.burst
+        return self.cdn_rate, self.cdn_burst
+
+    def acquire(self, host):
+        """Block until a request to `host` is allowed"""
+        wait = None
+        rate, burst = self._limits(host)
+        if self.redis_client:
+            try:
+                wait = float(
+                    self._acquire_script(keys=[self._key(host)], args=[time.time(), rate, burst, self.recovery])
+                )
+            except Exception as e:
+                logger.debug(f"Shared rate limiter failed, using local bucket: {e}")
+        if wait is None:
+            wait = self._acquire_local(host)
+        if wait > 0:
+            logger.debug(f"Rate limiting {host}: waiting {wait:.2f}s")
+            time.sleep(wait)
+
+    def penalize(self, host, retry_after=None):
+        """Called when the server throttled us: slow down every worker talking to `host`"""
+        retry_after = retry_after or 0
+        max_rate, _ = self._limits(host)
+        if self.redis_client:
+            try:
+                rate = self._penalize_script(
+                    keys=[self._key(host)], args=[time.time(), max_rate, self.min_rate, retry_after]
+                )
+                logger.warning(f"Throttled by {host}, shared rate lowered to {float(rate):.2f} req/s")
+                return
+            except Exception as e:
+                logger.debug(f"Shared rate limiter failed, using local bucket: {e}")
+        with self._lock:
+            bucket = self._local_bucket(host, time.time())
+            bucket["rate"] = max(self.min_rate, bucket["rate"] / 2)
+            bucket["blocked_until"] = max(bucket["blocked_until"], time.time() + retry_after)
+            logger.warning(f"Throttled by {host}, rate lowered to {bucket['rate']:.2f} req/s")
+
+    def _local_bucket(self, host, now):
+        bucket = self._local_buckets.get(host)
+        if bucket is None:
+            rate, burst = self._limits(host)
+            bucket = {"tokens": burst, "ts": now, "rate": rate, "blocked_until": 0}
+            self._local_buckets[host] = bucket
+        return bucket
+
+    def _acquire_local(self, host):
+        """Same algorithm as ACQUIRE_SCRIPT, for a single process"""
+        with self._lock:
+            now = time.time()
+            max_rate, burst = self._limits(host)
+            bucket = self._local_bucket(host, now)
+            elapsed = max(0, now - bucket["ts"])
+            bucket["rate"] = min(max_rate, bucket["rate"] + elapsed * self.recovery)
+            bucket["tokens"] = min(burst, bucket["tokens"] + elapsed * bucket["rate"]) - 1
+            bucket["ts"] = now
+            wait = -bucket["tokens"] / bucket["rate"] if bucket["tokens"] < 0 else 0
+            return max(wait, bucket["blocked_until"] - now)
+
+
+def parse_retry_after(value):
+    """
+    Parse a Retry-After header (delay in seconds or an HTTP date)
+
+    Returns:
+        float or None: Seconds to wait, capped at MAX_RETRY_AFTER
+    """
+    if not value:
+        return None
+    try:
+        seconds = float(value)
+    except ValueError:
+        try:
+            retry_at = email.utils.parsedate_to_datetime(value)
+        except (TypeError, ValueError):
+            return None
+        if retry_at.tzinfo is None:
+            retry_at = retry_at.replace(tzinfo=timezone.utc)
+        seconds = (retry_at - datetime.now(timezone.utc)).total_seconds()
+    return min(max(seconds, 0), MAX_RETRY_AFTER)
+
+
+def backoff_delay(attempt):
+    """Exponential backoff with full jitter"""
+    return random.uniform(0, min(BACKOFF_CAP, BACKOFF_BASE * (2**attempt)))
+
+
+# Global instance
+_rate_limiter = None
+_rate_limiter_lock = threading.Lock()
+
+
+def get_rate_limiter():
+    """Get or create global rate limiter instance"""
+    global _rate_limiter
+    with _rate_limiter_lock:
+        if _rate_limiter is None:
+            _rate_limiter = RateLimiter()
+    return _rate_limiter
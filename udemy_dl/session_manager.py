@@ -0,0 +1,258 @@
+"""
+Session Manager
+Keeps authenticated, visited Udemy sessions alive between downloads
+Sessions are pooled per (portal, token) so a process that runs several jobs
+pays for the TLS handshakes and the visit request once, not once per job.
+The cookies of a visit are also stored on disk (SQLite), so jobs that run in
+their own process (the forkserver download mode) reuse the visit of an
+earlier job for up to SESSION_MAX_AGE, only the connections are new.
+"""
+
+import hashlib
+import json
+import logging
+import os
+import sqlite3
+import threading
+import time
+
+from requests.cookies import create_cookie
+
+from constants import SAVED_DIR
+
+logger = logging.getLogger("udemy-downloader")
+
+SESSION_MAX_AGE = int(os.getenv("SESSION_MAX_AGE", 3600))  # re-visit after this many seconds
+SESSION_IDLE_TIMEOUT = int(os.getenv("SESSION_IDLE_TIMEOUT", 900))  # close sessions unused for this long
+SESSION_STORE_PATH = os.getenv("SESSION_STORE_PATH", os.path.join(SAVED_DIR, "sessions.db"))
+
+COOKIE_FIELDS = ("name", "value", "domain", "path", "expires", "secure")
+
+
+class VisitStore:
+    """
+    The cookies set by the visit request, per (portal_name, token hash)
+    The database is opened in WAL mode so several worker processes can share it
+    """
+
+    def __init__(self, path=SESSION_STORE_PATH):
+        self.path = path
+        self._local = threading.local()
+        os.makedirs(os.path.dirname(os.path.abspath(path)), exist_ok=True)
+        conn = self._connect()
+        with conn:
+            conn.execute(
+                "CREATE TABLE IF NOT EXISTS visits ("
+                "portal_name TEXT NOT NULL, token_hash TEXT NOT NULL, cookies_json TEXT NOT NULL, "
+                "visited_at REAL NOT NULL, PRIMARY KEY (portal_name, token_hash))"
+            )
+
+    def _connect(self):
+        """Returns a per-thread connection"""
+        conn = getattr(self._local, "conn", None)
+        if conn is None:
+            conn = sqlite3.connect(self.path, timeout=30)
+            conn.execute("PRAGMA journal_mode=WAL")
+            conn.execute("PRAGMA synchronous=NORMAL")
+            self._local.conn = conn
+        return conn
+
+    def load(self, key):
+        """
+        Returns:
+            tuple or None: (cookies, visited_at) of the stored visit
+        """
+        try:
+            row = (
+                self._connect()
+                .execute("SELECT cookies_json, visited_at FROM visits WHERE portal_name = ? AND token_hash = ?", key)
+                .fetchone()
+            )
+        except sqlite3.Error as e:
+            logger.warning(f"Session store lookup failed: {e}")
+            return None
+        return (json.loads(row[0]), row[1]) if row else None
+
+    def save(self, key, cookies, visited_at):
+        cookies_json = json.dumps([{field: getattr(c, field) for field in COOKIE_FIELDS} for c in cookies])
+        try:
+            conn = self._connect()
+            with conn:
+                conn.execute(
+                    "INSERT OR REPLACE INTO visits (portal_name, token_hash, cookies_json, visited_at) "
+                    "VALUES (?, ?, ?, ?)",
+                    (*key, cookies_json, visited_at),
+                )
+        except sqlite3.Error as e:
+            logger.warning(f"Session store write failed: {e}")
+
+    def delete(self, key):
+        try:
+            conn = self._connect()
+            with conn:
+                conn.execute("DELETE FROM visits WHERE portal_name = ? AND token_hash = ?", key)
+        except sqlite3.Error as e:
+            logger.warning(f"Session store write failed: {e}")
+
+
+class _PooledSession:
+    def __init__(self, session):
+        self.session = session
+        self.visited_at = 0
+        self.last_used = time.time()
+
+
+class SessionManager:
+    """
+    Pool of visited sessions
+
+    A session is handed out again as long as it is healthy: it hasn't been
+    flagged as broken (see Session.healthy), its visit isn't older than
+    max_age and none of its cookies have expired. Otherwise the visit is
+    repeated, and if that fails the session is replaced.
+    """
+
+    def __init__(self, max_age=SESSION_MAX_AGE, idle_timeout=SESSION_IDLE_TIMEOUT, store=None):
+        self.max_age = max_age
+        self.idle_timeout = idle_timeout
+        self.store = store
+        self._sessions = {}
+        self._lock = threading.Lock()
+
+    @staticmethod
+    def _key(portal_name, bearer_token):
+        return portal_name, hashlib.sha256((bearer_token or "").encode("utf-8")).hexdigest()
+
+    def get(self, portal_name, bearer_token, create_session):
+        """
+        Get a visited session for a portal
+
+        Args:
+            portal_name (str): The udemy portal (www, or the business subdomain)
+            bearer_token (str): The token the session is authenticated with
+            create_session (callable): create_session() -> new authenticated Session, not visited yet
+
+        Returns:
+            Session or None: None if the visit request failed
+        """
+        self.expire_idle()
+        key = self._key(portal_name, bearer_token)
+        with self._lock:
+            entry = self._sessions.get(key)
+            if entry is not None and not self._is_healthy(entry):
+                if entry.session.healthy and self._visit(entry, portal_name):
+                    logger.debug(f"Session for {portal_name} refreshed")
+                    self._save(entry, key)
+                else:
+                    logger.info(f"Session for {portal_name} is no longer usable, creating a new one")
+                    self._close(entry)
+                    del self._sessions[key]
+                    entry = None
+
+            if entry is None:
+                entry = _PooledSession(create_session())
+                if self._restore(entry, key):
+                    logger.debug(f"Reusing the stored visit for {portal_name}")
+                elif not self._visit(entry, portal_name):
+                    self._close(entry)
+                    return None
+                else:
+                    self._save(entry, key)
+                self._sessions[key] = entry
+            else:
+                logger.debug(f"Reusing session for {portal_name}")
+
+            entry.last_used = time.time()
+            return entry.session
+
+    def invalidate(self, portal_name, bearer_token):
+        """Drop a session, e.g. after the token was rejected"""
+        key = self._key(portal_name, bearer_token)
+        with self._lock:
+            entry = self._sessions.pop(key, None)
+        if self.store:
+            self.store.delete(key)
+        if entry is not None:
+            self._close(entry)
+
+    def expire_idle(self):
+        """Close the sessions that haven't been used for idle_timeout seconds"""
+        now = time.time()
+        with self._lock:
+            expired = [key for key, entry in self._sessions.items() if now - entry.last_used > self.idle_timeout]
+            entries = [self._sessions.pop(key) for key in expired]
+        for entry in entries:
+            self._close(entry)
+        if entries:
+            logger.debug(f"Closed {len(entries)} idle session(s)")
+
+    def close_all(self):
+        with self._lock:
+            entries = list(self._sessions.values())
+            self._sessions.clear()
+        for entry in entries:
+            self._close(entry)
+
+    def _is_healthy(self, entry):
+        if not entry.session.healthy:
+            return False
+        if time.time() - entry.visited_at > self.max_age:
+            return False
+        # the bot cookies set by the visit request are short lived
+        return not any(cookie.is_expired() for cookie in entry.session._session.cookies)
+
+    def _restore(self, entry, key):
+        """Put the cookies of a stored visit that is still fresh into the session of `entry`"""
+        stored = self.store.load(key) if self.store else None
+        if not stored:
+            return False
+        cookies, visited_at = stored
+        now = time.time()
+        if now - visited_at > self.max_age or any(c["expires"] and c["expires"] <= now for c in cookies):
+            return False
+        jar = entry.session._session.cookies
+        for cookie in cookies:
+            jar.set_cookie(create_cookie(**cookie))
+        entry.visited_at = visited_at
+        return True
+
+    def _save(self, entry, key):
+        if self.store:
+            self.store.save(key, entry.session._session.cookies, entry.visited_at)
+
+    @staticmethod
+    def _visit(entry, portal_name):
+        try:
+            if not entry.session.visit(portal_name):
+                return False
+        except Exception as e:
+            logger.error(f"Visit request failed: {e}")
+            return False
+        entry.visited_at = time.time()
+        return True
+
+    @staticmethod
+    def _close(entry):
+        try:
+            entry.session._session.close()
+        except Exception:
+            pass
+
+
+# Global instance
+_session_manager = None
+_session_manager_lock = threading.Lock()
+
+
+def get_session_manager():
+    """Get or create global session manager instance"""
+    global _session_manager
+    with _session_manager_lock:
+        if _session_manager is None:
+            try:
+                store = VisitStore()
+            except (OSError, sqlite3.Error) as e:
+                logger.warning(f"Session store unavailable, visits are only reused within this process: {e}")
+                store = None
+            _session_manager = SessionManager(store=store)
+    return _session_manager
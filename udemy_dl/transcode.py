@@ -0,0 +1,192 @@
+"""
+Transcode Queue
+H.265 encodes of downloaded lectures, on a worker pool of their own
+Downloads and muxing hand finished files over and move on; the encodes run
+here, sized to the CPU (or to the NVENC session limit). Sources are probed with
+ffprobe first, lectures that are already HEVC/AV1 are left as they are.
+"""
+
+import logging
+import os
+import subprocess
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+logger = logging.getLogger("udemy-downloader")
+
+TRANSCODE_THREADS_PER_JOB = int(os.getenv("TRANSCODE_THREADS_PER_JOB", 4))  # libx265 thread pool per encode
+TRANSCODE_NVENC_SESSIONS = int(os.getenv("TRANSCODE_NVENC_SESSIONS", 2))  # consumer GPUs cap concurrent sessions
+TRANSCODE_SKIP_CODECS = set(os.getenv("TRANSCODE_SKIP_CODECS", "hevc,av1").split(","))
+
+FFMPEG_COMMENT = 'comment="Downloaded with Udemy-Downloader by Puyodead1 (https://github.com/Puyodead1/udemy-downloader)"'
+
+
+def probe_video(path):
+    """
+    Codec, frame count and duration of the first video stream
+
+    Returns:
+        dict or None: {"codec": ..., "frames": int or None, "duration": float or None}, None if ffprobe failed
+    """
+    cmd = [
+        "ffprobe",
+        "-v",
+        "error",
+        "-select_streams",
+        "v:0",
+        "-show_entries",
+        "stream=codec_name,nb_frames:format=duration",
+        "-of",
+        "default=noprint_wrappers=1",
+        path,
+    ]
+    try:
+        output = subprocess.run(cmd, capture_output=True, text=True, timeout=60, check=True).stdout
+    except (OSError, subprocess.SubprocessError) as e:
+        logger.warning(f"ffprobe failed for {os.path.basename(path)}: {e}")
+        return None
+
+    values = dict(line.split("=", 1) for line in output.splitlines() if "=" in line)
+    if "codec_name" not in values:
+        return None
+
+    def number(key, cast):
+        try:
+            return cast(values.get(key))
+        except (TypeError, ValueError):
+            return None
+
+    return {"codec": values["codec_name"], "frames": number("nb_frames", int), "duration": number("duration", float)}
+
+
+class TranscodeQueue:
+    """
+    Runs H.265 encodes on a dedicated pool
+
+    Each libx265 encode is given TRANSCODE_THREADS_PER_JOB threads and the pool
+    runs as many encodes as that fits in the CPU count, so encodes don't
+    oversubscribe the cores and never hold up a download slot.
+    """
+
+    def __init__(self, crf=28, preset="medium", use_nvenc=False, max_workers=None):
+        self.crf = crf
+        self.preset = preset
+        self.use_nvenc = use_nvenc
+        if max_workers is None:
+            if use_nvenc:
+                max_workers = TRANSCODE_NVENC_SESSIONS
+            else:
+                max_workers = (os.cpu_count() or 1) // TRANSCODE_THREADS_PER_JOB
+        self.max_workers = max(1, max_workers)
+        self._executor = ThreadPoolExecutor(max_workers=self.max_workers, thread_name_prefix="transcode")
+        self._futures = []
+        self._lock = threading.Lock()
+        self.stats = {"encoded": 0, "skipped": 0, "failed": 0, "frames": 0, "seconds": 0.0}
+
+    def submit(self, path, label=None):
+        """
+        Queue the encode of `path`, the file is replaced in place once it's done
+
+        Returns:
+            Future: Resolves to True if the file was encoded, False if it was skipped or failed
+        """
+        future = self._executor.submit(self._run, path, label or os.path.basename(path))
+        with self._lock:
+            self._futures = [f for f in self._futures if not f.done()]
+            self._futures.append(future)
+        return future
+
+    def _run(self, path, label):
+        try:
+            return self.transcode(path, label)
+        except Exception:
+            logger.exception(f"  > Error encoding '{label}'")
+            self._count("failed")
+            return False
+
+    def _count(self, key, value=1):
+        with self._lock:
+            self.stats[key] += value
+
+    def _command(self, path, tmp_path):
+        cmd = ["nice", "-n", "7"] if os.name != "nt" else []
+        cmd.append("ffmpeg")
+        if self.use_nvenc:
+            cmd += ["-hwaccel", "cuda", "-hwaccel_output_format", "cuda"]
+        cmd += ["-y", "-nostats", "-loglevel", "error", "-progress", "pipe:1", "-i", path]
+        if self.use_nvenc:
+            cmd += ["-c:v", "hevc_nvenc", "-cq", str(self.crf)]
+        else:
+            cmd += [
+                "-c:v",
+                "libx265",
+                "-crf",
+                str(self.crf),
+                "-preset",
+                self.preset,
+                "-x265-params",
+                f"pools={TRANSCODE_THREADS_PER_JOB}:log-level=error",
+            ]
+        cmd += ["-vtag", "hvc1", "-c:a", "copy", "-f", "mp4", "-metadata", FFMPEG_COMMENT, tmp_path]
+        return cmd
+
+    def transcode(self, path, label):
+        probe = probe_video(path)
+        if probe is not None and probe["codec"] in TRANSCODE_SKIP_CODECS:
+            logger.info(f"      > '{label}' is already {probe['codec']}, not encoding it")
+            self._count("skipped")
+            return False
+
+        tmp_path = path + ".tmp"
+        logger.info(f"      > Encoding '{label}'...")
+        start = time.time()
+        frames = 0
+        process = subprocess.Popen(
+            self._command(path, tmp_path), stdout=subprocess.PIPE, stderr=subprocess.PIPE, text=True
+        )
+        # -progress writes key=value blocks, the frame count is all we need for the fps
+        for line in process.stdout:
+            key, _, value = line.strip().partition("=")
+            if key == "frame" and value.isdigit():
+                frames = int(value)
+        stderr = process.stderr.read()
+        ret_code = process.wait()
+        elapsed = max(time.time() - start, 0.001)
+
+        if ret_code != 0:
+            logger.error(f"      > Encoding '{label}' returned non-zero return code: {stderr.strip()[-500:]}")
+            self._count("failed")
+            try:
+                os.unlink(tmp_path)
+            except OSError:
+                pass
+            return False
+
+        os.replace(tmp_path, path)
+        self._count("encoded")
+        self._count("frames", frames)
+        self._count("seconds", elapsed)
+        speed = ""
+        if probe is not None and probe["duration"]:
+            speed = f", {probe['duration'] / elapsed:.2f}x realtime"
+        logger.info(f"      > Encoded '{label}' in {elapsed:.0f}s ({frames / elapsed:.1f} fps{speed})")
+        return True
+
+    def join(self):
+        """Wait for every queued encode"""
+        with self._lock:
+            futures = list(self._futures)
+        pending = sum(1 for f in futures if not f.done())
+        if pending:
+            logger.info(f"> Waiting for {pending} lecture(s) to finish encoding...")
+        for future in futures:
+            future.result()
+        if self.stats["seconds"]:
+            logger.info(
+                f"> Encoded {self.stats['encoded']} lecture(s) at {self.stats['frames'] / self.stats['seconds']:.1f} fps"
+                f" on average, skipped {self.stats['skipped']}, failed {self.stats['failed']}"
+            )
+
+    def close(self):
+        self._executor.shutdown(wait=False, cancel_futures=True)
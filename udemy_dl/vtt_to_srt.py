@@ -1,11 +1,105 @@
-from webvtt import WebVTT
+"""
+VTT to SRT
+Converts WebVTT captions to SubRip in memory, one cue at a time, without
+building webvtt/pysrt object models. The output is the same as the old
+webvtt + pysrt based `convert`, which is kept for the benchmark below.
+"""
+
 import html
 import os
-from pysrt.srtitem import SubRipItem
-from pysrt.srttime import SubRipTime
+import re
+import sys
+import time
+
+# cue tags that webvtt's Caption.text strips, the text inside them is kept
+CUE_TAG_RE = re.compile(r"</?(?:c[^>]*|i|b|u|ruby|rt|v[^>]*)>|<\d{2}:\d{2}:\d{2}\.\d{3}>")
+BLOCK_KEYWORDS = ("NOTE", "STYLE", "REGION")
+
+
+def _timestamp_ms(value):
+    """'01:02:03.456' or '02:03.456' -> milliseconds"""
+    clock, _, fraction = value.partition(".")
+    parts = clock.split(":")
+    seconds = 0
+    for part in parts:
+        seconds = seconds * 60 + int(part)
+    return seconds * 1000 + int(fraction.ljust(3, "0")[:3] or 0)
+
+
+def _srt_time(ms):
+    seconds, ms = divmod(ms, 1000)
+    minutes, seconds = divmod(seconds, 60)
+    hours, minutes = divmod(minutes, 60)
+    return "%02d:%02d:%02d,%03d" % (hours, minutes, seconds, ms)
+
+
+def _cue_to_srt(index, timing, text_lines):
+    start, _, rest = timing.partition("-->")
+    # the end timestamp can be followed by cue settings
+    end = rest.split(None, 1)[0] if rest.strip() else ""
+    text = html.unescape(CUE_TAG_RE.sub("", "\n".join(text_lines)))
+    return "%d\n%s --> %s\n%s\n\n" % (
+        index,
+        _srt_time(_timestamp_ms(start.strip())),
+        _srt_time(_timestamp_ms(end)),
+        text,
+    )
+
+
+def iter_srt(lines):
+    """
+    Convert WebVTT lines to SRT cues
+
+    Args:
+        lines (iterable): The lines of the caption file, with or without line endings
+
+    Yields:
+        str: One SRT cue at a time
+    """
+    index = 0
+    timing = None
+    text_lines = []
+    skipping = True  # the WEBVTT header block, and NOTE / STYLE / REGION blocks
+
+    for line in lines:
+        line = line.rstrip("\r\n")
+        if not line.strip():
+            if timing is not None:
+                index += 1
+                yield _cue_to_srt(index, timing, text_lines)
+            timing = None
+            text_lines = []
+            skipping = False
+            continue
+        if skipping:
+            continue
+        if timing is None:
+            if "-->" in line:
+                timing = line
+            elif line.startswith(BLOCK_KEYWORDS):
+                skipping = True
+            # otherwise it's a cue identifier
+            continue
+        text_lines.append(line)
+
+    if timing is not None:
+        index += 1
+        yield _cue_to_srt(index, timing, text_lines)
+
+
+def vtt_to_srt(text):
+    """Convert the text of a WebVTT file to SRT"""
+    if text.startswith("\ufeff"):
+        text = text[1:]
+    return "".join(iter_srt(text.splitlines()))
 
 
 def convert(directory, filename):
+    """Convert `directory/filename.vtt` to `directory/filename.srt` with webvtt and pysrt (the old, slow path)"""
+    from pysrt.srtitem import SubRipItem
+    from pysrt.srttime import SubRipTime
+    from webvtt import WebVTT
+
     index = 0
     vtt_filepath = os.path.join(directory, filename + ".vtt")
     srt_filepath = os.path.join(directory, filename + ".srt")
@@ -17,4 +111,42 @@ def convert(directory, filename):
         end = SubRipTime(0, 0, caption.end_in_seconds)
         srt.write(
             SubRipItem(index, start, end, html.unescape(
-                caption.text)).__str__() + "\n")
\ No newline at end of file
+                caption.text)).__str__() + "\n")
+    srt.close()
+
+
+if __name__ == "__main__":
+    """
+    Benchmark the in-memory converter against webvtt + pysrt
+    Usage: python3 vtt_to_srt.py <captions.vtt> [iterations]
+    """
+    import tempfile
+
+    if len(sys.argv) < 2:
+        print("Usage: python3 vtt_to_srt.py <captions.vtt> [iterations]")
+        sys.exit(1)
+
+    vtt_path = os.path.abspath(sys.argv[1])
+    iterations = int(sys.argv[2]) if len(sys.argv) > 2 else 50
+    with open(vtt_path, encoding="utf8", errors="ignore") as f:
+        vtt_text = f.read()
+
+    start = time.perf_counter()
+    for _ in range(iterations):
+        native_srt = vtt_to_srt(vtt_text)
+    native_time = (time.perf_counter() - start) / iterations
+
+    with tempfile.TemporaryDirectory() as tmp:
+        with open(os.path.join(tmp, "captions.vtt"), "w", encoding="utf8") as f:
+            f.write(vtt_text)
+        start = time.perf_counter()
+        for _ in range(iterations):
+            convert(tmp, "captions")
+        old_time = (time.perf_counter() - start) / iterations
+        with open(os.path.join(tmp, "captions.srt"), encoding="utf8") as f:
+            old_srt = f.read()
+
+    print(f"native: {native_time * 1000:.2f} ms/file")
+    print(f"webvtt+pysrt: {old_time * 1000:.2f} ms/file")
+    print(f"speedup: {old_time / native_time:.1f}x")
+    print(f"output matches: {native_srt == old_srt}")
@@ -5,6 +5,7 @@ ENHANCED: Real-time progress tracking via Redis Pub/Sub
 """
 
 import mysql.connector
+import mysql.connector.pooling
 import subprocess
 import os
 import shutil
@@ -17,12 +18,19 @@ from dotenv import load_dotenv
 import requests
 import hmac
 import hashlib
+import socket
 import time
 import redis
+import multiprocessing
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from contextlib import contextmanager
 from progress_emitter import emit_progress, emit_status_change, emit_order_complete
 from cookie_utils import get_udemy_token
 from lifecycle_logger import log_download_success, log_download_error, log_upload_success, log_upload_error
 from task_logger import log_info, log_error, log_warn, log_progress, log_to_node_api
+from budget import STAGE_UPLOAD, get_budget
+from journal import read_summary
 
 # ================= 0. TEE WRITER FOR DUAL OUTPUT =================
 
@@ -70,9 +78,12 @@ env_paths = [
 env_path = next((p for p in env_paths if os.path.exists(p)), None)
 load_dotenv(dotenv_path=env_path)
 
+_log_lock = threading.Lock()
+
 def log(msg):
-    """Log with timestamp"""
-    print(f"[{datetime.now().strftime('%Y-%m-%d %H:%M:%S')}] {msg}")
+    """Log with timestamp, one whole line at a time (jobs log from several threads)"""
+    with _log_lock:
+        print(f"[{datetime.now().strftime('%Y-%m-%d %H:%M:%S')}] {msg}", flush=True)
 
 # Check required environment variables (UDEMY_TOKEN is optional now, will use access_token from cookies)
 REQUIRED = ['DB_HOST', 'DB_USER', 'DB_PASSWORD', 'DB_NAME']
@@ -89,6 +100,9 @@ DB_CONFIG = {
     'connection_timeout': 300,
     'autocommit': True
 }
+# Connections kept open per worker process, and how long to wait for a free one before giving up
+DB_POOL_SIZE = int(os.getenv('DB_POOL_SIZE', 4))
+DB_POOL_WAIT_TIMEOUT = float(os.getenv('DB_POOL_WAIT_TIMEOUT', 30))
 
 # Download configuration - Get token from cookies.txt first, fallback to UDEMY_TOKEN env
 UDEMY_TOKEN = get_udemy_token()
@@ -106,6 +120,27 @@ MAX_RETRIES = 3
 # ✅ SECURITY: Reduced timeout from 40 hours to 30 minutes for better resource management
 # Can be overridden via environment variable PYTHON_DOWNLOAD_TIMEOUT
 DOWNLOAD_TIMEOUT = int(os.getenv('PYTHON_DOWNLOAD_TIMEOUT', 18000))  # 30 minutes (1800 seconds)
+# How main.py runs: 'forkserver' (forked from a process that already imported it), 'inprocess' (in this
+# process, sessions and caches are shared between jobs but the timeout can't be enforced) or 'subprocess'
+DOWNLOAD_MODE = os.getenv('DOWNLOAD_MODE', 'forkserver')
+
+# Concurrent jobs per worker process, and how many of them may use each resource at the same time
+# (network: course downloads and Drive uploads, disk: copies to VPS storage and sandbox cleanup,
+# cpu: whole downloads of jobs that encode to H.265, see H265_COURSE_TYPES; the -c copy muxing of
+# other downloads is light and not gated). 1 slot = the old one-job-at-a-time worker
+WORKER_SLOTS = max(1, int(os.getenv('WORKER_SLOTS', 1)))
+RESOURCE_SLOTS = {
+    'network': max(1, int(os.getenv('WORKER_NETWORK_SLOTS', WORKER_SLOTS))),
+    'disk': max(1, int(os.getenv('WORKER_DISK_SLOTS', 1))),
+    'cpu': max(1, int(os.getenv('WORKER_CPU_SLOTS', max(1, (os.cpu_count() or 1) // 4)))),
+}
+
+# Course types encoded to H.265 ("permanent", "temporary", comma separated), a job can set useH265 itself
+H265_COURSE_TYPES = set(filter(None, os.getenv('WORKER_H265_COURSE_TYPES', '').split(',')))
+
+# Size budgets for temporary courses (e.g. "12M" per minute of video, "3G" per course), empty = no budget
+TEMPORARY_MAX_BYTES_PER_MINUTE = os.getenv('TEMPORARY_MAX_BYTES_PER_MINUTE', '')
+TEMPORARY_SIZE_BUDGET = os.getenv('TEMPORARY_SIZE_BUDGET', '')
 
 # VPS Storage configuration
 VPS_STORAGE_PATH = os.getenv('VPS_STORAGE_PATH', '/data/courses')
@@ -113,20 +148,171 @@ API_BASE_URL = os.getenv('API_BASE_URL', 'https://api.getcourses.net')
 
 # ================= 2. HELPER FUNCTIONS =================
 
+_db_pool = None
+_db_pool_pid = None
+_db_pool_lock = threading.Lock()
+_db_metrics_lock = threading.Lock()
+_db_metrics = {
+    'connections': 0, 'wait_seconds': 0.0, 'max_wait_seconds': 0.0, 'pool_exhausted': 0,
+    'queries': 0, 'query_seconds': 0.0, 'max_query_seconds': 0.0, 'errors': 0,
+}
+
+def _record_db_metric(kind, seconds):
+    with _db_metrics_lock:
+        if kind == 'wait':
+            _db_metrics['connections'] += 1
+            _db_metrics['wait_seconds'] += seconds
+            _db_metrics['max_wait_seconds'] = max(_db_metrics['max_wait_seconds'], seconds)
+        else:
+            _db_metrics['queries'] += 1
+            _db_metrics['query_seconds'] += seconds
+            _db_metrics['max_query_seconds'] = max(_db_metrics['max_query_seconds'], seconds)
+
+def get_db_metrics():
+    """
+    Connection wait and query latency of this worker process since it started
+
+    Returns:
+        dict: Counters, totals and maxima in seconds, plus the averages
+    """
+    with _db_metrics_lock:
+        metrics = dict(_db_metrics)
+    metrics['avg_wait_ms'] = metrics['wait_seconds'] / metrics['connections'] * 1000 if metrics['connections'] else 0.0
+    metrics['avg_query_ms'] = metrics['query_seconds'] / metrics['queries'] * 1000 if metrics['queries'] else 0.0
+    return metrics
+
+def format_db_metrics():
+    m = get_db_metrics()
+    return (f"{m['queries']} queries avg {m['avg_query_ms']:.1f}ms (max {m['max_query_seconds'] * 1000:.0f}ms), "
+            f"{m['connections']} checkouts avg wait {m['avg_wait_ms']:.1f}ms (max {m['max_wait_seconds'] * 1000:.0f}ms), "
+            f"pool exhausted {m['pool_exhausted']}x, errors {m['errors']}")
+
+def get_db_pool():
+    """
+    Get or create the connection pool of this process
+    A pool inherited through fork is not reused, its sockets belong to the parent
+    """
+    global _db_pool, _db_pool_pid
+    with _db_pool_lock:
+        if _db_pool is None or _db_pool_pid != os.getpid():
+            _db_pool = mysql.connector.pooling.MySQLConnectionPool(
+                pool_name=f"worker_rq_{os.getpid()}",
+                pool_size=DB_POOL_SIZE,
+                pool_reset_session=True,
+                **DB_CONFIG
+            )
+            _db_pool_pid = os.getpid()
+            log(f"[DB] Connection pool ready ({DB_POOL_SIZE} connections)")
+    return _db_pool
+
 def get_db_connection():
     """
-    Create a new MySQL connection
-    ✅ OPTIMIZED: Simple connection management with proper error handling
+    Borrow a MySQL connection from the pool, close() hands it back
+    ✅ OPTIMIZED: Pooled connections, waits up to DB_POOL_WAIT_TIMEOUT when every connection is in use
     """
+    start = time.perf_counter()
     try:
-        conn = mysql.connector.connect(**DB_CONFIG)
-        return conn
+        pool = get_db_pool()
+        waited = False
+        while True:
+            try:
+                conn = pool.get_connection()
+                break
+            except mysql.connector.errors.PoolError:
+                # the pool doesn't block by itself, it raises as soon as it's empty
+                if not waited:
+                    waited = True
+                    with _db_metrics_lock:
+                        _db_metrics['pool_exhausted'] += 1
+                if time.perf_counter() - start >= DB_POOL_WAIT_TIMEOUT:
+                    raise
+                time.sleep(0.05)
     except mysql.connector.Error as e:
-        log(f"[DB ERR] Failed to create connection: {e}")
+        with _db_metrics_lock:
+            _db_metrics['errors'] += 1
+        log(f"[DB ERR] Failed to get connection: {e}")
         raise
     except Exception as e:
-        log(f"[DB ERR] Unexpected error creating connection: {e}")
+        log(f"[DB ERR] Unexpected error getting connection: {e}")
         raise
+    _record_db_metric('wait', time.perf_counter() - start)
+    return conn
+
+def db_query(query, params=(), fetch=None):
+    """
+    Run one statement on a pooled connection
+
+    Args:
+        fetch (str): None for statements, 'one' or 'all' for rows (as dicts)
+
+    Returns:
+        The row(s), or the affected row count if fetch is None
+    """
+    conn = get_db_connection()
+    try:
+        cur = conn.cursor(dictionary=True)
+        start = time.perf_counter()
+        try:
+            cur.execute(query, params)
+            if fetch == 'one':
+                result = cur.fetchone()
+            elif fetch == 'all':
+                result = cur.fetchall()
+            else:
+                result = cur.rowcount
+        except mysql.connector.Error:
+            with _db_metrics_lock:
+                _db_metrics['errors'] += 1
+            raise
+        finally:
+            _record_db_metric('query', time.perf_counter() - start)
+            cur.close()
+        return result
+    finally:
+        # ✅ FIX: Always hand the connection back to the pool
+        conn.close()
+
+def load_task_context(task_id):
+    """
+    Everything a job needs from download_tasks, in one query
+
+    Returns:
+        dict or None: id, status, email, course_url, order_id, course_type, None if the task doesn't exist
+    """
+    task = db_query(
+        "SELECT id, status, email, course_url, order_id, course_type FROM download_tasks WHERE id = %s",
+        (task_id,),
+        fetch='one'
+    )
+    if task is not None and not task.get('course_type'):
+        task['course_type'] = 'temporary'  # Default to temporary for backward compatibility
+    return task
+
+_resource_semaphores = {name: threading.BoundedSemaphore(count) for name, count in RESOURCE_SLOTS.items()}
+# main.py keeps its settings in module globals, so only one in-process download can run at a time
+_inprocess_lock = threading.Lock()
+
+@contextmanager
+def hold_resources(task_id, *names):
+    """
+    Hold a slot of each named resource (see RESOURCE_SLOTS) for the duration of the block
+    Slots are always taken in the same order, so two jobs can't deadlock on them
+    """
+    names = sorted(set(names))
+    held = []
+    try:
+        for name in names:
+            semaphore = _resource_semaphores[name]
+            if not semaphore.acquire(blocking=False):
+                log(f"[SLOTS] Task {task_id} waiting for a free {name} slot...")
+                start = time.time()
+                semaphore.acquire()
+                log(f"[SLOTS] Task {task_id} got a {name} slot after {time.time() - start:.0f}s")
+            held.append(semaphore)
+        yield
+    finally:
+        for semaphore in reversed(held):
+            semaphore.release()
 
 def clean_staging(task_id=None):
     """
@@ -138,7 +324,8 @@ def clean_staging(task_id=None):
         task_dir = os.path.join(STAGING_DIR, f"Task_{task_id}")
         if os.path.exists(task_dir):
             try:
-                shutil.rmtree(task_dir)
+                with hold_resources(task_id, 'disk'):
+                    shutil.rmtree(task_dir)
                 log(f"[CLEAN] Removed task directory: Task_{task_id}")
             except Exception as e:
                 log(f"[WARN] Cannot remove task dir Task_{task_id}: {e}")
@@ -151,6 +338,79 @@ def clean_staging(task_id=None):
                 log(f"[WARN] Cannot remove staging dir: {e}")
         os.makedirs(STAGING_DIR, exist_ok=True)
 
+_download_context = None
+
+def get_download_context():
+    """
+    Forkserver that has main.py (yt_dlp, bs4, m3u8, ...) imported already, started on first use
+    The children only re-run the (light) top level of this module to find _download_child
+    """
+    global _download_context
+    if _download_context is None:
+        ctx = multiprocessing.get_context('forkserver')
+        ctx.set_forkserver_preload(['main'])
+        _download_context = ctx
+    return _download_context
+
+def _download_child(argv, task_id, task_log_path):
+    """Runs in a forkserver child"""
+    # Own process group, so a timeout also kills aria2c / ffmpeg / yt-dlp
+    os.setpgrp()
+    import main
+    config = main.parse_args(argv)
+    config.task_id = task_id
+    config.log_file = task_log_path
+    try:
+        main.run(config)
+    except main.DownloadError as e:
+        sys.exit(e.exit_code)
+    finally:
+        # the child leaves through os._exit, atexit would never stop the aria2 daemon
+        from aria2_rpc import shutdown_aria2_daemon
+        shutdown_aria2_daemon()
+
+def run_download_job(cmd, cmd_safe, task_id, task_log_path):
+    """
+    Run the main.py command line `cmd` without starting a new interpreter
+    Raises the same exceptions as the subprocess path (CalledProcessError, TimeoutExpired)
+    """
+    argv = cmd[2:]  # without sys.executable and main.py
+    if DOWNLOAD_MODE == 'inprocess':
+        import main
+        config = main.parse_args(argv)
+        config.task_id = str(task_id)
+        config.log_file = task_log_path
+        try:
+            with _inprocess_lock:
+                main.run(config)
+        except main.DownloadError as e:
+            log(f"[ERROR] Download failed with exit code {e.exit_code}")
+            output_error_json(task_id, 'PROCESS_ERROR', str(e), {'exit_code': e.exit_code})
+            raise subprocess.CalledProcessError(e.exit_code, cmd_safe)
+        return
+
+    process = get_download_context().Process(
+        target=_download_child, args=(argv, str(task_id), task_log_path), name=f"download-{task_id}"
+    )
+    process.start()
+    process.join(DOWNLOAD_TIMEOUT)
+    if process.is_alive():
+        log(f"[TIMEOUT] Download exceeded {DOWNLOAD_TIMEOUT}s timeout, killing process group...")
+        output_error_json(task_id, 'TIMEOUT_ERROR', f'Download exceeded {DOWNLOAD_TIMEOUT}s timeout', {
+            'timeout_seconds': DOWNLOAD_TIMEOUT
+        })
+        try:
+            os.killpg(process.pid, signal.SIGKILL)
+        except OSError:
+            process.kill()
+        process.join(5)
+        raise subprocess.TimeoutExpired(cmd_safe, DOWNLOAD_TIMEOUT)
+    if process.exitcode != 0:
+        error_msg = f"Process failed with exit code {process.exitcode}"
+        log(f"[ERROR] {error_msg}")
+        output_error_json(task_id, 'PROCESS_ERROR', error_msg, {'exit_code': process.exitcode})
+        raise subprocess.CalledProcessError(process.exitcode, cmd_safe)
+
 def upload_to_drive(local_path, course_type='temporary'):
     """Upload folder to Google Drive using Rclone
     Args:
@@ -167,16 +427,23 @@ def upload_to_drive(local_path, course_type='temporary'):
     
     remote_path = f"{RCLONE_REMOTE}:{dest_path}/{folder_name}"
     
-    log(f"[RCLONE] Start upload: {folder_name} to {dest_path}")
-    cmd = ["rclone", "move", local_path, remote_path, "-P", "--transfers=8", "--checkers=16"]
+    # ✅ Take an upload share of the host-wide budget (uploads get a guaranteed minimum)
+    lease = get_budget().acquire(STAGE_UPLOAD, folder_name, 8)
+    log(f"[RCLONE] Start upload: {folder_name} to {dest_path} ({lease})")
+    cmd = ["rclone", "move", local_path, remote_path, "-P", f"--transfers={max(1, min(8, lease.connections))}", "--checkers=16"]
+    if lease.rate:
+        cmd.append(f"--bwlimit={max(1, lease.rate // 1024)}k")
     
     try:
-        subprocess.run(cmd, check=True)
+        with hold_resources(folder_name, 'network'):
+            subprocess.run(cmd, check=True)
         log(f"[RCLONE] ✓ Upload successful: {folder_name} to {dest_path}")
         return True
     except subprocess.CalledProcessError as e:
         log(f"[RCLONE ERR] ❌ Upload failed: {e}")
         return False
+    finally:
+        lease.release()
 
 def copy_to_vps_storage(local_path, course_slug, course_type='permanent'):
     """Copy course folder to VPS storage
@@ -199,7 +466,8 @@ def copy_to_vps_storage(local_path, course_slug, course_type='permanent'):
     try:
         # Use rsync for efficient copy
         cmd = ["rsync", "-av", "--progress", f"{local_path}/", f"{dest_path}/"]
-        result = subprocess.run(cmd, check=True, capture_output=True, text=True)
+        with hold_resources(course_slug, 'disk'):
+            result = subprocess.run(cmd, check=True, capture_output=True, text=True)
         
         log(f"[VPS STORAGE] ✓ Copy successful: {course_slug}")
         return True, dest_path
@@ -246,24 +514,19 @@ def notify_metadata_extraction(task_id, course_id, vps_path):
 def update_task_status(task_id, status, error_log=None):
     """
     Update task status in MySQL database
-    ✅ OPTIMIZED: Better error handling and connection management
+    ✅ OPTIMIZED: Pooled connection, better error handling
     """
-    conn = None
     try:
-        conn = get_db_connection()
-        cur = conn.cursor()
-        
         if error_log:
-            cur.execute(
+            db_query(
                 "UPDATE download_tasks SET status = %s, error_log = %s, updated_at = NOW() WHERE id = %s",
                 (status, error_log, task_id)
             )
         else:
-            cur.execute(
+            db_query(
                 "UPDATE download_tasks SET status = %s, updated_at = NOW() WHERE id = %s",
                 (status, task_id)
             )
-        conn.commit()
         log(f"[DB] Task {task_id} status -> {status}")
     except mysql.connector.Error as e:
         log(f"[DB ERR] MySQL error updating task {task_id}: {e}")
@@ -271,13 +534,6 @@ def update_task_status(task_id, status, error_log=None):
         log(f"[DB ERR] Failed to update task {task_id}: {e}")
         import traceback
         log(f"[DB ERR] Traceback: {traceback.format_exc()}")
-    finally:
-        # ✅ FIX: Always close connection to prevent leaks
-        if conn:
-            try:
-                conn.close()
-            except:
-                pass
 
 def notify_node_webhook(task_id, folder_name_local):
     """
@@ -356,92 +612,169 @@ def notify_node_webhook(task_id, folder_name_local):
 
 # ================= 3. MAIN PROCESSING FUNCTION =================
 
-def check_enrollment_status(task_id, max_wait_seconds=15):
+def check_enrollment_status(task_id, task=None):
     """
     Check if task is enrolled before downloading
-    Wait up to max_wait_seconds for enrollment to complete
+    A single check, jobs that have to wait for enrollment are parked (see park_job) instead of polling
     
-    ✅ OPTIMIZED: Better connection management and error handling
+    ✅ OPTIMIZED: Uses the task context already loaded for the job, no query at all in the common case
     
     Args:
         task_id (int): Task ID to check
-        max_wait_seconds (int): Maximum time to wait for enrollment (default 15 seconds)
+        task (dict): Task context from load_task_context, loaded here if not given
     
     Returns:
         tuple: (is_enrolled: bool, status: str, error_message: str)
+            status is 'waiting' while enrollment is still running, 'error' if the database couldn't be asked
     """
-    start_time = time.time()
-    check_interval = 2  # ✅ OPTIMIZED: Check every 2 seconds (faster response)
-    
     try:
-        while (time.time() - start_time) < max_wait_seconds:
-            conn = None
-            try:
-                conn = get_db_connection()
-                cur = conn.cursor(dictionary=True)
-                cur.execute(
-                    "SELECT id, status, email, course_url, order_id, course_type FROM download_tasks WHERE id = %s",
-                    (task_id,)
-                )
-                task = cur.fetchone()
-                
-                if not task:
-                    return (False, 'not_found', f'Task {task_id} not found in database')
-                
-                status = task['status']
-                order_id = task.get('order_id')
-                course_type = task.get('course_type', 'temporary')
-                
-                # Check if already enrolled
-                if status == 'enrolled':
-                    log(f"[ENROLL CHECK] ✅ Task {task_id} is enrolled, ready to download")
-                    return (True, status, None)
-                
-                # Check if enrollment failed
-                if status == 'failed':
-                    # ✅ FIX: For admin downloads, check if course might already be enrolled
-                    # Try to proceed with download anyway (course might be enrolled from previous attempt)
-                    if course_type == 'permanent' and order_id is None:
-                        log(f"[ENROLL CHECK] ⚠️ Task {task_id} enrollment failed, but this is admin download")
-                        log(f"[ENROLL CHECK] Attempting download anyway - course might already be enrolled")
-                        # Return True to allow download attempt
-                        return (True, 'failed_but_admin', f'Task {task_id} enrollment failed but proceeding for admin download')
-                    # ✅ CRITICAL: For regular orders, enrollment must succeed
-                    return (False, status, f'Task {task_id} enrollment failed - download cannot proceed')
-                
-                # Check if still processing enrollment
-                if status in ['processing', 'pending', 'paid']:
-                    elapsed = int(time.time() - start_time)
-                    if elapsed % 5 == 0:  # Log every 5 seconds to avoid spam
-                        log(f"[ENROLL CHECK] ⏳ Task {task_id} status={status}, waiting for enrollment... ({elapsed}s/{max_wait_seconds}s)")
-                    time.sleep(check_interval)
-                    continue
-                
-                # Unknown status
-                return (False, status, f'Task {task_id} has unexpected status: {status}')
-                
-            except mysql.connector.Error as e:
-                log(f"[ENROLL CHECK] [ERROR] MySQL error: {e}")
-                time.sleep(check_interval)
-            except Exception as e:
-                log(f"[ENROLL CHECK] [ERROR] Database query failed: {e}")
-                time.sleep(check_interval)
-            finally:
-                # ✅ FIX: Always close connection to prevent leaks
-                if conn:
-                    try:
-                        conn.close()
-                    except:
-                        pass
+        if task is None:
+            task = load_task_context(task_id)
         
-        # Timeout reached
-        return (False, 'timeout', f'Task {task_id} enrollment timeout after {max_wait_seconds}s')
+        if not task:
+            return (False, 'not_found', f'Task {task_id} not found in database')
         
+        status = task['status']
+        order_id = task.get('order_id')
+        course_type = task.get('course_type', 'temporary')
+        
+        # Check if already enrolled
+        if status == 'enrolled':
+            log(f"[ENROLL CHECK] ✅ Task {task_id} is enrolled, ready to download")
+            return (True, status, None)
+        
+        # Check if enrollment failed
+        if status == 'failed':
+            # ✅ FIX: For admin downloads, check if course might already be enrolled
+            # Try to proceed with download anyway (course might be enrolled from previous attempt)
+            if course_type == 'permanent' and order_id is None:
+                log(f"[ENROLL CHECK] ⚠️ Task {task_id} enrollment failed, but this is admin download")
+                log(f"[ENROLL CHECK] Attempting download anyway - course might already be enrolled")
+                # Return True to allow download attempt
+                return (True, 'failed_but_admin', f'Task {task_id} enrollment failed but proceeding for admin download')
+            # ✅ CRITICAL: For regular orders, enrollment must succeed
+            return (False, status, f'Task {task_id} enrollment failed - download cannot proceed')
+        
+        # Check if still processing enrollment
+        if status in ['processing', 'pending', 'paid']:
+            log(f"[ENROLL CHECK] ⏳ Task {task_id} status={status}, enrollment still running")
+            return (False, 'waiting', f'Task {task_id} is still being enrolled (status={status})')
+        
+        # Unknown status
+        return (False, status, f'Task {task_id} has unexpected status: {status}')
+        
+    except mysql.connector.Error as e:
+        log(f"[ENROLL CHECK] [ERROR] MySQL error: {e}")
+        return (False, 'error', f'Enrollment check failed: {e}')
     except Exception as e:
         import traceback
         log(f"[ENROLL CHECK] [CRITICAL] Enrollment check failed: {e}\n{traceback.format_exc()}")
         return (False, 'error', f'Enrollment check failed: {e}')
 
+# ================= 3b. ENROLLMENT WAIT (PARKED JOBS) =================
+
+# Redis keys (shared with the Node.js queue), parked jobs are kept by task id
+DOWNLOAD_QUEUE_KEY = 'rq:queue:downloads'
+PARKED_JOBS_KEY = 'rq:parked:downloads'  # hash: task id -> job json
+PARKED_WAKE_KEY = 'rq:delayed:downloads'  # sorted set: task id -> time of the next recheck
+# How long a job may wait for enrollment, and how often a parked job is rechecked in case an event was missed
+ENROLL_WAIT_TIMEOUT = int(os.getenv('ENROLL_WAIT_TIMEOUT', 900))
+ENROLL_RECHECK_INTERVAL = int(os.getenv('ENROLL_RECHECK_INTERVAL', 60))
+# Statuses published on task:{id}:status that end the wait
+ENROLL_WAKE_STATUSES = ('enrolled', 'failed')
+
+# Move a parked job back to the front of the queue, atomic so only one worker wakes it
+_WAKE_SCRIPT = """
+if redis.call('ZREM', KEYS[1], ARGV[1]) == 0 then
+    return 0
+end
+local job = redis.call('HGET', KEYS[2], ARGV[1])
+redis.call('HDEL', KEYS[2], ARGV[1])
+if not job then
+    return 0
+end
+redis.call('RPUSH', KEYS[3], job)
+return 1
+"""
+
+def wake_job(r, task_id, reason):
+    """
+    Put a parked job back in the download queue, it's the next one a worker pops
+
+    Returns:
+        bool: False if the job wasn't parked (or another worker woke it first)
+    """
+    if r.eval(_WAKE_SCRIPT, 3, PARKED_WAKE_KEY, PARKED_JOBS_KEY, DOWNLOAD_QUEUE_KEY, str(task_id)):
+        log(f"[ENROLL WAIT] Task {task_id} back in the queue ({reason})")
+        return True
+    return False
+
+def park_job(r, task_data, wait_until):
+    """
+    Park a job that is waiting for enrollment, the worker slot is free for other jobs meanwhile
+    It's woken by a task:{id}:status event, or rechecked every ENROLL_RECHECK_INTERVAL seconds
+
+    Args:
+        wait_until (float): Timestamp after which the job fails instead of being parked again
+    """
+    task_id = str(task_data.get('taskId'))
+    job = dict(task_data, enrollWaitUntil=wait_until)
+    recheck_at = min(time.time() + ENROLL_RECHECK_INTERVAL, wait_until)
+    pipe = r.pipeline()
+    pipe.hset(PARKED_JOBS_KEY, task_id, json.dumps(job))
+    pipe.zadd(PARKED_WAKE_KEY, {task_id: recheck_at})
+    pipe.execute()
+    log(f"[ENROLL WAIT] Task {task_id} parked until enrollment finishes ({int(wait_until - time.time())}s left)")
+    
+    # The event may have been published between the enrollment check and parking
+    try:
+        task = load_task_context(task_id)
+    except Exception as e:
+        log(f"[ENROLL WAIT] [WARN] Could not recheck task {task_id} after parking: {e}")
+        return
+    if task and task['status'] in ENROLL_WAKE_STATUSES:
+        wake_job(r, task_id, f"status {task['status']} while parking")
+
+def wake_due_jobs(r):
+    """Wake the parked jobs whose recheck time has come"""
+    for task_id in r.zrangebyscore(PARKED_WAKE_KEY, '-inf', time.time(), start=0, num=100):
+        wake_job(r, task_id, 'recheck')
+
+def enrollment_listener(r, worker_id=1):
+    """
+    Background thread of the worker: wakes parked jobs on task:{id}:status events and rechecks due ones
+    Every worker runs one, the wake script makes sure a job is only queued once
+    """
+    while True:
+        pubsub = None
+        try:
+            pubsub = r.pubsub(ignore_subscribe_messages=True)
+            pubsub.psubscribe('task:*:status')
+            log(f"[WORKER #{worker_id}] [ENROLL WAIT] Listening for enrollment events")
+            next_recheck = 0
+            while True:
+                message = pubsub.get_message(timeout=1.0)
+                if message and message['type'] == 'pmessage':
+                    try:
+                        payload = json.loads(message['data'])
+                    except (TypeError, ValueError):
+                        payload = {}
+                    if payload.get('newStatus') in ENROLL_WAKE_STATUSES:
+                        task_id = message['channel'].split(':')[1]
+                        wake_job(r, task_id, f"status {payload['newStatus']}")
+                if time.time() >= next_recheck:
+                    wake_due_jobs(r)
+                    next_recheck = time.time() + 5
+        except redis.RedisError as e:
+            log(f"[WORKER #{worker_id}] [ENROLL WAIT] [REDIS ERROR] {e}, resubscribing in 5 seconds...")
+            time.sleep(5)
+        finally:
+            if pubsub is not None:
+                try:
+                    pubsub.close()
+                except Exception:
+                    pass
+
 def validate_and_sanitize_url(url):
     """
     ✅ SECURITY: Validate and sanitize course URL to prevent command injection
@@ -517,7 +850,144 @@ def output_error_json(task_id, error_code, error_message, error_details=None):
     # Write to stderr in JSON format (Node.js can read this)
     print(json.dumps(error_output), file=sys.stderr, flush=True)
 
-def process_download(task_data):
+# ================= 3c. RELIABLE DELIVERY (LEASES) =================
+
+# A popped job is moved to the processing list of its worker and leased, the lease is renewed while the
+# job runs. If the worker dies (crash, OOM kill, PM2 restart) the lease expires and the job is requeued.
+PROCESSING_KEY_PREFIX = 'rq:processing:downloads:'  # list per worker: jobs it is running
+LEASES_KEY = 'rq:leases:downloads'  # sorted set: job json -> lease expiry
+LEASE_OWNERS_KEY = 'rq:lease_owners:downloads'  # hash: job json -> processing list it's in
+DEAD_LETTER_KEY = 'rq:dead:downloads'  # jobs that took down a worker too many times
+JOB_LEASE_TTL = int(os.getenv('JOB_LEASE_TTL', 120))
+JOB_HEARTBEAT_INTERVAL = int(os.getenv('JOB_HEARTBEAT_INTERVAL', 30))
+JOB_MAX_DELIVERIES = int(os.getenv('JOB_MAX_DELIVERIES', 3))
+
+# Requeue jobs (expired leases, or what a restarted worker left in its processing list), atomic so
+# concurrent reapers can't requeue a job twice. The delivery count and previous worker are added to
+# the job, jobs delivered JOB_MAX_DELIVERIES times go to the dead letter list instead.
+# KEYS: leases, lease owners, queue, dead letter, [processing list]  ARGV: now, limit, max deliveries
+_REQUEUE_SCRIPT = """
+local jobs
+if KEYS[5] then
+    jobs = redis.call('LRANGE', KEYS[5], 0, -1)
+else
+    jobs = redis.call('ZRANGEBYSCORE', KEYS[1], '-inf', ARGV[1], 'LIMIT', 0, tonumber(ARGV[2]))
+end
+local dead = {}
+for _, job in ipairs(jobs) do
+    local owner = redis.call('HGET', KEYS[2], job) or KEYS[5]
+    redis.call('ZREM', KEYS[1], job)
+    redis.call('HDEL', KEYS[2], job)
+    if owner then
+        redis.call('LREM', owner, 1, job)
+    end
+    local redelivered = job
+    local deliveries = 2
+    local ok, data = pcall(cjson.decode, job)
+    if ok and type(data) == 'table' then
+        deliveries = (tonumber(data['deliveries']) or 1) + 1
+        data['deliveries'] = deliveries
+        data['redeliveredFrom'] = owner
+        redelivered = cjson.encode(data)
+    end
+    if deliveries > tonumber(ARGV[3]) then
+        redis.call('LPUSH', KEYS[4], redelivered)
+        table.insert(dead, redelivered)
+    else
+        redis.call('RPUSH', KEYS[3], redelivered)
+    end
+end
+return {#jobs, dead}
+"""
+
+_active_leases = set()
+_active_leases_lock = threading.Lock()
+
+def processing_key(consumer):
+    return PROCESSING_KEY_PREFIX + consumer
+
+def pop_job(r, consumer, timeout=5):
+    """
+    Move the next job to this worker's processing list and lease it
+
+    Returns:
+        str or None: The job json, None if the queue stayed empty
+    """
+    try:
+        job_json = r.blmove(DOWNLOAD_QUEUE_KEY, processing_key(consumer), timeout, src='RIGHT', dest='LEFT')
+    except redis.ResponseError:
+        # BLMOVE needs Redis 6.2
+        job_json = r.brpoplpush(DOWNLOAD_QUEUE_KEY, processing_key(consumer), timeout)
+    if job_json:
+        pipe = r.pipeline()
+        pipe.zadd(LEASES_KEY, {job_json: time.time() + JOB_LEASE_TTL})
+        pipe.hset(LEASE_OWNERS_KEY, job_json, processing_key(consumer))
+        pipe.execute()
+        with _active_leases_lock:
+            _active_leases.add(job_json)
+    return job_json
+
+def ack_job(r, consumer, job_json):
+    """The job is done (whatever the outcome), drop its lease"""
+    with _active_leases_lock:
+        _active_leases.discard(job_json)
+    pipe = r.pipeline()
+    pipe.lrem(processing_key(consumer), 1, job_json)
+    pipe.zrem(LEASES_KEY, job_json)
+    pipe.hdel(LEASE_OWNERS_KEY, job_json)
+    pipe.execute()
+
+def renew_leases(r):
+    """Heartbeat: extend the leases of the jobs this worker is running"""
+    with _active_leases_lock:
+        jobs = list(_active_leases)
+    if not jobs:
+        return
+    expiry = time.time() + JOB_LEASE_TTL
+    pipe = r.pipeline()
+    for job_json in jobs:
+        # XX: a lease that was reaped meanwhile is not brought back
+        pipe.zadd(LEASES_KEY, {job_json: expiry}, xx=True, ch=True)
+    for job_json, renewed in zip(jobs, pipe.execute()):
+        with _active_leases_lock:
+            still_running = job_json in _active_leases
+        if not renewed and still_running:
+            log(f"[LEASE] [WARN] Lease expired while the job was running, it was requeued and may run twice: {job_json}")
+
+def requeue_jobs(r, from_processing=None):
+    """
+    Requeue expired leases, or every job left in a processing list
+
+    Returns:
+        int: The number of jobs taken out of leases
+    """
+    keys = [LEASES_KEY, LEASE_OWNERS_KEY, DOWNLOAD_QUEUE_KEY, DEAD_LETTER_KEY]
+    if from_processing:
+        keys.append(from_processing)
+    count, dead = r.eval(_REQUEUE_SCRIPT, len(keys), *keys, time.time(), 100, JOB_MAX_DELIVERIES)
+    for job_json in dead:
+        try:
+            job = json.loads(job_json)
+        except ValueError:
+            job = {}
+        log(f"[LEASE] ❌ Task {job.get('taskId')} was delivered {JOB_MAX_DELIVERIES} times without finishing, moved to {DEAD_LETTER_KEY}")
+        if job.get('taskId'):
+            update_task_status(job['taskId'], 'failed', f"Worker stopped during the job {JOB_MAX_DELIVERIES} times")
+    if count:
+        log(f"[LEASE] Requeued {count - len(dead)} job(s), {len(dead)} dead")
+    return count
+
+def lease_keeper(r, worker_id=1):
+    """Background thread of the worker: heartbeats for its own jobs, and the reaper for everyone's"""
+    while True:
+        time.sleep(JOB_HEARTBEAT_INTERVAL)
+        try:
+            renew_leases(r)
+            requeue_jobs(r)
+        except redis.RedisError as e:
+            log(f"[WORKER #{worker_id}] [LEASE] [REDIS ERROR] {e}")
+
+def process_download(task_data, redis_client=None):
     """
     Main function to process a download task
     ✅ IMPROVED: Task isolation + Smart retry with resume capability + Enrollment check
@@ -528,9 +998,13 @@ def process_download(task_data):
             - taskId (int): Download task ID from MySQL
             - email (str): User email
             - courseUrl (str): Course URL to download
+            - enrollWaitUntil (float): Set when the job was parked to wait for enrollment
+            - deliveries (int): Set when the job was requeued after its worker stopped
+            - useH265 (bool, optional): Encode to H.265, defaults from H265_COURSE_TYPES
+        redis_client: Redis connection to park the job on while enrollment is running
     
     Returns:
-        dict: Processing result with success status
+        dict: Processing result with success status, 'parked' is True if the job waits for enrollment
     """
     task_id = task_data.get('taskId')
     email = task_data.get('email')
@@ -591,32 +1065,42 @@ def process_download(task_data):
     # Use sanitized URL for processing
     course_url = sanitized_url
     
+    # ✅ RESUME: A job requeued after its worker stopped picks up the sandbox + download journal (same host)
+    if task_data.get('deliveries'):
+        log(f"[RESUME] Delivery {task_data['deliveries']} of task {task_id} (previously on {task_data.get('redeliveredFrom')})")
+        previous = read_summary(os.path.join(STAGING_DIR, f"Task_{task_id}"))
+        if previous:
+            log(f"[RESUME] Download journal: {json.dumps({k: v for k, v in previous.items() if k != 'failed_items'})}")
+    
     # ✅ CRITICAL FIX: Check enrollment status before downloading
     log(f"[ENROLL CHECK] Verifying enrollment status for task {task_id}...")
     
-    # Get task info to check if it's admin download
-    conn = None
-    is_admin_download = False
+    # ✅ OPTIMIZED: Load the task context (status, order_id, course_type, ...) once for the whole job
+    task_context = None
     try:
-        conn = get_db_connection()
-        cur = conn.cursor(dictionary=True)
-        cur.execute(
-            "SELECT course_type, order_id FROM download_tasks WHERE id = %s",
-            (task_id,)
-        )
-        task_info = cur.fetchone()
-        if task_info:
-            is_admin_download = (task_info.get('course_type') == 'permanent' and task_info.get('order_id') is None)
+        task_context = load_task_context(task_id)
     except Exception as e:
-        log(f"[ENROLL CHECK] [ERROR] Failed to check admin download status: {e}")
-    finally:
-        if conn:
-            try:
-                conn.close()
-            except:
-                pass
+        log(f"[ENROLL CHECK] [ERROR] Failed to load task {task_id}: {e}")
     
-    is_enrolled, status, error_msg = check_enrollment_status(task_id, max_wait_seconds=15)
+    is_enrolled, status, error_msg = check_enrollment_status(task_id, task=task_context)
+    
+    # ✅ OPTIMIZED: Park the job instead of holding the worker until enrollment finishes
+    if not is_enrolled and status in ('waiting', 'error'):
+        wait_until = task_data.get('enrollWaitUntil') or time.time() + ENROLL_WAIT_TIMEOUT
+        if redis_client is not None and time.time() < wait_until:
+            try:
+                park_job(redis_client, task_data, wait_until)
+                return {
+                    'success': False,
+                    'parked': True,
+                    'taskId': task_id,
+                    'status': status
+                }
+            except redis.RedisError as e:
+                log(f"[ENROLL WAIT] [ERROR] Failed to park task {task_id}: {e}")
+        if status == 'waiting':
+            status = 'timeout'
+            error_msg = f'Task {task_id} enrollment timeout after {ENROLL_WAIT_TIMEOUT}s'
     
     if not is_enrolled:
         # ✅ CRITICAL: Enrollment must succeed before download - no exceptions
@@ -637,31 +1121,14 @@ def process_download(task_data):
     else:
         log(f"[ENROLL CHECK] ✅ Enrollment verified, proceeding with download...")
     
-    # ✅ FIX: Get order_id and course_type for progress tracking (optimized connection handling)
-    order_id = None
-    course_type = 'temporary'  # Default to temporary for backward compatibility
-    conn = None
-    try:
-        conn = get_db_connection()
-        cur = conn.cursor(dictionary=True)
-        cur.execute("SELECT order_id, course_type FROM download_tasks WHERE id = %s", (task_id,))
-        task_row = cur.fetchone()
-        if task_row:
-            order_id = task_row.get('order_id')
-            course_type = task_row.get('course_type', 'temporary')  # Default to temporary if null
-    except Exception as e:
-        log(f"[ERROR] Failed to get order_id and course_type for task {task_id}: {e}")
-        order_id = None
-        course_type = 'temporary'  # Fallback to temporary
-    finally:
-        # ✅ FIX: Only close if not in pool
-        if conn:
-            try:
-                global _db_connection_pool
-                if _db_connection_pool and conn not in _db_connection_pool:
-                    conn.close()
-            except:
-                pass
+    # ✅ FIX: Get order_id and course_type for progress tracking, they don't change while enrollment is pending
+    if task_context is None:
+        try:
+            task_context = load_task_context(task_id)
+        except Exception as e:
+            log(f"[ERROR] Failed to get order_id and course_type for task {task_id}: {e}")
+    order_id = task_context.get('order_id') if task_context else None
+    course_type = task_context.get('course_type', 'temporary') if task_context else 'temporary'  # Fallback to temporary
     
     log(f"[INFO] Course type: {course_type}, Order ID: {order_id}")
     
@@ -669,6 +1136,9 @@ def process_download(task_data):
     if order_id:
         log_info(task_id, order_id, 'Enrollment verified, starting download', category='enrollment')
     
+    # ✅ SLOTS: Encoding jobs also take a CPU slot while they download
+    use_h265 = bool(task_data.get('useH265', course_type in H265_COURSE_TYPES))
+    
     # ✅ FIX: Create task-specific sandbox directory
     task_sandbox = os.path.join(STAGING_DIR, f"Task_{task_id}")
     os.makedirs(task_sandbox, exist_ok=True)
@@ -720,6 +1190,18 @@ def process_download(task_data):
                 "--continue-lecture-numbers"
             ]
             
+            # ✅ Temporary courses pick the best quality that fits their size budget
+            if course_type == 'temporary':
+                if TEMPORARY_MAX_BYTES_PER_MINUTE:
+                    cmd += ["--max-bytes-per-minute", TEMPORARY_MAX_BYTES_PER_MINUTE]
+                if TEMPORARY_SIZE_BUDGET:
+                    cmd += ["--size-budget", TEMPORARY_SIZE_BUDGET]
+                if TEMPORARY_MAX_BYTES_PER_MINUTE or TEMPORARY_SIZE_BUDGET:
+                    log(f"[INFO] Size budget: {TEMPORARY_MAX_BYTES_PER_MINUTE or '-'}/min, {TEMPORARY_SIZE_BUDGET or '-'} per course")
+            if use_h265:
+                cmd.append("--use-h265")
+                log(f"[INFO] Encoding to H.265")
+            
             # ✅ SECURITY: Log command without token (for security)
             cmd_safe = cmd.copy()
             if len(cmd_safe) > 3 and cmd_safe[2] == "-b":
@@ -733,8 +1215,8 @@ def process_download(task_data):
             
             # ✅ FIX: Set environment variable so main.py can write to task log file
             # This ensures ALL logs (stdout, stderr, logging module) go to task log file
-            os.environ['TASK_LOG_FILE'] = task_log_path
-            os.environ['TASK_ID'] = str(task_id)
+            # Per job (not os.environ), other slots of this worker run jobs of their own
+            job_env = dict(os.environ, TASK_LOG_FILE=task_log_path, TASK_ID=str(task_id))
             
             # ✅ EMIT: Download in progress (simulated - main.py doesn't report progress yet)
             # Note: For real progress, we'd need to modify main.py to emit progress events
@@ -751,95 +1233,111 @@ def process_download(task_data):
                 header = f"\n{'='*60}\n[{datetime.now().isoformat()}] Starting download for task {task_id}\nCommand: {' '.join(cmd)}\n{'='*60}\n"
                 tee.write(header)
                 
-                # ✅ SECURITY: Run subprocess with output duplicated to both stdout and task log file
-                # ✅ SECURITY: Use subprocess.run() with timeout and proper error handling
-                # ✅ SECURITY: Process is killed automatically on timeout
-                process = None
-                try:
-                    process = subprocess.Popen(
-                        cmd,
-                        stdout=tee,  # TeeWriter will duplicate to both stdout and file
-                        stderr=subprocess.STDOUT,  # Merge stderr to stdout
-                        text=True,
-                        cwd=os.path.dirname(__file__)  # Run from udemy_dl directory
-                    )
+                # ✅ SLOTS: Course downloads share the network slots, encoding ones the CPU slots too
+                download_resources = ['network', 'cpu'] if use_h265 else ['network']
+                with hold_resources(task_id, *download_resources):
+                    if DOWNLOAD_MODE in ('forkserver', 'inprocess'):
+                        # ✅ PERF: No interpreter start / imports / tool probes per attempt
+                        run_download_job(cmd, cmd_safe, task_id, task_log_path)
+                    else:
+                        # ✅ SECURITY: Run subprocess with output duplicated to both stdout and task log file
+                        # ✅ SECURITY: Use subprocess.run() with timeout and proper error handling
+                        # ✅ SECURITY: Process is killed automatically on timeout
+                        process = None
+                        try:
+                            process = subprocess.Popen(
+                                cmd,
+                                stdout=tee,  # TeeWriter will duplicate to both stdout and file
+                                stderr=subprocess.STDOUT,  # Merge stderr to stdout
+                                text=True,
+                                cwd=os.path.dirname(__file__),  # Run from udemy_dl directory
+                                env=job_env
+                            )
                     
-                    # Wait for process with timeout
-                    try:
-                        return_code = process.wait(timeout=DOWNLOAD_TIMEOUT)
+                            # Wait for process with timeout
+                            try:
+                                return_code = process.wait(timeout=DOWNLOAD_TIMEOUT)
                         
-                        if return_code != 0:
-                            error_msg = f"Process failed with exit code {return_code}"
-                            log(f"[ERROR] {error_msg}")
-                            output_error_json(task_id, 'PROCESS_ERROR', error_msg, {
-                                'exit_code': return_code,
-                                'command': ' '.join(cmd_safe)
-                            })
-                            raise subprocess.CalledProcessError(return_code, cmd)
+                                if return_code != 0:
+                                    error_msg = f"Process failed with exit code {return_code}"
+                                    log(f"[ERROR] {error_msg}")
+                                    output_error_json(task_id, 'PROCESS_ERROR', error_msg, {
+                                        'exit_code': return_code,
+                                        'command': ' '.join(cmd_safe)
+                                    })
+                                    raise subprocess.CalledProcessError(return_code, cmd)
                     
-                    except subprocess.TimeoutExpired:
-                        # ✅ SECURITY: Kill process on timeout to prevent resource leaks
-                        log(f"[TIMEOUT] Download exceeded {DOWNLOAD_TIMEOUT}s timeout, killing process...")
-                        output_error_json(task_id, 'TIMEOUT_ERROR', 
-                                        f'Download exceeded {DOWNLOAD_TIMEOUT}s timeout', {
-                                            'timeout_seconds': DOWNLOAD_TIMEOUT
-                                        })
+                            except subprocess.TimeoutExpired:
+                                # ✅ SECURITY: Kill process on timeout to prevent resource leaks
+                                log(f"[TIMEOUT] Download exceeded {DOWNLOAD_TIMEOUT}s timeout, killing process...")
+                                output_error_json(task_id, 'TIMEOUT_ERROR', 
+                                                f'Download exceeded {DOWNLOAD_TIMEOUT}s timeout', {
+                                                    'timeout_seconds': DOWNLOAD_TIMEOUT
+                                                })
                         
-                        # ✅ SECURITY: Force kill process and its children
-                        try:
-                            process.kill()
-                            process.wait(timeout=5)
-                        except:
-                            try:
-                                # Kill process group to ensure all child processes are terminated
-                                if hasattr(os, 'getpgid') and hasattr(os, 'killpg'):
-                                    os.killpg(os.getpgid(process.pid), signal.SIGKILL)
-                                else:
-                                    # Fallback for Windows
+                                # ✅ SECURITY: Force kill process and its children
+                                try:
                                     process.kill()
-                            except:
-                                pass
+                                    process.wait(timeout=5)
+                                except:
+                                    try:
+                                        # Kill process group to ensure all child processes are terminated
+                                        if hasattr(os, 'getpgid') and hasattr(os, 'killpg'):
+                                            os.killpg(os.getpgid(process.pid), signal.SIGKILL)
+                                        else:
+                                            # Fallback for Windows
+                                            process.kill()
+                                    except:
+                                        pass
                         
-                        raise subprocess.TimeoutExpired(cmd, DOWNLOAD_TIMEOUT)
+                                raise subprocess.TimeoutExpired(cmd, DOWNLOAD_TIMEOUT)
                     
-                except subprocess.CalledProcessError as e:
-                    error_msg = f"Process failed with exit code {e.returncode}"
-                    log(f"[ERROR] {error_msg}")
-                    output_error_json(task_id, 'PROCESS_ERROR', error_msg, {
-                        'exit_code': e.returncode
-                    })
-                    raise
-                except subprocess.TimeoutExpired:
-                    # Already handled above, re-raise
-                    raise
-                except Exception as e:
-                    error_msg = f"Subprocess error: {str(e)}"
-                    log(f"[ERROR] {error_msg}")
-                    output_error_json(task_id, 'SUBPROCESS_ERROR', error_msg, {
-                        'exception_type': type(e).__name__
-                    })
-                    raise
-                finally:
-                    # ✅ SECURITY: Ensure process is terminated
-                    if process and process.poll() is None:
-                        try:
-                            process.terminate()
-                            process.wait(timeout=5)
-                        except:
-                            try:
-                                process.kill()
-                            except:
-                                pass
+                        except subprocess.CalledProcessError as e:
+                            error_msg = f"Process failed with exit code {e.returncode}"
+                            log(f"[ERROR] {error_msg}")
+                            output_error_json(task_id, 'PROCESS_ERROR', error_msg, {
+                                'exit_code': e.returncode
+                            })
+                            raise
+                        except subprocess.TimeoutExpired:
+                            # Already handled above, re-raise
+                            raise
+                        except Exception as e:
+                            error_msg = f"Subprocess error: {str(e)}"
+                            log(f"[ERROR] {error_msg}")
+                            output_error_json(task_id, 'SUBPROCESS_ERROR', error_msg, {
+                                'exception_type': type(e).__name__
+                            })
+                            raise
+                        finally:
+                            # ✅ SECURITY: Ensure process is terminated
+                            if process and process.poll() is None:
+                                try:
+                                    process.terminate()
+                                    process.wait(timeout=5)
+                                except:
+                                    try:
+                                        process.kill()
+                                    except:
+                                        pass
             
             # ✅ EMIT: Download completed
             emit_progress(task_id, order_id, percent=70, current_file="Download completed, preparing upload...")
             
+            # ✅ RESUME: Completion summary from the download journal (items a retry would skip / re-fetch)
+            journal_summary = read_summary(task_sandbox)
+            if journal_summary:
+                log(f"[JOURNAL] {json.dumps({k: v for k, v in journal_summary.items() if k != 'failed_items'})}")
+                for item in journal_summary.get('failed_items', []):
+                    log(f"[JOURNAL] Incomplete {item['kind']}: {item['path']} ({item['error']})")
+            
             # ✅ UNIFIED LOGGER: Log download completed
             if order_id:
                 download_duration = int(time.time() - download_start_time)
                 log_progress(task_id, order_id, 70, "Download completed, preparing upload...", {
                     'duration': download_duration,
-                    'attempt': attempt
+                    'attempt': attempt,
+                    'journal': journal_summary
                 })
             
             # Check for output folder
@@ -1056,13 +1554,66 @@ def process_download(task_data):
 
 # ================= 4. REDIS QUEUE CONSUMER =================
 
+def handle_job(r, worker_id, queue_name, job_json):
+    """Run one job popped from the queue, on a job slot of the worker"""
+    log(f"[WORKER #{worker_id}] Received job from {queue_name}")
+    
+    # Parse job data
+    try:
+        job_data = json.loads(job_json)
+        log(f"[WORKER #{worker_id}] Job data: {job_data}")
+        
+        # Process the download
+        result = process_download(job_data, redis_client=r)
+        
+        if result.get('parked'):
+            log(f"[WORKER #{worker_id}] ⏸️ Job parked until enrollment: Task {job_data.get('taskId')}")
+        elif result['success']:
+            log(f"[WORKER #{worker_id}] ✅ Job completed: Task {job_data.get('taskId')}")
+        else:
+            log(f"[WORKER #{worker_id}] ❌ Job failed: Task {job_data.get('taskId')}")
+        
+        # ✅ METRICS: Connection wait / query latency, also readable from Redis by the backend
+        log(f"[WORKER #{worker_id}] [DB] {format_db_metrics()}")
+        try:
+            r.hset(f"worker:{worker_id}:db_metrics", mapping={
+                k: round(v, 4) if isinstance(v, float) else v for k, v in get_db_metrics().items()
+            })
+        except redis.RedisError:
+            pass
+            
+    except json.JSONDecodeError as e:
+        log(f"[WORKER #{worker_id}] [ERROR] Invalid job JSON: {e}")
+        # Update task status if we have taskId
+        try:
+            job_data_parsed = json.loads(job_json) if job_json else {}
+            task_id = job_data_parsed.get('taskId')
+            if task_id:
+                update_task_status(task_id, 'failed', f'Invalid job JSON: {str(e)}')
+        except:
+            pass
+    except Exception as e:
+        import traceback
+        error_trace = traceback.format_exc()
+        log(f"[WORKER #{worker_id}] [ERROR] Processing failed: {e}")
+        log(f"[WORKER #{worker_id}] [ERROR] Traceback: {error_trace}")
+        
+        # ✅ FIX: Update task status on processing error
+        try:
+            job_data_parsed = json.loads(job_json) if job_json else {}
+            task_id = job_data_parsed.get('taskId')
+            if task_id:
+                update_task_status(task_id, 'failed', f'Worker processing error: {str(e)}\n{error_trace}')
+        except:
+            pass
+
 def start_worker(worker_id=1):
     """
     Start Redis queue consumer
-    Continuously polls Redis list for jobs and processes them
+    Continuously polls Redis list for jobs and processes them, up to WORKER_SLOTS at a time
     """
     log(f">>> REDIS WORKER #{worker_id} STARTED <<<")
-    log(f"Listening to queue: rq:queue:downloads")
+    log(f"Listening to queue: {DOWNLOAD_QUEUE_KEY}")
     
     # Connect to Redis
     redis_host = os.getenv('REDIS_HOST', 'localhost')
@@ -1087,56 +1638,52 @@ def start_worker(worker_id=1):
         log(f"[REDIS ERROR] Cannot connect: {e}")
         sys.exit(1)
     
-    queue_key = 'rq:queue:downloads'
+    queue_key = DOWNLOAD_QUEUE_KEY
+    # ✅ RELIABLE: Jobs are moved to this worker's processing list and leased while they run
+    consumer = f"{socket.gethostname()}:{worker_id}"
+    recovered = requeue_jobs(r, from_processing=processing_key(consumer))
+    if recovered:
+        log(f"[WORKER #{worker_id}] [LEASE] Requeued {recovered} job(s) a previous run of this worker didn't finish")
+    threading.Thread(target=lease_keeper, args=(r, worker_id), name='lease-keeper', daemon=True).start()
+    
+    # ✅ Wake jobs parked for enrollment as soon as the Node.js enrollment flow publishes the result
+    threading.Thread(target=enrollment_listener, args=(r, worker_id), name='enroll-listener', daemon=True).start()
+    
+    log(f"[WORKER #{worker_id}] {WORKER_SLOTS} job slot(s), resource slots: {RESOURCE_SLOTS}")
+    if WORKER_SLOTS > 1 and DOWNLOAD_MODE == 'inprocess':
+        log(f"[WORKER #{worker_id}] [WARN] DOWNLOAD_MODE=inprocess runs one download at a time, use forkserver for parallel downloads")
+    
+    # ✅ SLOTS: Jobs run on a thread pool, a job is only popped when a slot is free (the rest stay for other workers)
+    free_slots = threading.BoundedSemaphore(WORKER_SLOTS)
+    executor = ThreadPoolExecutor(max_workers=WORKER_SLOTS, thread_name_prefix='job')
+    
+    def run_in_slot(job_json):
+        try:
+            handle_job(r, worker_id, queue_key, job_json)
+        finally:
+            try:
+                ack_job(r, consumer, job_json)
+            except redis.RedisError as e:
+                log(f"[WORKER #{worker_id}] [LEASE] [REDIS ERROR] Failed to ack job, it will be requeued: {e}")
+            free_slots.release()
     
     # Main worker loop
     while True:
         try:
-            # Block and wait for job (BRPOP - blocking right pop)
+            if not free_slots.acquire(timeout=5):
+                continue
+            
+            # Block and wait for job (BLMOVE - blocking right pop into the processing list)
             # Timeout: 5 seconds
-            result = r.brpop(queue_key, timeout=5)
+            job_json = None
+            try:
+                job_json = pop_job(r, consumer, timeout=5)
+            finally:
+                if not job_json:
+                    free_slots.release()
             
-            if result:
-                queue_name, job_json = result
-                log(f"[WORKER #{worker_id}] Received job from {queue_name}")
-                
-                # Parse job data
-                try:
-                    job_data = json.loads(job_json)
-                    log(f"[WORKER #{worker_id}] Job data: {job_data}")
-                    
-                    # Process the download
-                    result = process_download(job_data)
-                    
-                    if result['success']:
-                        log(f"[WORKER #{worker_id}] ✅ Job completed: Task {job_data.get('taskId')}")
-                    else:
-                        log(f"[WORKER #{worker_id}] ❌ Job failed: Task {job_data.get('taskId')}")
-                        
-                except json.JSONDecodeError as e:
-                    log(f"[WORKER #{worker_id}] [ERROR] Invalid job JSON: {e}")
-                    # Update task status if we have taskId
-                    try:
-                        job_data_parsed = json.loads(job_json) if job_json else {}
-                        task_id = job_data_parsed.get('taskId')
-                        if task_id:
-                            update_task_status(task_id, 'failed', f'Invalid job JSON: {str(e)}')
-                    except:
-                        pass
-                except Exception as e:
-                    import traceback
-                    error_trace = traceback.format_exc()
-                    log(f"[WORKER #{worker_id}] [ERROR] Processing failed: {e}")
-                    log(f"[WORKER #{worker_id}] [ERROR] Traceback: {error_trace}")
-                    
-                    # ✅ FIX: Update task status on processing error
-                    try:
-                        job_data_parsed = json.loads(job_json) if job_json else {}
-                        task_id = job_data_parsed.get('taskId')
-                        if task_id:
-                            update_task_status(task_id, 'failed', f'Worker processing error: {str(e)}\n{error_trace}')
-                    except:
-                        pass
+            if job_json:
+                executor.submit(run_in_slot, job_json)
             else:
                 # No job available (timeout), continue waiting
                 pass
@@ -1158,6 +1705,8 @@ def start_worker(worker_id=1):
             log(f"[WORKER #{worker_id}] [ERROR] Unexpected error: {e}")
             time.sleep(5)
     
+    log(f"[WORKER #{worker_id}] Waiting for running jobs to finish...")
+    executor.shutdown(wait=True)
     log(f"[WORKER #{worker_id}] Worker stopped.")
 
 # ================= 5. MAIN ENTRY POINT =================